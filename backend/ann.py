@@ -0,0 +1,122 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from typing import List, Tuple, Optional
+
+# Libraries smaller than this are always searched exactly
+ANN_MIN_SIZE = 4096
+
+# Default number of inverted lists probed per query (recall/latency knob)
+DEFAULT_NPROBE = 8
+
+
+def _to_tensor(block: np.ndarray) -> torch.Tensor:
+    """Convert a (possibly memory-mapped) block to a float32 tensor"""
+    return torch.from_numpy(np.array(block, dtype=np.float32))
+
+
+def assign_lists(matrix: np.ndarray, centroids: torch.Tensor, chunk_size: int = 65536) -> np.ndarray:
+    """Return the nearest centroid of every row, processed in chunks"""
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), chunk_size):
+        block = _to_tensor(matrix[start:start + chunk_size])
+        assignments[start:start + len(block)] = (block @ centroids.T).argmax(dim=1).numpy()
+    return assignments
+
+
+def train_centroids(matrix: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> torch.Tensor:
+    """Train nlist unit-norm centroids with spherical k-means on a sample of rows"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * 256)
+    sample_ids = np.sort(rng.choice(len(matrix), sample_size, replace=False))
+    sample = F.normalize(_to_tensor(matrix[sample_ids]), dim=1)
+
+    centroids = sample[torch.from_numpy(rng.choice(sample_size, nlist, replace=False))]
+    for _ in range(iterations):
+        assignments = (sample @ centroids.T).argmax(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, sample)
+        counts = torch.bincount(assignments, minlength=nlist)
+        # Keep the previous centroid for empty lists
+        empty = counts == 0
+        sums[empty] = centroids[empty]
+        centroids = F.normalize(sums, dim=1)
+    return centroids
+
+
+class IVFIndex:
+    """
+    IVF-flat approximate nearest neighbour index over an embedding matrix.
+    Rows are bucketed by their nearest centroid; a query only scores the
+    rows of the nprobe closest buckets.
+    """
+
+    def __init__(self, centroids: torch.Tensor, assignments: np.ndarray):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.trained_size = len(assignments)
+        self._lists: Optional[List[np.ndarray]] = None
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int = None) -> "IVFIndex":
+        """Train centroids and bucket every row of the matrix"""
+        if nlist is None:
+            nlist = max(1, int(np.sqrt(len(matrix))))
+        centroids = train_centroids(matrix, nlist)
+        return cls(centroids, assign_lists(matrix, centroids))
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.assignments)
+
+    def needs_rebuild(self) -> bool:
+        """Rebuild once the library has grown well past the training size"""
+        return len(self) > 4 * max(self.trained_size, ANN_MIN_SIZE)
+
+    def add(self, vectors: np.ndarray):
+        """Append rows for new vectors"""
+        self.assignments = np.concatenate([self.assignments, assign_lists(vectors, self.centroids)])
+        self._lists = None
+
+    def select(self, keep: List[int]):
+        """Keep only the given rows, renumbering them in order"""
+        self.assignments = self.assignments[keep]
+        self._lists = None
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(self.nlist + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+        return self._lists
+
+    def candidates(self, query: torch.Tensor, nprobe: int = DEFAULT_NPROBE) -> np.ndarray:
+        """Return the sorted row ids in the nprobe lists closest to the query"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        probe = torch.topk(self.centroids @ query.float(), nprobe).indices.tolist()
+        lists = self._inverted_lists()
+        return np.sort(np.concatenate([lists[i] for i in probe]))
+
+    def search(self, matrix: np.ndarray, query: torch.Tensor, k: int, nprobe: int = DEFAULT_NPROBE) -> Tuple[np.ndarray, torch.Tensor]:
+        """Return the ids and cosine scores of the approximate top-k rows"""
+        ids = self.candidates(query, nprobe)
+        if len(ids) == 0:
+            return ids, torch.empty(0)
+        scores = _to_tensor(matrix[ids]) @ query.float()
+        values, order = torch.topk(scores, min(k, len(ids)))
+        return ids[order.numpy()], values
+
+    def save(self, path):
+        """Write centroids and assignments to an .npz file"""
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids.numpy(), assignments=self.assignments,
+                     trained_size=np.array(self.trained_size))
+
+    @classmethod
+    def load(cls, path) -> "IVFIndex":
+        data = np.load(path)
+        index = cls(torch.from_numpy(data["centroids"]), data["assignments"])
+        index.trained_size = int(data["trained_size"])
+        return index
@@ -0,0 +1,683 @@
+"""
+Benchmarks for the search pipeline
+
+Usage:
+    python -m backend.benchmark recall [--folder PATH] [--size N] [--k K] [--nprobe 1 4 8 16]
+    python -m backend.benchmark decode [--folder PATH] [--count N] [--workers 1 4 8]
+    python -m backend.benchmark drift [--folder PATH] [--count N] [--max-drift 0.02]
+    python -m backend.benchmark coldstart [--formats torch torchscript onnx]
+    python -m backend.benchmark precision [--folder PATH] [--size N] [--k K]
+    python -m backend.benchmark duplicates [--size N] [--duplicates N] [--threshold 0.95]
+    python -m backend.benchmark scan [--folder PATH] [--dirs N] [--files N] [--workers 1 8 32]
+    python -m backend.benchmark pipeline [--folder PATH] [--count N] [--batch-sizes 16 32 64] [--workers 1 4]
+    python -m backend.benchmark memory [--dirs N] [--files N] [--searches N] [--max-rss-mb 512]
+    python -m backend.benchmark tiles [--folder PATH] [--count N] [--levels 0 2 2,3]
+"""
+import os
+import sys
+import json
+import argparse
+import itertools
+import subprocess
+import asyncio
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn.functional as F
+from pathlib import Path
+from PIL import Image
+from .ann import IVFIndex, ANN_MIN_SIZE
+from .duplicates import find_duplicates
+from .index import EmbeddingIndex, INDEX_ROOT, get_index, scan_folder
+from .clip_utils import (
+    load_model, decode_image_batch, iter_image_batches, load_image_tensor, encode_image_batch,
+    get_image_embedding, encode_texts
+)
+from .metrics import metrics, current_rss
+from . import scanner
+from .scanner import ListingCache, iter_scan, SUPPORTED_FORMATS
+
+
+def synthetic_embeddings(size: int, dim: int = 512, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Generate clustered unit-norm embeddings that roughly mimic CLIP image embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    return F.normalize(torch.from_numpy(vectors), dim=1).numpy()
+
+
+def make_corpus(folder: str, count: int, width: int = 1920, height: int = 1280, seed: int = 0) -> str:
+    """Write a synthetic corpus of JPEG images with random gradients and noise"""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    for i in range(count):
+        path = os.path.join(folder, f"synthetic_{i:06d}.jpg")
+        if os.path.exists(path):
+            continue
+        r, g, b = rng.random(3)
+        pixels = np.stack([
+            (x / width * 255 * r),
+            (y / height * 255 * g),
+            ((x + y) / (width + height) * 255 * b)
+        ], axis=-1)
+        pixels += rng.normal(0, 12, pixels.shape)
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=90)
+    return folder
+
+
+def bench_recall(args):
+    """Compare ANN recall@k and latency against the exact search"""
+    if args.folder:
+        index = get_index(args.folder)
+        matrix = np.concatenate([block.numpy() for _, block in index.iter_chunks()])
+    else:
+        matrix = synthetic_embeddings(args.size)
+    print(f"Library: {len(matrix)} embeddings")
+
+    start = time.perf_counter()
+    ann = IVFIndex.build(matrix, args.nlist)
+    print(f"Built IVF index with {ann.nlist} lists in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(1)
+    query_ids = rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)
+    queries = torch.from_numpy(matrix[query_ids])
+    vectors = torch.from_numpy(matrix)
+
+    start = time.perf_counter()
+    exact = [set(torch.topk(vectors @ q, args.k).indices.tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"exact      latency {exact_ms:8.2f} ms/query")
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        found = [set(ann.search(matrix, q, args.k, nprobe)[0].tolist()) for q in queries]
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+        print(f"nprobe={nprobe:<4} latency {ann_ms:8.2f} ms/query  recall@{args.k} {recall:.3f}")
+
+
+def bench_decode(args):
+    """Compare the threads and processes decode backends"""
+    folder = args.folder or make_corpus(os.path.join(tempfile.gettempdir(), "clip_bench_corpus"), args.count)
+    paths = [path for path, _, _ in scan_folder(folder)][:args.count]
+    model, preprocess = load_model()
+    print(f"Corpus: {len(paths)} images in {folder}")
+
+    async def decode_only(backend, workers):
+        for i in range(0, len(paths), args.batch_size):
+            await decode_image_batch(paths[i:i + args.batch_size], preprocess, backend, workers)
+
+    async def pipeline(backend, workers):
+        async for _ in iter_image_batches(paths, model, preprocess, args.batch_size, args.prefetch, backend, workers):
+            pass
+
+    for backend in ["threads", "processes"]:
+        for workers in args.workers:
+            # Warm up so process start-up is not measured
+            if backend == "processes":
+                asyncio.run(decode_only(backend, workers))
+            results = []
+            for run in (decode_only, pipeline):
+                start = time.perf_counter()
+                asyncio.run(run(backend, workers))
+                results.append(len(paths) / (time.perf_counter() - start))
+            print(f"{backend:<10} workers={workers:<3} decode {results[0]:8.1f} img/s  decode+encode {results[1]:8.1f} img/s")
+
+
+def bench_drift(args):
+    """Compare reduced-resolution decoding against full decoding: speed and embedding drift"""
+    folder = args.folder or make_corpus(
+        os.path.join(tempfile.gettempdir(), f"clip_bench_corpus_{args.width}x{args.height}"),
+        args.count, args.width, args.height
+    )
+    paths = [path for path, _, _ in scan_folder(folder)][:args.count]
+    model, preprocess = load_model()
+    print(f"Corpus: {len(paths)} images in {folder}")
+
+    embeddings = {}
+    for name, target_size in [("full", 0), ("reduced", args.target_size)]:
+        start = time.perf_counter()
+        inputs = [load_image_tensor(path, preprocess, target_size) for path in paths]
+        elapsed = time.perf_counter() - start
+        embeddings[name] = encode_image_batch(torch.stack(inputs), model)
+        print(f"{name:<8} decode {len(paths) / elapsed:8.1f} img/s")
+
+    drift = 1 - (embeddings["full"] * embeddings["reduced"]).sum(dim=1)
+    print(f"cosine drift: mean {drift.mean().item():.5f}  max {drift.max().item():.5f}")
+    if drift.max().item() > args.max_drift:
+        print(f"FAIL: drift above {args.max_drift}")
+        sys.exit(1)
+
+
+def bench_precision(args):
+    """Compare float32, float16 and int8 storage: memory per image, query latency and top-k overlap"""
+    if args.folder:
+        matrix = np.concatenate([block.numpy() for _, block in get_index(args.folder).iter_chunks()])
+    else:
+        matrix = synthetic_embeddings(args.size)
+    embeddings = torch.from_numpy(matrix)
+    paths = [f"image_{i}" for i in range(len(matrix))]
+    print(f"Library: {len(matrix)} embeddings")
+
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)]
+
+    def search(index, query):
+        # Same path as /search: score the stored matrix chunk by chunk
+        scores = torch.cat([block_scores for _, block_scores, _ in index.iter_scores(query)])
+        return set(torch.topk(scores, args.k).indices.tolist())
+
+    exact = None
+    for dtype in ["float32", "float16", "int8"]:
+        # In-memory index: the folder name only has to be unique
+        index = EmbeddingIndex(os.path.join(tempfile.gettempdir(), f"clip_bench_precision_{dtype}"), dtype)
+        index.add(paths, embeddings)
+        index.row_count()
+        nbytes = index.matrix.nbytes + (index.scales.nbytes if index.scales is not None else 0)
+
+        start = time.perf_counter()
+        found = [search(index, q) for q in queries]
+        latency = (time.perf_counter() - start) * 1000 / len(queries)
+        if exact is None:
+            exact = found
+        overlap = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+        print(f"{dtype:<8} {nbytes / len(matrix):7.1f} bytes/image  latency {latency:8.2f} ms/query  top-{args.k} overlap {overlap:.3f}")
+
+
+def bench_duplicates(args):
+    """Time duplicate detection and check that planted near-duplicates are found"""
+    matrix = synthetic_embeddings(args.size)
+    rng = np.random.default_rng(2)
+    sources = rng.choice(args.size, args.duplicates, replace=False)
+    targets = rng.choice(np.setdiff1d(np.arange(args.size), sources), args.duplicates, replace=False)
+    noisy = matrix[sources] + args.noise * rng.standard_normal((args.duplicates, matrix.shape[1])).astype(np.float32)
+    matrix[targets] = F.normalize(torch.from_numpy(noisy), dim=1).numpy()
+    matrix = matrix.astype(np.float16)
+    paths = [str(i) for i in range(args.size)]
+    print(f"Library: {args.size} embeddings with {args.duplicates} planted near-duplicates")
+
+    modes = ["ann"] + (["exact"] if args.size <= args.max_exact else [])
+    for mode in modes:
+        start = time.perf_counter()
+        ann = IVFIndex.build(matrix) if mode == "ann" and args.size >= ANN_MIN_SIZE else None
+        clusters = find_duplicates(matrix, None, paths, args.threshold, ann, args.nprobe)
+        elapsed = time.perf_counter() - start
+        cluster_of = {}
+        for number, cluster in enumerate(clusters):
+            for member in cluster["paths"]:
+                cluster_of[int(member["path"])] = number
+        found = np.mean([
+            source in cluster_of and cluster_of.get(source) == cluster_of.get(target)
+            for source, target in zip(sources, targets)
+        ])
+        print(f"{mode:<6} {elapsed:8.1f}s  {len(clusters)} clusters  planted pairs found {found:.3f}")
+
+
+# Run in a fresh interpreter per model format so nothing is cached
+COLDSTART_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import torch
+torch_imported = time.perf_counter()
+import backend.main
+imported = time.perf_counter()
+from backend.clip_utils import load_model, encode_image_batch
+model, preprocess = load_model()
+loaded = time.perf_counter()
+inputs = torch.randn({batch_size}, 3, 224, 224)
+encode_image_batch(inputs, model)
+first = time.perf_counter()
+for _ in range({runs}):
+    encode_image_batch(inputs, model)
+done = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "torch": torch_imported - start,
+    "load": loaded - imported,
+    "first_batch": first - loaded,
+    "throughput": {batch_size} * {runs} / (done - first)
+}}))
+"""
+
+
+def bench_coldstart(args):
+    """Measure server import time (and the share of import torch), model load time and CPU throughput per model format"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = COLDSTART_SCRIPT.format(batch_size=args.batch_size, runs=args.runs)
+    for model_format in args.formats:
+        env = dict(os.environ, CLIP_MODEL_FORMAT=model_format)
+        if args.cpu:
+            env["CUDA_VISIBLE_DEVICES"] = ""
+        result = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+            print(f"{model_format:<12} unavailable: {error}")
+            continue
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"{model_format:<12} import {timings['import']:6.2f}s (torch {timings['torch']:5.2f}s)  load {timings['load']:6.2f}s  "
+            f"first batch {timings['first_batch']:6.2f}s  {timings['throughput']:8.1f} img/s"
+        )
+
+
+def make_tree(folder: str, dirs: int, files: int) -> str:
+    """Write a tree of dirs directories holding files empty .jpg files each (for scan timing only)"""
+    for d in range(dirs):
+        directory = os.path.join(folder, f"d{d // 100:03d}", f"d{d:05d}")
+        if os.path.isdir(directory):
+            continue
+        os.makedirs(directory)
+        for i in range(files):
+            open(os.path.join(directory, f"img{i:05d}.jpg"), "wb").close()
+    return folder
+
+
+def bench_scan(args):
+    """Compare os.walk scanning with the parallel scandir scanner, cold and with cached listings"""
+    folder = os.path.abspath(args.folder or make_tree(
+        os.path.join(tempfile.gettempdir(), "clip_bench_tree"), args.dirs, args.files
+    ))
+
+    start = time.perf_counter()
+    count = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if os.path.splitext(name)[1].lower() in SUPPORTED_FORMATS:
+                os.stat(os.path.join(root, name))
+                count += 1
+    print(f"os.walk                {time.perf_counter() - start:8.3f}s  {count} images")
+
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            scanner.scan_pool = ThreadPoolExecutor(max_workers=workers)
+            cache = ListingCache(Path(cache_dir) / "listings.json")
+            for label in ["cold", "cached"]:
+                start = time.perf_counter()
+                found = sum(len(files) for files in iter_scan(folder, cache))
+                print(f"scandir workers={workers:<3} {label:<6} {time.perf_counter() - start:8.3f}s  {found} images")
+
+
+def run_searches(folder: str, batch_size: int, runs: int, query_text: str):
+    """
+    Run one cold image search (everything encoded) and then warm image and text
+    searches through the server's search pipeline; prints the timings as JSON
+    """
+    from . import main as server
+    from .progress import ProgressChannel
+    from .scheduler import scheduler
+
+    # Keep the benchmark out of the user's last settings
+    server.SETTINGS_FILE = str(INDEX_ROOT / "settings.json")
+    model, preprocess = load_model()
+    paths = [path for path, _, _ in scan_folder(folder)]
+
+    async def search(search_type):
+        search_id = str(uuid.uuid4())
+        server.search_progress[search_id] = ProgressChannel({'progress': 0})
+        start = time.perf_counter()
+        with metrics.time("query"):
+            if search_type == "image":
+                query_embedding = get_image_embedding(paths[0], model, preprocess)
+            else:
+                query_embedding = encode_texts([query_text], model)[0]
+        scheduler.try_admit()
+        await server.process_search(
+            search_id, [folder], query_embedding, model, preprocess, 0.0, batch_size, search_type,
+            query_text=query_text if search_type == "text" else None, query_path=paths[0]
+        )
+        error = server.search_progress.pop(search_id).get('error')
+        if error:
+            raise RuntimeError(error)
+        return time.perf_counter() - start
+
+    async def run():
+        metrics.track_rss = True
+        scheduler.start(model)
+        cold = await search("image")
+        cold_stages = metrics.summary()
+        metrics.reset()
+        latencies = {"image": [], "text": []}
+        for _ in range(runs):
+            for search_type in latencies:
+                latencies[search_type].append(await search(search_type))
+        await scheduler.stop()
+        return {
+            "images": len(paths),
+            "cold_seconds": cold,
+            "cold_stages": cold_stages,
+            "latencies": latencies,
+            "warm_stages": metrics.summary()
+        }
+
+    print(json.dumps(asyncio.run(run())))
+
+
+# Run in a fresh interpreter per configuration with an empty index
+PIPELINE_SCRIPT = "from backend.benchmark import run_searches; run_searches({folder!r}, {batch_size}, {runs}, {query!r})"
+
+
+def print_stages(title: str, stages: dict):
+    print(f"  {title:<12} {'count':>7} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'peak RSS MB':>12}")
+    for stage, row in stages.items():
+        rate = f"{row['items_per_sec']:.1f}" if row["items_per_sec"] is not None else "-"
+        rss = f"{row['peak_rss_mb']:.1f}" if row["peak_rss_mb"] is not None else "-"
+        print(f"  {stage:<12} {row['count']:>7} {rate:>10} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {rss:>12}")
+
+
+def bench_pipeline(args):
+    """Time image and text searches end to end on CPU across batch sizes and decode worker counts"""
+    folder = os.path.abspath(args.folder or make_corpus(
+        os.path.join(tempfile.gettempdir(), "clip_bench_corpus"), args.count
+    ))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for batch_size in args.batch_sizes:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as index_dir:
+                env = dict(os.environ, CLIP_INDEX_DIR=index_dir, CLIP_DECODE_WORKERS=str(workers), CUDA_VISIBLE_DEVICES="")
+                script = PIPELINE_SCRIPT.format(folder=folder, batch_size=batch_size, runs=args.runs, query=args.query)
+                result = subprocess.run(
+                    [sys.executable, "-c", script],
+                    cwd=root, env=env, capture_output=True, text=True
+                )
+            if result.returncode != 0:
+                error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+                print(f"batch={batch_size:<4} workers={workers:<3} failed: {error}")
+                continue
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            run.update(batch_size=batch_size, workers=workers)
+            results.append(run)
+
+            latency = "  ".join(
+                f"{search_type} p50 {np.percentile(times, 50) * 1000:7.1f} ms p95 {np.percentile(times, 95) * 1000:7.1f} ms"
+                for search_type, times in run["latencies"].items()
+            )
+            print(f"batch={batch_size:<4} workers={workers:<3} cold {run['images'] / run['cold_seconds']:7.1f} img/s  {latency}")
+            print_stages("cold search", run["cold_stages"])
+            print_stages("warm search", run["warm_stages"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def run_memory(folder: str, searches: int, top_k: int, batch_size: int):
+    """
+    Index every image below folder with synthetic embeddings, then run concurrent
+    searches over it and print the peak RSS they add on top of a warm server as JSON
+    The files are empty and the index is filled directly, so nothing is decoded
+    and no model is needed
+    """
+    import threading
+    from . import main as server
+    from .progress import ProgressChannel
+    from .scheduler import scheduler
+
+    server.SETTINGS_FILE = str(INDEX_ROOT / "settings.json")
+
+    index = get_index(folder)
+    count = 0
+    pending = []
+    for files in itertools.chain(iter_scan(folder), [None]):
+        pending.extend(files or [])
+        if len(pending) >= 65536 or (files is None and pending):
+            paths = index.new_paths(pending)
+            index.add(paths, torch.from_numpy(synthetic_embeddings(len(paths), seed=count)))
+            count += len(paths)
+            pending = []
+    index.save()
+    query_embedding = next(index.iter_chunks(1))[1][0]
+
+    async def search():
+        search_id = str(uuid.uuid4())
+        server.search_progress[search_id] = ProgressChannel({'progress': 0})
+        scheduler.try_admit()
+        await server.process_search(
+            search_id, [folder], query_embedding, None, None, 0.0, batch_size, "image",
+            query_path=folder, top_k=top_k
+        )
+        progress = server.search_progress.pop(search_id)
+        if progress.get('error'):
+            raise RuntimeError(progress['error'])
+        return progress['result_count']
+
+    peak = 0
+    sampling = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not sampling.is_set():
+            peak = max(peak, current_rss() or 0)
+            time.sleep(0.005)
+
+    async def run():
+        nonlocal peak
+        # Warm up: map the index and fill the scan and result caches once
+        await search()
+        baseline = current_rss() or 0
+        peak = baseline
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        found = await asyncio.gather(*[search() for _ in range(searches)])
+        elapsed = time.perf_counter() - start
+        sampling.set()
+        sampler.join()
+        return {
+            "images": count,
+            "searches": searches,
+            "results": found,
+            "seconds": elapsed,
+            "baseline_rss_mb": baseline / 2 ** 20,
+            "peak_rss_mb": peak / 2 ** 20
+        }
+
+    print(json.dumps(asyncio.run(run())))
+
+
+# Run in a fresh interpreter with an empty index
+MEMORY_SCRIPT = "from backend.benchmark import run_memory; run_memory({folder!r}, {searches}, {top_k}, {batch_size})"
+
+
+def measure_memory(folder: str, searches: int, top_k: int, batch_size: int) -> dict:
+    """Run run_memory in a fresh interpreter with an empty index and return its measurements"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as index_dir:
+        env = dict(os.environ, CLIP_INDEX_DIR=index_dir, CUDA_VISIBLE_DEVICES="")
+        script = MEMORY_SCRIPT.format(folder=folder, searches=searches, top_k=top_k, batch_size=batch_size)
+        result = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError((result.stderr.strip().splitlines() or ["failed"])[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_memory(args):
+    """Check that concurrent searches over a large library run in bounded memory"""
+    folder = os.path.abspath(args.folder or make_tree(
+        os.path.join(tempfile.gettempdir(), f"clip_bench_tree_{args.dirs}x{args.files}"), args.dirs, args.files
+    ))
+    try:
+        run = measure_memory(folder, args.searches, args.top_k, args.batch_size)
+    except RuntimeError as e:
+        print(f"FAIL: {str(e)}")
+        sys.exit(1)
+    growth = run["peak_rss_mb"] - run["baseline_rss_mb"]
+    print(
+        f"{run['images']} images  {run['searches']} concurrent searches in {run['seconds']:.1f}s  "
+        f"results {run['results']}"
+    )
+    print(f"RSS baseline {run['baseline_rss_mb']:.1f} MB  peak {run['peak_rss_mb']:.1f} MB  growth {growth:.1f} MB")
+    if growth > args.max_rss_mb:
+        print(f"FAIL: searches added more than {args.max_rss_mb} MB")
+        sys.exit(1)
+
+
+def run_tiling(folder: str, count: int, batch_size: int, queries: int):
+    """
+    Encode images with the tiling configured by CLIP_TILE_GRIDS into an empty index,
+    then time max-pooled scoring; prints throughput, storage and latency as JSON
+    """
+    from .tiles import TILE_GRIDS
+
+    model, preprocess = load_model()
+    index = get_index(folder)
+    paths = index.new_paths(scan_folder(folder)[:count])
+
+    async def encode():
+        async for _, valid_paths, embeddings in iter_image_batches(paths, model, preprocess, batch_size):
+            if embeddings is not None:
+                index.add(valid_paths, embeddings)
+
+    start = time.perf_counter()
+    asyncio.run(encode())
+    elapsed = time.perf_counter() - start
+    index.save()
+    files = [index.MATRIX, index.SCALES, index.TILES, index.TILE_SCALES]
+    nbytes = sum(os.path.getsize(index.path / name) for name in files if (index.path / name).exists())
+
+    rng = np.random.default_rng(1)
+    query_embeddings = index.embeddings(rng.choice(len(index), min(queries, len(index)), replace=False))
+    start = time.perf_counter()
+    for query in query_embeddings:
+        for _, similarities, row_ids in index.iter_scores(query):
+            index.pool_tiles(row_ids, similarities, query)
+    latency = (time.perf_counter() - start) * 1000 / len(query_embeddings)
+    print(json.dumps({
+        "grids": TILE_GRIDS,
+        "images": len(index),
+        "views": 1 + index.tile_count,
+        "images_per_sec": len(index) / elapsed,
+        "bytes_per_image": nbytes / max(len(index), 1),
+        "latency_ms": latency
+    }))
+
+
+# Run in a fresh interpreter per tiling level with an empty index
+TILING_SCRIPT = "from backend.benchmark import run_tiling; run_tiling({folder!r}, {count}, {batch_size}, {queries})"
+
+
+def bench_tiles(args):
+    """Compare encode throughput, storage per image and query latency per tiling level"""
+    folder = os.path.abspath(args.folder or make_corpus(
+        os.path.join(tempfile.gettempdir(), "clip_bench_corpus"), args.count
+    ))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for level in args.levels:
+        grids = "" if level in ("0", "1") else level
+        with tempfile.TemporaryDirectory() as index_dir:
+            env = dict(os.environ, CLIP_INDEX_DIR=index_dir, CLIP_TILE_GRIDS=grids)
+            if args.cpu:
+                env["CUDA_VISIBLE_DEVICES"] = ""
+            script = TILING_SCRIPT.format(folder=folder, count=args.count, batch_size=args.batch_size, queries=args.queries)
+            result = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+            print(f"tiles={level:<8} failed: {error}")
+            continue
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"tiles={level:<8} {run['views']:>3} views/image  encode {run['images_per_sec']:8.1f} img/s  "
+            f"{run['bytes_per_image']:8.0f} bytes/image  query {run['latency_ms']:7.2f} ms over {run['images']} images"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search pipeline benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recall = commands.add_parser("recall", help="ANN recall@k against exact search")
+    recall.add_argument("--folder", help="Use the stored index of this folder instead of synthetic data")
+    recall.add_argument("--size", type=int, default=200000, help="Number of synthetic embeddings")
+    recall.add_argument("--nlist", type=int, default=None, help="Number of inverted lists")
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    recall.add_argument("--k", type=int, default=10)
+    recall.add_argument("--queries", type=int, default=100)
+    recall.set_defaults(func=bench_recall)
+
+    decode = commands.add_parser("decode", help="Threads vs processes decode throughput")
+    decode.add_argument("--folder", help="Use images from this folder instead of a synthetic corpus")
+    decode.add_argument("--count", type=int, default=256, help="Number of images")
+    decode.add_argument("--batch-size", type=int, default=32)
+    decode.add_argument("--prefetch", type=int, default=2, help="Batches decoded ahead of inference")
+    decode.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    decode.set_defaults(func=bench_decode)
+
+    drift = commands.add_parser("drift", help="Reduced-resolution decode speed and embedding drift")
+    drift.add_argument("--folder", help="Use images from this folder instead of a synthetic corpus")
+    drift.add_argument("--count", type=int, default=32, help="Number of images")
+    drift.add_argument("--width", type=int, default=6000, help="Width of synthetic images")
+    drift.add_argument("--height", type=int, default=4000, help="Height of synthetic images")
+    drift.add_argument("--target-size", type=int, default=448, help="Shortest side decoded images are reduced to")
+    drift.add_argument("--max-drift", type=float, default=0.02, help="Fail if any 1 - cosine exceeds this")
+    drift.set_defaults(func=bench_drift)
+
+    coldstart = commands.add_parser("coldstart", help="Server import, model load and inference time per model format")
+    coldstart.add_argument("--formats", nargs="+", default=["torch", "torchscript", "onnx"])
+    coldstart.add_argument("--batch-size", type=int, default=32)
+    coldstart.add_argument("--runs", type=int, default=5)
+    coldstart.add_argument("--cpu", action="store_true", help="Hide CUDA devices")
+    coldstart.set_defaults(func=bench_coldstart)
+
+    precision = commands.add_parser("precision", help="Memory, latency and top-k overlap per storage precision")
+    precision.add_argument("--folder", help="Use the stored index of this folder instead of synthetic data")
+    precision.add_argument("--size", type=int, default=200000, help="Number of synthetic embeddings")
+    precision.add_argument("--k", type=int, default=100)
+    precision.add_argument("--queries", type=int, default=50)
+    precision.set_defaults(func=bench_precision)
+
+    duplicates = commands.add_parser("duplicates", help="Duplicate detection time and recall of planted duplicates")
+    duplicates.add_argument("--size", type=int, default=200000, help="Number of synthetic embeddings")
+    duplicates.add_argument("--duplicates", type=int, default=1000, help="Planted near-duplicate pairs")
+    duplicates.add_argument("--noise", type=float, default=0.005, help="Noise added to planted copies")
+    duplicates.add_argument("--threshold", type=float, default=0.95)
+    duplicates.add_argument("--nprobe", type=int, default=2)
+    duplicates.add_argument("--max-exact", type=int, default=100000, help="Largest library also joined exactly")
+    duplicates.set_defaults(func=bench_duplicates)
+
+    scan = commands.add_parser("scan", help="Folder scan time: os.walk vs parallel scandir, cold and cached")
+    scan.add_argument("--folder", help="Scan this folder instead of a synthetic tree")
+    scan.add_argument("--dirs", type=int, default=2000, help="Directories in the synthetic tree")
+    scan.add_argument("--files", type=int, default=100, help="Images per directory")
+    scan.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    scan.set_defaults(func=bench_scan)
+
+    pipeline = commands.add_parser("pipeline", help="Per-stage timing of image and text searches on CPU")
+    pipeline.add_argument("--folder", help="Use images from this folder instead of a synthetic corpus")
+    pipeline.add_argument("--count", type=int, default=512, help="Number of synthetic images")
+    pipeline.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64])
+    pipeline.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Decode worker counts")
+    pipeline.add_argument("--runs", type=int, default=10, help="Warm searches of each type")
+    pipeline.add_argument("--query", default="a colorful gradient", help="Text query")
+    pipeline.add_argument("--output", help="Also write the results as JSON to this file")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    memory = commands.add_parser("memory", help="Peak RSS of concurrent searches over a large library")
+    memory.add_argument("--folder", help="Search this folder instead of a synthetic tree")
+    memory.add_argument("--dirs", type=int, default=10000, help="Directories in the synthetic tree")
+    memory.add_argument("--files", type=int, default=100, help="Images per directory")
+    memory.add_argument("--searches", type=int, default=4, help="Concurrent searches")
+    memory.add_argument("--top-k", type=int, default=500, help="Results per search (0: up to CLIP_MAX_RESULTS)")
+    memory.add_argument("--batch-size", type=int, default=32)
+    memory.add_argument("--max-rss-mb", type=float, default=512, help="Fail if the searches add more than this")
+    memory.set_defaults(func=bench_memory)
+
+    tiles = commands.add_parser("tiles", help="Encode throughput, storage and query latency per tiling level")
+    tiles.add_argument("--folder", help="Use images from this folder instead of a synthetic corpus")
+    tiles.add_argument("--count", type=int, default=256, help="Number of images")
+    tiles.add_argument("--levels", nargs="+", default=["0", "2", "3", "2,3"], help="Tile grids per level (0: no tiles)")
+    tiles.add_argument("--batch-size", type=int, default=32)
+    tiles.add_argument("--queries", type=int, default=50)
+    tiles.add_argument("--cpu", action="store_true", help="Hide CUDA devices")
+    tiles.set_defaults(func=bench_tiles)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,145 @@
 import os
 import torch
-import clip
 from PIL import Image
 import torch.nn.functional as F
 from pathlib import Path
-from typing import List, Dict, Union, Tuple
+from typing import List, Dict, Union, Tuple, Optional
 import numpy as np
 import re
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import torch.multiprocessing as torch_mp
+from .imaging import open_image, DECODE_TARGET_SIZE
+from .thumbnails import THUMBNAILS_ON_INGEST, save_ingest_thumbnail
+from .models import MODEL_FORMAT, MODEL_NAME, load_compiled_model
+from .metrics import metrics
+from .scanner import device_of
+from .tiles import TILE_BOXES, tile_decode_size, crop_tiles
 
-# Global cache for image embeddings
-cache = {}
+# LRU cache of normalized text embeddings keyed by text
+TEXT_CACHE_SIZE = 4096
+text_cache: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+text_cache_lock = threading.Lock()
+
+# Image decoding backend: "threads" or "processes" (escapes the GIL on many-core CPUs)
+DECODE_BACKEND = os.environ.get("CLIP_DECODE_BACKEND", "threads")
+
+# Number of decode workers and of batches decoded ahead of inference
+DECODE_WORKERS = int(os.environ.get("CLIP_DECODE_WORKERS", "4"))
+PREFETCH_BATCHES = int(os.environ.get("CLIP_PREFETCH_BATCHES", "2"))
 
 # Global thread pool executor for image processing
-thread_pool = ThreadPoolExecutor(max_workers=4)  # Adjust based on your CPU cores
+thread_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+
+# Decode thread pools per storage device, created on first use, so reads
+# from a slow mount do not hold up decoding from other devices
+decode_pools: Dict[int, ThreadPoolExecutor] = {}
+decode_pools_lock = threading.Lock()
+
+# Process pools for decoding, created on first use and keyed by worker count
+process_pools: Dict[int, ProcessPoolExecutor] = {}
+
+# Preprocess function of the current decode worker process
+_worker_preprocess = None
+
+# Single worker that runs model forward passes off the event loop
+inference_executor = ThreadPoolExecutor(max_workers=1)
+
+# Number of torch threads for CPU inference (0 keeps the torch default)
+CPU_THREADS = int(os.environ.get("CLIP_CPU_THREADS", "0"))
 
 
 def load_model():
     """Load CLIP model and return model and preprocess function"""
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load("ViT-B/32", device=device)
+    if device == "cpu" and CPU_THREADS > 0:
+        torch.set_num_threads(CPU_THREADS)
+    if MODEL_FORMAT != "torch":
+        return load_compiled_model(MODEL_FORMAT, device)
+    # Imported here so importing this module does not pull in clip
+    import clip
+    # clip.load keeps fp16 weights on CUDA and converts to fp32 on CPU
+    model, preprocess = clip.load(MODEL_NAME, device=device)
     model.eval()  # Set to evaluation mode
     return model, preprocess
 
 
+def tokenize(texts: List[str]) -> torch.Tensor:
+    """Tokenize texts for the CLIP text encoder"""
+    import clip
+    return clip.tokenize(texts)
+
+
 def analyze_image_content(image_path: str, model: torch.nn.Module, preprocess) -> str:
     """Analyze image content using CLIP"""
+    from .tags import DEFAULT_LABELS, label_matrix, label_probabilities, top_labels
+    
     try:
-        device = next(model.parameters()).device
-        image = Image.open(image_path).convert("RGB")
-        image_input = preprocess(image).unsqueeze(0).to(device)
+        image_features = get_image_embedding(image_path, model, preprocess)
+        if image_features is None:
+            return "unknown content"
         
-        # Categories for image analysis
-        categories = [
-            "a photograph", "digital art", "a painting", "a sketch",
-            "landscape photo", "portrait photo", "abstract art", "still life",
-            "black and white", "colorful", "high contrast", "soft lighting",
-            "nature scene", "urban scene", "indoor scene", "outdoor scene",
-            "close-up shot", "wide angle shot", "aerial view", "macro photography",
-            "night scene", "daylight scene", "sunset scene", "sunrise scene",
-            "architecture", "people", "animals", "plants",
-            "water", "mountains", "sky", "buildings",
-            "vintage style", "modern style", "minimalist", "detailed",
-            "texture", "pattern", "symmetrical", "asymmetrical"
-        ]
+        # Similarities against the cached category embeddings
+        similarity = label_probabilities(image_features.unsqueeze(0) @ label_matrix(DEFAULT_LABELS, model).T)
         
-        text = clip.tokenize(categories).to(device)
+        # Get top 5 matches
+        values, indices = top_labels(similarity, 5)
         
-        with torch.no_grad():
-            image_features = model.encode_image(image_input)
-            text_features = model.encode_text(text)
-            
-            # Calculate similarities
-            similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-            
-            # Get top 5 matches
-            values, indices = similarity[0].topk(5)
-            
-            # Create description
-            descriptions = [categories[idx] for idx in indices]
-            scores = [float(val) for val in values]
-            
-            # Format top matches with confidence scores
-            formatted_desc = [f"{desc} ({score:.1f}%)" for desc, score in zip(descriptions, scores)]
-            return ", ".join(formatted_desc)
+        # Format top matches with confidence scores
+        formatted_desc = [
+            f"{DEFAULT_LABELS[idx]} ({float(val):.1f}%)" for val, idx in zip(values[0], indices[0].tolist())
+        ]
+        return ", ".join(formatted_desc)
             
     except Exception as e:
         print(f"Error analyzing image {image_path}: {str(e)}")
         return "unknown content"
 
 
+def load_image_tensor(
+    image_path: str,
+    preprocess,
+    target_size: int = DECODE_TARGET_SIZE,
+    boxes: List[Tuple[float, float, float, float]] = None
+) -> Union[torch.Tensor, None]:
+    """
+    Decode and preprocess a single image into a [3, H, W] tensor
+    With tile boxes, returns a [1 + tiles, 3, H, W] tensor of the whole image
+    followed by its tiles, decoded at a size that keeps every tile sharp
+    """
+    try:
+        with metrics.time("decode"):
+            image = open_image(image_path, tile_decode_size(target_size, boxes))
+        if THUMBNAILS_ON_INGEST:
+            save_ingest_thumbnail(image_path, image, target_size)
+        with metrics.time("preprocess"):
+            if boxes:
+                return torch.stack([preprocess(view) for view in [image] + crop_tiles(image, boxes)])
+            return preprocess(image)
+    except Exception as e:
+        print(f"Error processing image {image_path}: {str(e)}")
+        return None
+
+
+def encode_image_batch(image_inputs: torch.Tensor, model: torch.nn.Module) -> torch.Tensor:
+    """Encode a [B, 3, H, W] batch in a single forward pass and return normalized embeddings"""
+    param = next(model.parameters())
+    with metrics.time("encode", len(image_inputs)), torch.inference_mode():
+        image_inputs = image_inputs.to(param.device, dtype=param.dtype, non_blocking=True)
+        image_features = model.encode_image(image_inputs)
+        image_features = F.normalize(image_features.float(), dim=-1)
+    return image_features.cpu()
+
+
 def get_image_embedding(image_path: str, model: torch.nn.Module, preprocess) -> Union[torch.Tensor, None]:
     """Get embedding for a single image"""
+    image_input = load_image_tensor(image_path, preprocess)
+    if image_input is None:
+        return None
     try:
-        image = Image.open(image_path).convert('RGB')
-        image_input = preprocess(image).unsqueeze(0).to(next(model.parameters()).device)
-        with torch.no_grad():
-            image_features = model.encode_image(image_input)
-            image_features = F.normalize(image_features.squeeze(0), dim=0)
-        return image_features.cpu()
+        return encode_image_batch(image_input.unsqueeze(0), model).squeeze(0)
     except Exception as e:
         print(f"Error processing image {image_path}: {str(e)}")
         return None
@@ -97,49 +157,165 @@ async def async_get_image_embedding(image_path: str, model: torch.nn.Module, pre
     )
 
 
-def get_cached_embedding(image_path: str, model: torch.nn.Module, preprocess) -> Union[torch.Tensor, None]:
-    """Return cached embedding if available, else compute and cache it"""
-    try:
-        mod_time = os.path.getmtime(image_path)
-        key = (image_path, mod_time)
-        
-        if key in cache:
-            return cache[key]
-            
-        embedding = get_image_embedding(image_path, model, preprocess)
-        if embedding is not None:
-            cache[key] = embedding
-        return embedding
-    except Exception as e:
-        print(f"Error with cache for {image_path}: {str(e)}")
-        return None
+def collate_inputs(image_inputs: List[torch.Tensor]) -> torch.Tensor:
+    """Collate per-image inputs into one batch; the views of tiled images are laid out image by image"""
+    if image_inputs[0].dim() == 4:
+        return torch.cat(image_inputs)
+    return torch.stack(image_inputs)
 
 
-async def process_image_batch(batch_paths: List[str], model: torch.nn.Module, preprocess) -> Tuple[List[str], torch.Tensor]:
-    """Process a batch of images concurrently"""
-    # Create tasks for all images in the batch
-    embedding_tasks = [
-        async_get_image_embedding(path, model, preprocess)
-        for path in batch_paths
-    ]
-    
-    # Process all embeddings concurrently
-    embeddings = await asyncio.gather(*embedding_tasks)
-    
-    # Filter out failed embeddings and keep track of valid paths
-    valid_embeddings = []
+def decode_batch(batch_paths: List[str], preprocess, boxes=TILE_BOXES) -> Tuple[List[str], Optional[torch.Tensor]]:
+    """Decode and preprocess a batch of images into one [B, 3, H, W] tensor ([B * views, 3, H, W] when tiled)"""
+    valid_inputs = []
     valid_paths = []
     
-    for path, embedding in zip(batch_paths, embeddings):
-        if embedding is not None:
-            valid_embeddings.append(embedding)
+    for path in batch_paths:
+        image_input = load_image_tensor(path, preprocess, boxes=boxes)
+        if image_input is not None:
+            valid_inputs.append(image_input)
             valid_paths.append(path)
     
-    if not valid_embeddings:
+    if not valid_inputs:
+        return [], None
+    return valid_paths, collate_inputs(valid_inputs)
+
+
+def decode_pool_for(folder: str) -> ThreadPoolExecutor:
+    """Decode thread pool of the device a folder is on"""
+    device = device_of(folder)
+    with decode_pools_lock:
+        if device not in decode_pools:
+            decode_pools[device] = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+        return decode_pools[device]
+
+
+def _init_decode_worker(preprocess):
+    """Initialize a decode worker process"""
+    global _worker_preprocess
+    _worker_preprocess = preprocess
+    # Parallelism comes from the worker processes themselves
+    torch.set_num_threads(1)
+
+
+def _decode_batch_in_worker(batch_paths: List[str], boxes) -> Tuple[List[str], Optional[torch.Tensor]]:
+    """Decode a batch in a worker process, handing the tensor back through shared memory"""
+    valid_paths, batch = decode_batch(batch_paths, _worker_preprocess, boxes)
+    if batch is not None:
+        batch.share_memory_()
+    return valid_paths, batch
+
+
+def get_process_pool(preprocess, workers: int = DECODE_WORKERS) -> ProcessPoolExecutor:
+    """Return the decode process pool, starting it on first use"""
+    if workers not in process_pools:
+        process_pools[workers] = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=torch_mp.get_context("spawn"),
+            initializer=_init_decode_worker,
+            initargs=(preprocess,)
+        )
+    return process_pools[workers]
+
+
+async def decode_image_batch(
+    batch_paths: List[str],
+    preprocess,
+    backend: str = None,
+    workers: int = DECODE_WORKERS,
+    executor: ThreadPoolExecutor = None,
+    boxes=TILE_BOXES
+) -> Tuple[List[str], Optional[torch.Tensor]]:
+    """
+    Decode a batch of images on the configured backend
+    The threads backend runs on executor, or the shared thread pool
+    With tile boxes every image contributes its whole view followed by its tiles
+    """
+    loop = asyncio.get_event_loop()
+    backend = backend or DECODE_BACKEND
+    
+    if backend == "processes":
+        pool = get_process_pool(preprocess, workers)
+        # Split the batch so every worker process gets a share
+        size = max(1, -(-len(batch_paths) // workers))
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(pool, _decode_batch_in_worker, batch_paths[i:i + size], boxes)
+            for i in range(0, len(batch_paths), size)
+        ])
+        valid_paths = [path for paths, _ in parts for path in paths]
+        tensors = [batch for _, batch in parts if batch is not None]
+        return valid_paths, torch.cat(tensors) if tensors else None
+    
+    # Worker threads decode one image each
+    image_inputs = await asyncio.gather(*[
+        loop.run_in_executor(executor or thread_pool, load_image_tensor, path, preprocess, DECODE_TARGET_SIZE, boxes)
+        for path in batch_paths
+    ])
+    valid = [(path, image_input) for path, image_input in zip(batch_paths, image_inputs) if image_input is not None]
+    if not valid:
+        return [], None
+    return [path for path, _ in valid], collate_inputs([image_input for _, image_input in valid])
+
+
+async def process_image_batch(batch_paths: List[str], model: torch.nn.Module, preprocess) -> Tuple[List[str], Optional[torch.Tensor]]:
+    """Decode a batch of images concurrently and encode them in one forward pass"""
+    loop = asyncio.get_event_loop()
+    valid_paths, batch = await decode_image_batch(batch_paths, preprocess, boxes=None)
+    if batch is None:
         return [], None
     
-    # Stack valid embeddings
-    return valid_paths, torch.stack(valid_embeddings)
+    # Encode the collated batch off the event loop
+    embeddings = await loop.run_in_executor(inference_executor, encode_image_batch, batch, model)
+    return valid_paths, embeddings
+
+
+async def iter_image_batches(
+    paths: List[str],
+    model: torch.nn.Module,
+    preprocess,
+    batch_size: int,
+    prefetch: int = PREFETCH_BATCHES,
+    backend: str = None,
+    workers: int = DECODE_WORKERS,
+    encoder=None,
+    executor: ThreadPoolExecutor = None
+):
+    """
+    Encode images in batches, decoding up to `prefetch` batches ahead
+    so decoding overlaps with model inference
+    encoder is an optional coroutine function taking a [B, 3, H, W] batch,
+    used to route forward passes through the inference scheduler
+    executor is an optional thread pool to decode on
+    Yields (batch_paths, valid_paths, embeddings) in order; with tiling enabled the
+    views of all images go through one forward pass and embeddings are [B, 1 + tiles, D]
+    """
+    loop = asyncio.get_event_loop()
+    pending = deque()
+    
+    async def encode(batch_paths, decoding):
+        valid_paths, batch = await decoding
+        if batch is None:
+            return batch_paths, [], None
+        if encoder is not None:
+            embeddings = await encoder(batch)
+        else:
+            embeddings = await loop.run_in_executor(inference_executor, encode_image_batch, batch, model)
+        if len(embeddings) != len(valid_paths):
+            embeddings = embeddings.view(len(valid_paths), -1, embeddings.shape[-1])
+        return batch_paths, valid_paths, embeddings
+    
+    try:
+        for i in range(0, len(paths), batch_size):
+            batch_paths = paths[i:i + batch_size]
+            decoding = asyncio.ensure_future(decode_image_batch(batch_paths, preprocess, backend, workers, executor))
+            pending.append((batch_paths, decoding))
+            if len(pending) > prefetch:
+                yield await encode(*pending.popleft())
+        while pending:
+            yield await encode(*pending.popleft())
+    finally:
+        # Drop prefetched batches if the consumer stops early
+        for _, decoding in pending:
+            decoding.cancel()
 
 
 def tokenize_search_query(query: str) -> List[str]:
@@ -164,31 +340,57 @@ def tokenize_search_query(query: str) -> List[str]:
     return tokens
 
 
-def get_token_similarities(image_embedding: torch.Tensor, tokens: List[str], model) -> List[Tuple[str, float]]:
+def encode_texts(texts: List[str], model: torch.nn.Module) -> torch.Tensor:
     """
-    Calculate similarity scores between image embedding and each token
-    Returns list of (token, similarity_score) tuples
+    Encode texts into a [T, D] matrix of normalized embeddings
+    Texts missing from the LRU cache are encoded together in one batch
     """
-    device = next(model.parameters()).device
-    similarities = []
+    with text_cache_lock:
+        missing = [text for text in dict.fromkeys(texts) if text not in text_cache]
     
-    for token in tokens:
-        # Tokenize and encode the text
-        text = clip.tokenize([token]).to(device)
-        with torch.no_grad():
-            text_features = model.encode_text(text)
-            text_features = F.normalize(text_features.squeeze(0), dim=0)
-        
-        # Calculate similarity
-        similarity = torch.dot(image_embedding.to(device), text_features.to(device))
-        similarity_score = (similarity.item() + 1) / 2  # Normalize to 0-1 range
-        similarities.append((token, similarity_score))
+    if missing:
+        device = next(model.parameters()).device
+        text_inputs = tokenize(missing).to(device)
+        with torch.inference_mode():
+            text_features = F.normalize(model.encode_text(text_inputs).float(), dim=-1).cpu()
+        with text_cache_lock:
+            for text, features in zip(missing, text_features):
+                text_cache[text] = features
     
-    # Sort by similarity score in descending order
+    with text_cache_lock:
+        embeddings = []
+        for text in texts:
+            text_cache.move_to_end(text)
+            embeddings.append(text_cache[text])
+        while len(text_cache) > TEXT_CACHE_SIZE:
+            text_cache.popitem(last=False)
+    return torch.stack(embeddings)
+
+
+def score_tokens(image_embeddings: torch.Tensor, token_embeddings: torch.Tensor) -> torch.Tensor:
+    """Score [N, D] image embeddings against [T, D] token embeddings, normalized to 0-1"""
+    return (image_embeddings.float() @ token_embeddings.float().T + 1) / 2
+
+
+def format_token_similarities(tokens: List[str], scores: torch.Tensor) -> List[Tuple[str, float]]:
+    """Pair tokens with their scores, sorted by score in descending order"""
+    similarities = list(zip(tokens, scores.tolist()))
     similarities.sort(key=lambda x: x[1], reverse=True)
     return similarities
 
 
+def get_token_similarities(image_embedding: torch.Tensor, tokens: List[str], model) -> List[Tuple[str, float]]:
+    """
+    Calculate similarity scores between image embedding and each token
+    Returns list of (token, similarity_score) tuples
+    """
+    if not tokens:
+        return []
+    token_embeddings = encode_texts(tokens, model)
+    scores = score_tokens(image_embedding.unsqueeze(0), token_embeddings)[0]
+    return format_token_similarities(tokens, scores)
+
+
 async def async_get_token_similarities(
     image_embedding: torch.Tensor,
     tokens: List[str],
@@ -196,27 +398,14 @@ async def async_get_token_similarities(
     device
 ) -> List[Tuple[str, float]]:
     """Asynchronous function to get token similarities"""
-    similarities = []
-    
-    # Process tokens in parallel
-    async def process_token(token: str) -> Tuple[str, float]:
-        text = clip.tokenize([token]).to(device)
-        with torch.no_grad():
-            text_features = model.encode_text(text)
-            text_features = F.normalize(text_features.squeeze(0), dim=0)
-            similarity = torch.dot(image_embedding.to(device), text_features.to(device))
-            similarity_score = (similarity.item() + 1) / 2
-        return token, similarity_score
-    
-    # Create tasks for all tokens
-    similarity_tasks = [process_token(token) for token in tokens]
-    
-    # Process all similarities concurrently
-    similarities = await asyncio.gather(*similarity_tasks)
-    
-    # Sort by similarity score in descending order
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        inference_executor,
+        get_token_similarities,
+        image_embedding,
+        tokens,
+        model
+    )
 
 
 def search_similar_images(query_embedding: torch.Tensor, folder_path: str, model, preprocess, min_score: float = 0.0, batch_size: int = 32, query_text: str = None) -> List[Dict]:
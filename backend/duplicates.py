@@ -0,0 +1,212 @@
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+from typing import Callable, Dict, List, Optional, Tuple
+from .ann import IVFIndex
+from .index import dequantize
+from .imaging import open_image
+
+# Cosine similarity above which two images count as near-duplicates
+DEFAULT_THRESHOLD = 0.95
+
+# Inverted lists compared with each list in ANN mode
+DEFAULT_DUPLICATE_NPROBE = 2
+
+# Rows per block of the blocked self-join (a block of scores is BLOCK_SIZE^2 floats)
+BLOCK_SIZE = 4096
+
+
+class DisjointSet:
+    """Union-find over row ids, tracking every row's best match score"""
+
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+        self.best = np.zeros(size, dtype=np.float32)
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union_edges(self, rows: np.ndarray, cols: np.ndarray, scores: np.ndarray):
+        """Join every (row, col) pair and record the scores"""
+        np.maximum.at(self.best, rows, scores)
+        np.maximum.at(self.best, cols, scores)
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            root_i, root_j = self.find(i), self.find(j)
+            if root_i != root_j:
+                self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def clusters(self) -> List[np.ndarray]:
+        """Groups of two or more rows, largest first"""
+        roots = np.array([self.find(i) for i in range(len(self.parent))])
+        order = np.argsort(roots, kind="stable")
+        bounds = np.flatnonzero(np.diff(roots[order])) + 1
+        groups = [group for group in np.split(order, bounds) if len(group) > 1]
+        groups.sort(key=len, reverse=True)
+        return groups
+
+
+def perceptual_hash(image_path: str) -> Optional[int]:
+    """64-bit difference hash of an image, or None if it cannot be read"""
+    try:
+        image = open_image(image_path, 64).convert("L").resize((9, 8))
+        pixels = np.asarray(image, dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        return int(np.packbits(bits).view(">u8")[0])
+    except Exception as e:
+        print(f"Error hashing image {image_path}: {str(e)}")
+        return None
+
+
+def group_by_hash(hashes: List[Optional[int]]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Return one representative row per distinct hash and the groups of identical hashes"""
+    groups: Dict[int, List[int]] = {}
+    unhashed = []
+    for row, value in enumerate(hashes):
+        # Flat images all hash to 0 and are left to the embedding comparison
+        if not value:
+            unhashed.append(row)
+        else:
+            groups.setdefault(value, []).append(row)
+    representatives = sorted([rows[0] for rows in groups.values()] + unhashed)
+    duplicates = [np.array(rows) for rows in groups.values() if len(rows) > 1]
+    return np.array(representatives, dtype=np.int64), duplicates
+
+
+def _load_rows(matrix: np.ndarray, scales: Optional[np.ndarray], ids: np.ndarray) -> torch.Tensor:
+    """Normalized float32 embeddings of the given rows"""
+    block_scales = scales[ids] if scales is not None else None
+    return F.normalize(dequantize(matrix[ids], block_scales), dim=1)
+
+
+def _join(
+    groups: DisjointSet,
+    left_ids: np.ndarray,
+    left: torch.Tensor,
+    right_ids: np.ndarray,
+    right: torch.Tensor,
+    threshold: float,
+    same: bool
+):
+    """Join every pair of rows between two blocks scoring at least threshold"""
+    scores = left @ right.T
+    if same:
+        # Each pair once, no self pairs
+        scores = torch.triu(scores, diagonal=1)
+    rows, cols = torch.nonzero(scores >= threshold, as_tuple=True)
+    if len(rows):
+        groups.union_edges(left_ids[rows.numpy()], right_ids[cols.numpy()], scores[rows, cols].numpy())
+
+
+def join_exact(
+    groups: DisjointSet,
+    matrix: np.ndarray,
+    scales: Optional[np.ndarray],
+    ids: np.ndarray,
+    threshold: float,
+    block_size: int = BLOCK_SIZE,
+    on_progress: Callable = None
+):
+    """Blocked self-join: compare every row with every later row, one score block at a time"""
+    starts = list(range(0, len(ids), block_size))
+    total = len(starts) * (len(starts) + 1) // 2
+    done = 0
+    for i, start in enumerate(starts):
+        left_ids = ids[start:start + block_size]
+        left = _load_rows(matrix, scales, left_ids)
+        for other in starts[i:]:
+            right_ids = ids[other:other + block_size]
+            right = left if other == start else _load_rows(matrix, scales, right_ids)
+            _join(groups, left_ids, left, right_ids, right, threshold, other == start)
+            done += 1
+            if on_progress is not None:
+                on_progress(done, total)
+
+
+def join_ann(
+    groups: DisjointSet,
+    matrix: np.ndarray,
+    scales: Optional[np.ndarray],
+    ids: np.ndarray,
+    ann: IVFIndex,
+    threshold: float,
+    nprobe: int = DEFAULT_DUPLICATE_NPROBE,
+    block_size: int = BLOCK_SIZE,
+    on_progress: Callable = None
+):
+    """
+    Approximate self-join: compare the rows of every inverted list with the rows
+    of its nprobe closest lists (itself included)
+    """
+    include = np.zeros(len(ann), dtype=bool)
+    include[ids] = True
+    lists = [rows[include[rows]] for rows in ann._inverted_lists()]
+    nprobe = max(1, min(nprobe, ann.nlist))
+    neighbours = torch.topk(ann.centroids @ ann.centroids.T, nprobe, dim=1).indices.tolist()
+    neighbour_sets = [set(probe) for probe in neighbours]
+
+    for list_id, probe in enumerate(neighbours):
+        members = lists[list_id]
+        for start in range(0, len(members), block_size):
+            left_ids = members[start:start + block_size]
+            left = _load_rows(matrix, scales, left_ids)
+            for other_id in probe:
+                # Pairs of mutually close lists are compared from the lower list only
+                if other_id < list_id and list_id in neighbour_sets[other_id]:
+                    continue
+                others = lists[other_id]
+                first = start if other_id == list_id else 0
+                for other in range(first, len(others), block_size):
+                    right_ids = others[other:other + block_size]
+                    same = other_id == list_id and other == start
+                    right = left if same else _load_rows(matrix, scales, right_ids)
+                    _join(groups, left_ids, left, right_ids, right, threshold, same)
+        if on_progress is not None:
+            on_progress(list_id + 1, ann.nlist)
+
+
+def find_duplicates(
+    matrix: np.ndarray,
+    scales: Optional[np.ndarray],
+    paths: List[str],
+    threshold: float = DEFAULT_THRESHOLD,
+    ann: IVFIndex = None,
+    nprobe: int = DEFAULT_DUPLICATE_NPROBE,
+    hashes: List[Optional[int]] = None,
+    on_progress: Callable = None
+) -> List[Dict]:
+    """
+    Group the rows of an embedding matrix into near-duplicate clusters
+    With hashes, images with identical perceptual hashes are grouped up front
+    and only one of them takes part in the embedding comparison
+    Uses the ANN index when given, else an exact blocked self-join
+    """
+    groups = DisjointSet(len(paths))
+    ids = np.arange(len(paths))
+    if hashes is not None:
+        ids, exact = group_by_hash(hashes)
+        for rows in exact:
+            groups.union_edges(rows[1:], np.full(len(rows) - 1, rows[0]), np.ones(len(rows) - 1, dtype=np.float32))
+
+    if ann is not None:
+        join_ann(groups, matrix, scales, ids, ann, threshold, nprobe, on_progress=on_progress)
+    else:
+        join_exact(groups, matrix, scales, ids, threshold, on_progress=on_progress)
+
+    clusters = []
+    for rows in groups.clusters():
+        members = [
+            {"path": paths[row], "filename": os.path.basename(paths[row]), "score": float(groups.best[row])}
+            for row in rows.tolist()
+        ]
+        clusters.append({
+            "size": len(members),
+            "score": max(member["score"] for member in members),
+            "paths": members
+        })
+    return clusters
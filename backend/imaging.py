@@ -0,0 +1,25 @@
+import os
+from PIL import Image, ImageOps
+
+# Images are decoded at reduced resolution, keeping the shortest side at least
+# this many pixels (2x the 224px model input); 0 decodes at full resolution
+DECODE_TARGET_SIZE = int(os.environ.get("CLIP_DECODE_TARGET_SIZE", "448"))
+
+
+def open_image(image_path: str, target_size: int = DECODE_TARGET_SIZE) -> Image.Image:
+    """
+    Open an image as upright RGB
+    Images much larger than target_size are decoded at reduced resolution:
+    JPEGs through draft mode (DCT scaling, so the full-size bitmap is never
+    allocated) and other formats through a fast box reduction
+    """
+    with Image.open(image_path) as image:
+        if target_size and image.format == "JPEG":
+            image.draft("RGB", (target_size, target_size))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    
+    if target_size:
+        factor = min(image.size) // target_size
+        if factor >= 2:
+            image = image.reduce(factor)
+    return image
@@ -0,0 +1,903 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import asyncio
+import threading
+import multiprocessing
+import numpy as np
+import torch
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterator, AsyncIterator, Optional
+from .ann import IVFIndex, ANN_MIN_SIZE
+from .tiles import TILE_GRIDS, tile_boxes
+from .scanner import ListingCache, iter_scan, stream_scan, scan_pool_for, SUPPORTED_FORMATS, SCAN_CACHE
+
+# Root directory where per-folder indexes are stored
+ROOT_DIR = Path(__file__).parent.parent
+INDEX_ROOT = Path(os.environ.get("CLIP_INDEX_DIR", str(ROOT_DIR / "index_cache")))
+
+# Storage precision for the embedding matrix: float32, float16 or int8
+# (scalar-quantized with one scale per row)
+INDEX_DTYPE = os.environ.get("CLIP_INDEX_DTYPE", "float16")
+
+# Open indexes and directory listing caches, keyed by absolute folder path
+_indexes: Dict[str, "EmbeddingIndex"] = {}
+_listings: Dict[str, ListingCache] = {}
+
+
+def listing_cache_for(folder: str) -> Optional[ListingCache]:
+    """Return the shared directory listing cache of a folder, or None when caching is disabled"""
+    if not SCAN_CACHE:
+        return None
+    folder = os.path.abspath(folder)
+    if folder not in _listings:
+        _listings[folder] = ListingCache(index_dir_for(folder) / "listings.json")
+    return _listings[folder]
+
+
+def scan_folder(folder: str, reuse: bool = True) -> List[Tuple[str, float, int]]:
+    """
+    Scan a folder and return (path, mtime, size) for every supported image
+    With reuse, directories whose mtime is unchanged are taken from the listing cache
+    Directories are listed on the listing pool of the folder's device
+    """
+    folder = os.path.abspath(folder)
+    return [row for files in iter_scan(folder, listing_cache_for(folder), reuse, scan_pool_for(folder)) for row in files]
+
+
+def stream_folder(folder: str, reuse: bool = True) -> AsyncIterator[List[Tuple[str, float, int]]]:
+    """Stream the (path, mtime, size) rows of a folder one directory at a time"""
+    folder = os.path.abspath(folder)
+    return stream_scan(folder, listing_cache_for(folder), reuse, scan_pool_for(folder))
+
+
+def quantize(block: np.ndarray, dtype) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert float embeddings to the storage dtype
+    int8 maps every row symmetrically onto [-127, 127] and returns the per-row scales
+    """
+    block = np.asarray(block, dtype=np.float32)
+    if np.dtype(dtype) != np.int8:
+        return block.astype(dtype), None
+    scales = np.abs(block).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(block / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize(block: np.ndarray, scales: Optional[np.ndarray] = None) -> torch.Tensor:
+    """Return stored embeddings as a float32 tensor"""
+    # Copy in the stored dtype (memory-mapped rows are read-only) and let torch widen it
+    block = torch.from_numpy(np.array(block)).float()
+    if scales is not None:
+        block *= torch.from_numpy(np.asarray(scales, dtype=np.float32)).unsqueeze(1)
+    return block
+
+
+def _int8_matmul(rows: torch.Tensor, queries: torch.Tensor) -> torch.Tensor:
+    """int8 [N, D] x int8 [D, Q] product accumulated in int32"""
+    try:
+        return torch._int_mm(rows, queries)
+    except (AttributeError, RuntimeError):
+        # Older torch builds without an int8 kernel for this device
+        return (rows.float() @ queries.float()).to(torch.int32)
+
+
+def score_block(block: np.ndarray, scales: Optional[np.ndarray], query: torch.Tensor) -> torch.Tensor:
+    """
+    Cosine similarities of stored (unit-norm) rows with a unit query [D]
+    or with every column of a query matrix [D, Q] in one multiply,
+    computed in the stored precision without widening the rows
+    """
+    rows = torch.from_numpy(np.ascontiguousarray(block))
+    if rows.dtype != torch.int8:
+        return (rows @ query.to(rows.dtype)).float()
+    # Quantize the queries too (one scale per query) and run an integer matmul
+    queries = query.unsqueeze(1) if query.dim() == 1 else query
+    query_scales = queries.abs().amax(dim=0).clamp(min=1e-12) / 127.0
+    queries_int8 = torch.round(queries / query_scales).to(torch.int8)
+    dots = _int8_matmul(rows, queries_int8).float()
+    row_scales = torch.from_numpy(np.asarray(scales, dtype=np.float32)).unsqueeze(1)
+    scores = dots * row_scales * query_scales
+    return scores.squeeze(1) if query.dim() == 1 else scores
+
+
+class AppendableRows:
+    """
+    Rows of a (typically memory-mapped) base array followed by a growable
+    in-memory tail; appending never copies the base, and reads are served
+    from whichever part holds the requested rows
+    """
+
+    MIN_CAPACITY = 1024
+
+    def __init__(self, base: Optional[np.ndarray] = None):
+        self.base = base
+        self._tail: Optional[np.ndarray] = None
+        self._count = 0
+
+    @property
+    def split(self) -> int:
+        """Number of rows in the base"""
+        return len(self.base) if self.base is not None else 0
+
+    def __len__(self) -> int:
+        return self.split + self._count
+
+    @property
+    def shape(self) -> tuple:
+        parts = self.parts()
+        row_shape = parts[0].shape[1:] if parts else self.base.shape[1:] if self.base is not None else ()
+        return (len(self),) + row_shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        parts = self.parts()
+        return parts[0].dtype if parts else self.base.dtype if self.base is not None else None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(part.nbytes for part in self.parts())
+
+    def append(self, block: np.ndarray):
+        """Append rows, doubling the tail capacity when it is full"""
+        count = self._count
+        tail = self._tail
+        if tail is None or count + len(block) > len(tail):
+            capacity = max(self.MIN_CAPACITY, 2 * count, count + len(block))
+            grown = np.empty((capacity,) + block.shape[1:], dtype=block.dtype)
+            if count:
+                grown[:count] = tail[:count]
+            tail = grown
+        tail[count:count + len(block)] = block
+        # Readers in other threads see the new rows only once they are written
+        self._tail = tail
+        self._count = count + len(block)
+
+    def parts(self) -> List[np.ndarray]:
+        """The non-empty base and tail arrays, in row order"""
+        count = self._count
+        tail = self._tail[:count] if self._tail is not None else None
+        return [part for part in (self.base, tail) if part is not None and len(part)]
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Rows of a slice (a view when it stays within one part) or of an array of row ids"""
+        split = self.split
+        count = self._count
+        tail = self._tail
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(split + count)
+            if stop <= split or tail is None:
+                return self.base[start:stop]
+            if start >= split:
+                return tail[start - split:stop - split]
+            return np.concatenate([self.base[start:split], tail[:stop - split]])
+        ids = np.asarray(key, dtype=np.int64)
+        if tail is None:
+            return self.base[ids]
+        if split == 0:
+            return tail[ids]
+        in_base = ids < split
+        rows = np.empty((len(ids),) + tail.shape[1:], dtype=tail.dtype)
+        rows[in_base] = self.base[ids[in_base]]
+        rows[~in_base] = tail[ids[~in_base] - split]
+        return rows
+
+
+def append_rows(rows: Optional[AppendableRows], blocks: List[np.ndarray]) -> AppendableRows:
+    """Append blocks of rows, creating the row store on first use"""
+    rows = rows if rows is not None else AppendableRows()
+    for block in blocks:
+        rows.append(block)
+    return rows
+
+
+def save_rows(path: Path, rows: Optional[AppendableRows], empty: np.ndarray, dtype, chunk_size: int = 65536):
+    """Write rows to a .npy file chunk by chunk, without merging base and tail in memory"""
+    parts = rows.parts() if rows is not None else []
+    if not parts:
+        with open(path, "wb") as f:
+            np.save(f, empty)
+        return
+    shape = (sum(len(part) for part in parts),) + parts[0].shape[1:]
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    row = 0
+    for part in parts:
+        for start in range(0, len(part), chunk_size):
+            block = part[start:start + chunk_size]
+            out[row:row + len(block)] = block
+            row += len(block)
+    out.flush()
+    del out
+
+
+def as_rows(array: Optional[np.ndarray]) -> Optional[AppendableRows]:
+    return AppendableRows(array) if array is not None else None
+
+
+def index_dir_for(folder: str) -> Path:
+    """Return the directory holding the index of a folder"""
+    key = os.path.normcase(os.path.abspath(folder)).encode("utf-8")
+    return INDEX_ROOT / hashlib.sha1(key).hexdigest()[:16]
+
+
+class EmbeddingIndex:
+    """
+    Persistent embedding index for one folder.
+    Embeddings live in a memory-mapped .npy matrix, with a JSON manifest
+    holding the path, mtime and size of every row. Rows added since the
+    last save live in an in-memory tail that save() merges into the file.
+    int8 matrices keep their per-row scales in a parallel scales.npy.
+    With tiling, the tile embeddings of every row live in a parallel
+    [rows, tiles, D] tiles.npy (and tile_scales.npy for int8).
+    """
+
+    MANIFEST = "manifest.json"
+    MATRIX = "embeddings.npy"
+    SCALES = "scales.npy"
+    TILES = "tiles.npy"
+    TILE_SCALES = "tile_scales.npy"
+    ANN = "ann.npz"
+
+    def __init__(self, folder: str, dtype: str = INDEX_DTYPE, tile_grids: List[int] = None):
+        self.folder = os.path.abspath(folder)
+        self.path = index_dir_for(self.folder)
+        self.dtype = np.dtype(dtype)
+        self.tile_grids = list(TILE_GRIDS if tile_grids is None else tile_grids)
+        self.tile_count = len(tile_boxes(self.tile_grids))
+        self.paths: List[str] = []
+        self.mtimes: List[float] = []
+        self.sizes: List[int] = []
+        self.matrix: Optional[AppendableRows] = None
+        self.scales: Optional[AppendableRows] = None
+        self.tiles: Optional[AppendableRows] = None
+        self.tile_scales: Optional[AppendableRows] = None
+        self.ann: Optional[IVFIndex] = None
+        self.lock = asyncio.Lock()
+        # Futures of images currently being encoded, keyed by path
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, Tuple[float, int]] = {}
+        self._known = set()
+        # Row of every flushed path, built on first use; generation changes whenever rows move
+        self._rows: Optional[Dict[str, int]] = None
+        self.generation = 0
+        self._pending_rows: List[Tuple[str, float, int]] = []
+        self._pending: List[np.ndarray] = []
+        self._pending_scales: List[np.ndarray] = []
+        self._pending_tiles: List[np.ndarray] = []
+        self._pending_tile_scales: List[np.ndarray] = []
+        # Guards pending rows: they are added on the event loop and flushed from worker threads
+        self._pending_lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.paths) + len(self._pending_rows)
+
+    def load(self):
+        """Load the manifest and memory-map the embedding matrix"""
+        manifest_path = self.path / self.MANIFEST
+        matrix_path = self.path / self.MATRIX
+        if not manifest_path.exists() or not matrix_path.exists():
+            return
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("tiles", []) != self.tile_grids:
+                # Tiles cannot be derived from stored embeddings: start over
+                print(f"Tiling of the index for {self.folder} changed, re-encoding its images")
+                return
+            matrix = np.load(matrix_path, mmap_mode="c")
+            if len(manifest["paths"]) != matrix.shape[0]:
+                raise ValueError("manifest does not match embedding matrix")
+            scales = None
+            if matrix.dtype == np.int8:
+                scales = np.load(self.path / self.SCALES)
+                if len(scales) != matrix.shape[0]:
+                    raise ValueError("scales do not match embedding matrix")
+            tiles = tile_scales = None
+            if self.tile_count:
+                tiles = np.load(self.path / self.TILES, mmap_mode="c")
+                if tiles.shape[:2] != (matrix.shape[0], self.tile_count):
+                    raise ValueError("tiles do not match embedding matrix")
+                if tiles.dtype == np.int8:
+                    tile_scales = np.load(self.path / self.TILE_SCALES)
+            self.paths = manifest["paths"]
+            self.mtimes = manifest["mtimes"]
+            self.sizes = manifest["sizes"]
+            if matrix.dtype != self.dtype and len(matrix):
+                # Stored at another precision: convert now, persist on the next save
+                self.matrix, self.scales = quantize(dequantize(matrix, scales).numpy(), self.dtype)
+                self._dirty = True
+            else:
+                self.matrix, self.scales = matrix, scales
+            if tiles is not None and tiles.dtype != self.dtype and len(tiles):
+                self.tiles, self.tile_scales = self._quantize_tiles(
+                    dequantize(tiles.reshape(-1, tiles.shape[-1]),
+                               tile_scales.reshape(-1) if tile_scales is not None else None).numpy()
+                    .reshape(tiles.shape)
+                )
+            else:
+                self.tiles, self.tile_scales = tiles, tile_scales
+            self.matrix, self.scales = as_rows(self.matrix), as_rows(self.scales)
+            self.tiles, self.tile_scales = as_rows(self.tiles), as_rows(self.tile_scales)
+            self._known = set(self.paths)
+        except Exception as e:
+            print(f"Error loading index for {self.folder}: {str(e)}")
+            self.paths, self.mtimes, self.sizes, self.matrix, self.scales = [], [], [], None, None
+            self.tiles, self.tile_scales = None, None
+            self._known = set()
+            return
+
+        ann_path = self.path / self.ANN
+        if ann_path.exists():
+            try:
+                ann = IVFIndex.load(ann_path)
+                if len(ann) == len(self.paths):
+                    self.ann = ann
+            except Exception as e:
+                print(f"Error loading ANN index for {self.folder}: {str(e)}")
+
+    def sync(self, files: List[Tuple[str, float, int]]) -> List[str]:
+        """
+        Drop rows for deleted or modified files and
+        return the paths that still need to be encoded
+        """
+        self._flush()
+        current = {path: (mtime, size) for path, mtime, size in files}
+        keep = [
+            i for i, path in enumerate(self.paths)
+            if current.get(path) == (self.mtimes[i], self.sizes[i])
+        ]
+        if len(keep) != len(self.paths):
+            self._select(keep)
+
+        stale = [path for path, _, _ in files if path not in self._known]
+        self._stats.update({path: current[path] for path in stale})
+        return stale
+
+    def _row_map(self) -> Dict[str, int]:
+        rows = self._rows
+        if rows is None:
+            rows = self._rows = {path: row for row, path in enumerate(self.paths)}
+        return rows
+
+    def rows_of(self, paths, stop: int = None) -> np.ndarray:
+        """Rows of the given paths that are flushed and below stop"""
+        rows = self._row_map()
+        stop = len(self.paths) if stop is None else stop
+        found = (rows.get(path, -1) for path in paths)
+        return np.fromiter((row for row in found if 0 <= row < stop), dtype=np.int64)
+
+    def check_files(self, files: List[Tuple[str, float, int]], seen: np.ndarray) -> List[str]:
+        """
+        Streaming counterpart of sync: mark the rows of indexed files in seen and
+        return the paths of files modified since they were indexed
+        Call sweep once the scan is complete to evict what it did not see
+        Runs on the event loop; the pending lock keeps flushes and evictions
+        in worker threads from moving rows under it
+        """
+        modified = []
+        with self._pending_lock:
+            rows = self._row_map()
+            for path, mtime, size in files:
+                row = rows.get(path)
+                if row is None:
+                    continue
+                if row < len(seen):
+                    seen[row] = True
+                if self.mtimes[row] != mtime or self.sizes[row] != size:
+                    modified.append(path)
+                    self._stats[path] = (mtime, size)
+        return modified
+
+    def sweep(self, seen: np.ndarray, generation: int, modified: List[str]) -> bool:
+        """
+        Drop the rows of files a complete streaming scan did not see or found modified
+        Rows added after the scan started are kept; if rows were removed since then,
+        seen no longer lines up and only the modified rows are dropped (by path),
+        returning False
+        """
+        self._flush()
+        if generation != self.generation:
+            # Modified files must still go, or add() would skip their new embeddings
+            self.remove(modified)
+            return False
+        keep = np.ones(len(self.paths), dtype=bool)
+        keep[:len(seen)] = seen
+        keep[self.rows_of(modified)] = False
+        if not keep.all():
+            self._select(np.flatnonzero(keep).tolist())
+        return True
+
+    def new_paths(self, files: List[Tuple[str, float, int]]) -> List[str]:
+        """
+        Return the paths of files that are not indexed yet, without evicting
+        anything; lets encoding start before a scan is complete
+        """
+        new = [(path, mtime, size) for path, mtime, size in files if path not in self._known]
+        self._stats.update({path: (mtime, size) for path, mtime, size in new})
+        return [path for path, _, _ in new]
+
+    def _quantize_tiles(self, tiles: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Convert [N, tiles, D] float tile embeddings to the storage dtype (one int8 scale per tile)"""
+        block, scales = quantize(tiles.reshape(-1, tiles.shape[-1]), self.dtype)
+        return block.reshape(tiles.shape), scales.reshape(tiles.shape[:2]) if scales is not None else None
+
+    def add(self, paths: List[str], embeddings: torch.Tensor):
+        """
+        Queue new embeddings; they are merged into the matrix on flush
+        Paths that are already indexed are skipped
+        Tiled [B, 1 + tiles, D] embeddings keep the whole image in the matrix
+        and the tiles in the tile matrix
+        """
+        rows = [i for i, path in enumerate(paths) if path not in self._known]
+        if not rows:
+            return
+        embeddings = embeddings[rows].detach().cpu().float()
+        tiles = tile_scales = None
+        if embeddings.dim() == 3:
+            embeddings, tiles = embeddings[:, 0], embeddings[:, 1:]
+        if self.tile_count:
+            if tiles is None or tiles.shape[1] != self.tile_count:
+                # Embedded without (these) tiles: the whole image stands in for every tile
+                tiles = embeddings.unsqueeze(1).expand(-1, self.tile_count, -1)
+            tiles, tile_scales = self._quantize_tiles(tiles.numpy())
+        block, scales = quantize(embeddings.numpy(), self.dtype)
+        with self._pending_lock:
+            for i in rows:
+                path = paths[i]
+                mtime, size = self._stats.pop(path, (0.0, 0))
+                self._pending_rows.append((path, mtime, size))
+                self._known.add(path)
+            self._pending.append(block)
+            if scales is not None:
+                self._pending_scales.append(scales)
+            if tiles is not None:
+                self._pending_tiles.append(tiles)
+            if tile_scales is not None:
+                self._pending_tile_scales.append(tile_scales)
+            self._dirty = True
+
+    def remove(self, paths: List[str]):
+        """Remove rows for the given paths"""
+        self._flush()
+        drop = set(paths)
+        keep = [i for i, path in enumerate(self.paths) if path not in drop]
+        if len(keep) != len(self.paths):
+            self._select(keep)
+
+    def _select(self, keep: List[int]):
+        """Keep only the given rows"""
+        matrix = as_rows(self.matrix[keep]) if self.matrix is not None else None
+        scales = as_rows(self.scales[keep]) if self.scales is not None else None
+        tiles = as_rows(self.tiles[keep]) if self.tiles is not None else None
+        tile_scales = as_rows(self.tile_scales[keep]) if self.tile_scales is not None else None
+        if self.ann is not None:
+            self.ann.select(keep)
+        paths = [self.paths[i] for i in keep]
+        mtimes = [self.mtimes[i] for i in keep]
+        sizes = [self.sizes[i] for i in keep]
+        # Swap everything at once so check_files never sees rows and lists out of step
+        with self._pending_lock:
+            self.matrix, self.scales, self.tiles, self.tile_scales = matrix, scales, tiles, tile_scales
+            self.paths, self.mtimes, self.sizes = paths, mtimes, sizes
+            self._known = set(paths).union(path for path, _, _ in self._pending_rows)
+            self._rows = None
+            self.generation += 1
+            self._dirty = True
+
+    def _flush(self):
+        """Append pending embeddings to the in-memory tail of the matrix"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+            pending_rows, self._pending_rows = self._pending_rows, []
+            pending_scales, self._pending_scales = self._pending_scales, []
+            pending_tiles, self._pending_tiles = self._pending_tiles, []
+            pending_tile_scales, self._pending_tile_scales = self._pending_tile_scales, []
+        if not pending:
+            return
+        if self.ann is not None:
+            self.ann.add(np.concatenate(pending, axis=0))
+        self.matrix = append_rows(self.matrix, pending)
+        if pending_scales:
+            self.scales = append_rows(self.scales, pending_scales)
+        if pending_tiles:
+            self.tiles = append_rows(self.tiles, pending_tiles)
+        if pending_tile_scales:
+            self.tile_scales = append_rows(self.tile_scales, pending_tile_scales)
+        # Rows are published in the row map only once their mtime and size are in place
+        with self._pending_lock:
+            rows = self._rows
+            for path, mtime, size in pending_rows:
+                self.paths.append(path)
+                self.mtimes.append(mtime)
+                self.sizes.append(size)
+                if rows is not None:
+                    rows[path] = len(self.paths) - 1
+            self._dirty = True
+
+    def save(self):
+        """Write the index to disk atomically, merging the tail, and re-map it read-only"""
+        self._flush()
+        if not self._dirty:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        matrix_tmp = self.path / (self.MATRIX + ".tmp")
+        save_rows(matrix_tmp, self.matrix, np.zeros((0, 0), dtype=self.dtype), self.dtype)
+        manifest_tmp = self.path / (self.MANIFEST + ".tmp")
+        with open(manifest_tmp, "w") as f:
+            json.dump({
+                "folder": self.folder,
+                "paths": self.paths,
+                "mtimes": self.mtimes,
+                "sizes": self.sizes,
+                "tiles": self.tile_grids
+            }, f)
+
+        scales_path = self.path / self.SCALES
+        if self.dtype == np.int8:
+            scales_tmp = self.path / (self.SCALES + ".tmp")
+            save_rows(scales_tmp, self.scales, np.zeros(0, dtype=np.float32), np.float32)
+            os.replace(scales_tmp, scales_path)
+            self.scales = AppendableRows(np.load(scales_path))
+        elif scales_path.exists():
+            os.remove(scales_path)
+
+        tiles_path = self.path / self.TILES
+        tile_scales_path = self.path / self.TILE_SCALES
+        if self.tile_count:
+            tiles_tmp = self.path / (self.TILES + ".tmp")
+            save_rows(tiles_tmp, self.tiles, np.zeros((0, self.tile_count, 0), dtype=self.dtype), self.dtype)
+        elif tiles_path.exists():
+            os.remove(tiles_path)
+        if self.tile_count and self.dtype == np.int8:
+            tile_scales_tmp = self.path / (self.TILE_SCALES + ".tmp")
+            save_rows(tile_scales_tmp, self.tile_scales, np.zeros((0, self.tile_count), dtype=np.float32), np.float32)
+            os.replace(tile_scales_tmp, tile_scales_path)
+            self.tile_scales = AppendableRows(np.load(tile_scales_path))
+        elif tile_scales_path.exists():
+            os.remove(tile_scales_path)
+
+        ann_path = self.path / self.ANN
+        if self.ann is not None:
+            ann_tmp = self.path / (self.ANN + ".tmp")
+            self.ann.save(ann_tmp)
+            os.replace(ann_tmp, ann_path)
+        elif ann_path.exists():
+            os.remove(ann_path)
+
+        os.replace(matrix_tmp, self.path / self.MATRIX)
+        if self.tile_count:
+            os.replace(tiles_tmp, tiles_path)
+            self.tiles = AppendableRows(np.load(tiles_path, mmap_mode="c"))
+        os.replace(manifest_tmp, self.path / self.MANIFEST)
+        self.matrix = AppendableRows(np.load(self.path / self.MATRIX, mmap_mode="c"))
+        self._dirty = False
+
+    def row_count(self) -> int:
+        """Number of rows, including embeddings added since the last flush"""
+        self._flush()
+        return len(self.paths)
+
+    def iter_chunks(self, chunk_size: int = 65536, stop: int = None) -> Iterator[Tuple[List[str], torch.Tensor]]:
+        """Yield (paths, float32 embeddings) in contiguous chunks, up to row stop"""
+        self._flush()
+        if self.matrix is None:
+            return
+        stop = len(self.paths) if stop is None else min(stop, len(self.paths))
+        for start in range(0, stop, chunk_size):
+            end = min(start + chunk_size, stop)
+            scales = self.scales[start:end] if self.scales is not None else None
+            yield self.paths[start:end], dequantize(self.matrix[start:end], scales)
+
+    def iter_scores(
+        self,
+        query: torch.Tensor,
+        chunk_size: int = 65536,
+        stop: int = None,
+        ids: np.ndarray = None
+    ) -> Iterator[Tuple[List[str], torch.Tensor, np.ndarray]]:
+        """
+        Yield (paths, cosine similarities, row ids) of the stored rows against a query,
+        scored directly on the stored matrix; only the given row ids when ids is set
+        A [D, Q] query matrix yields [N, Q] similarities
+        """
+        self._flush()
+        if self.matrix is None:
+            return
+        query = torch.nn.functional.normalize(query.float().cpu(), dim=0)
+        if ids is None:
+            stop = len(self.paths) if stop is None else min(stop, len(self.paths))
+            ids = np.arange(stop)
+            contiguous = True
+        else:
+            contiguous = False
+        for start in range(0, len(ids), chunk_size):
+            block_ids = ids[start:start + chunk_size]
+            if contiguous:
+                # Contiguous rows are scored straight from the memory map
+                end = start + len(block_ids)
+                block = self.matrix[start:end]
+                scales = self.scales[start:end] if self.scales is not None else None
+                paths = self.paths[start:end]
+            else:
+                block = self.matrix[block_ids]
+                scales = self.scales[block_ids] if self.scales is not None else None
+                paths = [self.paths[i] for i in block_ids]
+            yield paths, score_block(block, scales, query), block_ids
+
+    def pool_tiles(
+        self,
+        ids: np.ndarray,
+        similarities: torch.Tensor,
+        query: torch.Tensor,
+        chunk_size: int = 8192
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Max-pool the whole-image similarities of the given rows with the similarities
+        of their tiles to a unit query [D]; returns the pooled similarities and the
+        best view of every row (0 for the whole image, i for tile i - 1), or the
+        similarities unchanged and None without tiles
+        """
+        self._flush()
+        if self.tiles is None or not len(ids):
+            return similarities, None
+        query = torch.nn.functional.normalize(query.float().cpu(), dim=0)
+        pooled = similarities.clone()
+        views = torch.zeros(len(ids), dtype=torch.long)
+        for start in range(0, len(ids), chunk_size):
+            block_ids = ids[start:start + chunk_size]
+            end = start + len(block_ids)
+            # Contiguous rows are read straight from the memory map
+            if block_ids[-1] - block_ids[0] + 1 == len(block_ids):
+                block_ids = slice(int(block_ids[0]), int(block_ids[-1]) + 1)
+            block = self.tiles[block_ids]
+            scales = self.tile_scales[block_ids].reshape(-1) if self.tile_scales is not None else None
+            scores = score_block(block.reshape(-1, block.shape[-1]), scales, query).view(end - start, -1)
+            best, tile = scores.max(dim=1)
+            better = best > pooled[start:end]
+            pooled[start:end] = torch.where(better, best, pooled[start:end])
+            views[start:end] = torch.where(better, tile + 1, views[start:end])
+        return pooled, views
+
+    def embeddings(self, ids: np.ndarray) -> torch.Tensor:
+        """Return float32 embeddings of the given rows"""
+        self._flush()
+        scales = self.scales[ids] if self.scales is not None else None
+        return dequantize(self.matrix[ids], scales)
+
+    def ensure_ann(self, nlist: int = None) -> Optional[IVFIndex]:
+        """
+        Build the ANN index if it is missing or stale
+        Returns None for libraries too small to benefit from it
+        """
+        self._flush()
+        if len(self.paths) < ANN_MIN_SIZE:
+            return None
+        if self.ann is None or self.ann.needs_rebuild():
+            self.ann = IVFIndex.build(self.matrix, nlist)
+            self._dirty = True
+        return self.ann
+
+
+def get_index(folder: str) -> EmbeddingIndex:
+    """Return the shared index for a folder, loading it on first use"""
+    folder = os.path.abspath(folder)
+    if folder not in _indexes:
+        _indexes[folder] = EmbeddingIndex(folder)
+    return _indexes[folder]
+
+
+# Offline bulk indexing
+#
+#   python -m backend.index build <folder> [--workers N]
+#   python -m backend.index build <folder> --shards N --shard I   (one machine per shard)
+#   python -m backend.index merge <folder>
+#
+# Each shard encodes the images whose path hashes to it and writes append-only
+# checkpoint chunks below index_cache/<folder>/shards/, so an interrupted build
+# resumes where it stopped. Merging folds the chunks into the regular index.
+
+SHARDS_DIR = "shards"
+
+# Images encoded between two checkpoints
+CHECKPOINT_EVERY = 4096
+
+
+def shard_of(path: str, shards: int) -> int:
+    """Stable shard number of a path, identical on every machine"""
+    return int(hashlib.sha1(path.encode("utf-8")).hexdigest()[:8], 16) % shards
+
+
+def shard_dir_for(folder: str, shard: int, shards: int) -> Path:
+    """Return the checkpoint directory of one shard of a folder"""
+    return index_dir_for(folder) / SHARDS_DIR / f"{shard:03d}-of-{shards:03d}"
+
+
+def iter_checkpoints(shard_dir: Path) -> Iterator[Tuple[Dict, Path]]:
+    """Yield (rows, matrix path) for every committed checkpoint chunk of a shard"""
+    for rows_path in sorted(shard_dir.glob("chunk_*.json")):
+        try:
+            with open(rows_path, "r") as f:
+                rows = json.load(f)
+        except Exception as e:
+            print(f"Error reading checkpoint {rows_path}: {str(e)}")
+            continue
+        yield rows, rows_path.with_suffix(".npy")
+
+
+def write_checkpoint(shard_dir: Path, rows: List[Tuple[str, float, int]], embeddings: np.ndarray):
+    """
+    Write one checkpoint chunk; the JSON file is written last and marks it complete
+    Chunks are float16 and converted to the index precision on merge
+    """
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    numbers = [int(path.stem.split("_")[1]) for path in shard_dir.glob("chunk_*.json")]
+    number = max(numbers) + 1 if numbers else 0
+    name = shard_dir / f"chunk_{number:06d}"
+    with open(name.with_suffix(".npy.tmp"), "wb") as f:
+        np.save(f, np.ascontiguousarray(embeddings, dtype=np.float16))
+    os.replace(name.with_suffix(".npy.tmp"), name.with_suffix(".npy"))
+    with open(name.with_suffix(".json.tmp"), "w") as f:
+        json.dump({
+            "paths": [path for path, _, _ in rows],
+            "mtimes": [mtime for _, mtime, _ in rows],
+            "sizes": [size for _, _, size in rows]
+        }, f)
+    os.replace(name.with_suffix(".json.tmp"), name.with_suffix(".json"))
+
+
+def build_shard(
+    folder: str,
+    shard: int = 0,
+    shards: int = 1,
+    batch_size: int = 64,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    threads: int = 0
+):
+    """Encode the images of one shard of a folder into checkpoint chunks"""
+    from .clip_utils import load_model, iter_image_batches
+
+    if threads:
+        torch.set_num_threads(threads)
+    folder = os.path.abspath(folder)
+    shard_dir = shard_dir_for(folder, shard, shards)
+    label = f"[shard {shard + 1}/{shards}]"
+
+    # Skip images that are already indexed or checkpointed with the same mtime and size
+    files = [row for row in scan_folder(folder) if shard_of(row[0], shards) == shard]
+    done = {}
+    index = EmbeddingIndex(folder)
+    done.update(zip(index.paths, zip(index.mtimes, index.sizes)))
+    # Checkpoints of earlier runs count too, even with a different shard count
+    for other_dir in shard_dir.parent.glob("*-of-*"):
+        for rows, _ in iter_checkpoints(other_dir):
+            done.update(zip(rows["paths"], zip(rows["mtimes"], rows["sizes"])))
+    todo = [(path, mtime, size) for path, mtime, size in files if done.get(path) != (mtime, size)]
+    print(f"{label} {len(files)} images, {len(files) - len(todo)} already indexed, {len(todo)} to encode")
+    if not todo:
+        return
+
+    model, preprocess = load_model()
+    stats = {path: (mtime, size) for path, mtime, size in todo}
+
+    async def run():
+        rows, blocks = [], []
+        processed = 0
+        start = time.time()
+        async for batch_paths, valid_paths, embeddings in iter_image_batches(
+            [path for path, _, _ in todo], model, preprocess, batch_size
+        ):
+            if embeddings is not None:
+                rows.extend((path,) + stats[path] for path in valid_paths)
+                blocks.append(embeddings.cpu().numpy())
+            processed += len(batch_paths)
+            if len(rows) >= checkpoint_every:
+                write_checkpoint(shard_dir, rows, np.concatenate(blocks))
+                rows, blocks = [], []
+
+            throughput = processed / max(time.time() - start, 1e-6)
+            eta = (len(todo) - processed) / max(throughput, 1e-6)
+            print(f"{label} {processed}/{len(todo)} images, {throughput:.1f} img/s, ETA {eta / 60:.1f} min", flush=True)
+        if rows:
+            write_checkpoint(shard_dir, rows, np.concatenate(blocks))
+
+    asyncio.run(run())
+
+
+def merge_shards(folder: str) -> "EmbeddingIndex":
+    """Fold the checkpoint chunks of every shard into the index of a folder"""
+    index = EmbeddingIndex(os.path.abspath(folder))
+    files = scan_folder(index.folder)
+    current = {path: (mtime, size) for path, mtime, size in files}
+    stale = set(index.sync(files))
+
+    shards_root = index.path / SHARDS_DIR
+    merged = 0
+    for shard_dir in sorted(shards_root.glob("*-of-*")) if shards_root.exists() else []:
+        for rows, matrix_path in iter_checkpoints(shard_dir):
+            # Images modified since they were checkpointed are left for the next build
+            keep = [
+                i for i, path in enumerate(rows["paths"])
+                if path in stale and current.get(path) == (rows["mtimes"][i], rows["sizes"][i])
+            ]
+            if not keep:
+                continue
+            block = np.load(matrix_path)[keep]
+            index.add([rows["paths"][i] for i in keep], torch.from_numpy(block))
+            stale.difference_update(rows["paths"][i] for i in keep)
+            merged += len(keep)
+
+    index.ensure_ann()
+    index.save()
+    if shards_root.exists():
+        shutil.rmtree(shards_root)
+    print(f"Merged {merged} images; index holds {len(index)} images, {len(stale)} still to encode")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline bulk indexing of image folders")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Encode every image of a folder into its index")
+    build.add_argument("folder")
+    build.add_argument("--workers", type=int, default=1, help="Local worker processes, one shard each")
+    build.add_argument("--shards", type=int, default=None, help="Total shards when splitting across machines (with --shard)")
+    build.add_argument("--shard", type=int, default=None, help="Shard encoded by this machine (0-based)")
+    build.add_argument("--batch-size", type=int, default=64)
+    build.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="Images between checkpoints")
+    build.add_argument("--no-merge", action="store_true", help="Leave checkpoints unmerged")
+
+    merge = commands.add_parser("merge", help="Fold shard checkpoints into the index")
+    merge.add_argument("folder")
+
+    args = parser.parse_args()
+    if args.command == "merge":
+        merge_shards(args.folder)
+        return
+
+    if args.shard is not None and (args.shards is None or not 0 <= args.shard < args.shards):
+        parser.error("--shard requires --shards and must be below it")
+
+    start = time.time()
+    if args.shard is not None:
+        # One shard of a multi-machine build; merge once every shard is done
+        build_shard(args.folder, args.shard, args.shards, args.batch_size, args.checkpoint_every)
+        print(f"Shard done in {time.time() - start:.1f}s; run `python -m backend.index merge` after all shards")
+        return
+
+    shards = max(1, args.workers)
+    if shards == 1:
+        build_shard(args.folder, 0, 1, args.batch_size, args.checkpoint_every)
+    else:
+        # Split the CPU threads between worker processes
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(
+                target=build_shard,
+                args=(args.folder, shard, shards, args.batch_size, args.checkpoint_every, threads)
+            )
+            for shard in range(shards)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode != 0 for worker in workers):
+            print("Some shards failed; re-run the same command to resume")
+            sys.exit(1)
+    print(f"Encoding done in {time.time() - start:.1f}s")
+
+    if not args.no_merge:
+        merge_shards(args.folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
@@ -8,28 +8,77 @@ import io
 import base64
 from pathlib import Path
 import asyncio
-from typing import List, Dict
+from typing import List, Dict, Tuple, Optional
+from pydantic import BaseModel
 import time
-import tkinter as tk
-from tkinter import filedialog
 import json
 import torch
 import torch.nn.functional as F
-import clip
+import numpy as np
 from .clip_utils import (
     load_model,
-    get_image_embedding,
     process_image_batch,
     tokenize_search_query,
-    async_get_token_similarities
+    encode_texts,
+    score_tokens,
+    format_token_similarities,
+    thread_pool,
+    inference_executor,
+    decode_pool_for
 )
+from .index import get_index, scan_folder, stream_folder
+from .ann import DEFAULT_NPROBE, ANN_MIN_SIZE, IVFIndex
+from .topk import TopK
+from .tiles import pool_views, whole_image, region_of
+from .watcher import indexer
+from .progress import ProgressChannel, SearchCancelled
+from .scheduler import scheduler, encode_into_index, encode_stream_into_index, SEARCH_PRIORITY
+from .thumbnails import get_thumbnail, DEFAULT_THUMB_SIZE, THUMB_MEDIA_TYPE
+from .models import ModelLoader
+from .duplicates import find_duplicates, perceptual_hash, DEFAULT_THRESHOLD, DEFAULT_DUPLICATE_NPROBE
+from .metrics import metrics
+from .results import result_store, MAX_PAGE_SIZE
+from .query_cache import query_cache, normalize_text
+from .tags import get_tag_store, load_labels, label_matrix, TAGS_PER_IMAGE, MIN_TAG_SCORE
 import uuid
-from collections import defaultdict
 
 app = FastAPI()
 
-# Store search progress
-search_progress = defaultdict(dict)
+# Progress of searches and jobs by id; an entry is removed PROGRESS_KEEP_SECONDS
+# after its job finishes
+search_progress: Dict[str, ProgressChannel] = {}
+
+# Seconds a finished search's progress stays available to /search-progress
+PROGRESS_KEEP_SECONDS = 300
+
+# Seconds a running search survives without any progress listener, so a
+# reconnecting EventSource or a brief network drop does not cancel it
+DISCONNECT_GRACE_SECONDS = float(os.environ.get("CLIP_DISCONNECT_GRACE_SECONDS", "15"))
+
+# Number of best matches streamed while a search is running
+PARTIAL_RESULTS = 50
+
+# Number of results per SSE event when a search completes
+RESULT_CHUNK_SIZE = 100
+
+# Most queries accepted by one /search/batch request
+MAX_BATCH_QUERIES = 256
+
+# Images hashed per step of the perceptual-hash pre-filter
+HASH_CHUNK_SIZE = 1024
+
+# Seconds a completed search's stored scores are re-filtered for a new
+# min_score or top_k instead of searching the folder again
+RESULT_REUSE_SECONDS = float(os.environ.get("CLIP_RESULT_REUSE_SECONDS", "300"))
+
+# Separates the roots of a multi-folder search in settings and stored results
+ROOT_SEPARATOR = ";"
+
+# Progress of searches that are still running, so they can be cancelled
+running_searches: Dict[str, ProgressChannel] = {}
+
+# Recently completed searches by query and folder
+completed_searches: Dict[tuple, Dict] = {}
 
 # CORS middleware
 app.add_middleware(
@@ -40,38 +89,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load model globally
-model, preprocess = load_model()
+# The model loads in the background at startup; requests that need it wait on it
+model_loader = ModelLoader(load_model)
 
 # Settings file path
 SETTINGS_FILE = "settings.json"
 
+# Last used settings, cached after the first read
+last_settings: Optional[Dict] = None
+
+# Default number of results returned per search (0 returns every match)
+DEFAULT_TOP_K = 500
+
+# Most results a search keeps, so its top-k buffer has a fixed size even with
+# top_k=0 (0 lifts the limit)
+MAX_RESULTS = int(os.environ.get("CLIP_MAX_RESULTS", "100000"))
+
 # Get project root directory
 ROOT_DIR = Path(__file__).parent.parent
 
 # Mount frontend directory
 app.mount("/static", StaticFiles(directory=str(ROOT_DIR / "frontend")), name="static")
 
-def save_last_settings(query_path: str, folder_path: str, results=None):
-    """Save the last used image, folder paths and results"""
+def save_last_settings(query_path: str, folder_path: str, search_id: str = None):
+    """Save the last used image and folder paths and the id of the last search's stored results"""
+    global last_settings
     settings = {
         "last_query": query_path,
         "last_folder": folder_path,
-        "last_results": results if results else [],
+        "last_search_id": search_id,
         "timestamp": time.time()
     }
-    with open(SETTINGS_FILE, "w") as f:
+    last_settings = settings
+    with metrics.time("settings"), open(SETTINGS_FILE, "w") as f:
         json.dump(settings, f)
 
-def get_last_settings() -> Dict:
-    """Get the last used settings"""
+def get_image_size(path: str):
+    """Return (width, height) of an image, or (0, 0) if it cannot be read"""
     try:
-        if os.path.exists(SETTINGS_FILE):
-            with open(SETTINGS_FILE, "r") as f:
-                return json.load(f)
+        with metrics.time("dimensions"), Image.open(path) as img:
+            return img.size
     except Exception as e:
-        print(f"Error reading settings: {e}")
-    return {"last_query": None, "last_folder": None, "timestamp": None}
+        print(f"Error reading image size {path}: {str(e)}")
+        return 0, 0
+
+def get_last_settings() -> Dict:
+    """Get the last used settings; the file is only read once"""
+    global last_settings
+    if last_settings is None:
+        last_settings = {"last_query": None, "last_folder": None, "last_search_id": None, "timestamp": None}
+        try:
+            if os.path.exists(SETTINGS_FILE):
+                with open(SETTINGS_FILE, "r") as f:
+                    settings = json.load(f)
+                # Settings written by older versions embed the full result list
+                settings.pop("last_results", None)
+                last_settings.update(settings)
+        except Exception as e:
+            print(f"Error reading settings: {e}")
+    return last_settings
+
+def start_model_services(model, preprocess):
+    """Start the inference scheduler and keep registered folders indexed in the background"""
+    scheduler.start(model)
+    indexer.start(model, preprocess)
+
+@app.on_event("startup")
+async def start_model_loading():
+    """Load the model without blocking startup"""
+    model_loader.start(on_ready=start_model_services)
+
+async def get_model():
+    """Wait for the model; 503 if it failed to load"""
+    try:
+        return await model_loader.wait()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.on_event("shutdown")
+async def stop_indexer():
+    await indexer.stop()
+    await scheduler.stop()
+
+@app.get("/ready")
+async def get_readiness():
+    """Readiness probe: 200 once the model is loaded, 503 while it is loading or if it failed"""
+    status = model_loader.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @app.get("/")
 async def read_root():
@@ -82,6 +186,18 @@ async def get_settings():
     """Get the last used settings"""
     return get_last_settings()
 
+@app.get("/results/{search_id}")
+async def get_results(search_id: str, offset: int = 0, limit: int = 100):
+    """A page of the stored results of a search, best match first"""
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}")
+    loop = asyncio.get_event_loop()
+    page = await loop.run_in_executor(thread_pool, result_store.page, search_id, offset, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Unknown search")
+    meta, total, results = page
+    return {"search_id": search_id, **meta, "total": total, "offset": offset, "limit": limit, "results": results}
+
 @app.get("/image/{path:path}")
 async def get_image(path: str):
     """Serve image files safely"""
@@ -90,10 +206,29 @@ async def get_image(path: str):
     except Exception as e:
         raise HTTPException(status_code=404, detail="Image not found")
 
+@app.get("/thumb/{path:path}")
+async def get_thumb(path: str, request: Request, size: int = DEFAULT_THUMB_SIZE):
+    """Serve a cached thumbnail of an image, generating it on first request"""
+    try:
+        loop = asyncio.get_event_loop()
+        thumb_path, etag = await loop.run_in_executor(thread_pool, get_thumbnail, path, size)
+    except Exception as e:
+        print(f"Error creating thumbnail for {path}: {str(e)}")
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(thumb_path, media_type=THUMB_MEDIA_TYPE, headers=headers)
+
 @app.post("/select-image")
 async def select_image():
     """Open native file selection dialog and return the selected file's info"""
     try:
+        # tkinter is only needed for this desktop dialog
+        import tkinter as tk
+        from tkinter import filedialog
+        
         root = tk.Tk()
         root.withdraw()
         root.attributes('-topmost', True)
@@ -128,32 +263,264 @@ async def select_image():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def search_progress_generator(search_id: str):
-    """Generate SSE events for search progress"""
-    while True:
-        if search_id in search_progress:
-            progress = search_progress[search_id]
-            if 'error' in progress:
+async def search_progress_generator(search_id: str, limit: int = None):
+    """
+    Generate SSE events for search progress, sending only when something changed
+    With limit, only the first limit final results are sent; the rest can be paged from /results
+    """
+    if search_id not in search_progress:
+        yield f"data: {json.dumps({'type': 'error', 'message': 'Unknown or expired search'})}\n\n"
+        return
+    
+    loop = asyncio.get_event_loop()
+    progress = search_progress[search_id]
+    version = -1
+    sent_progress = None
+    sent_partial = None
+    progress.listeners += 1
+    try:
+        while True:
+            version = await progress.wait(version)
+            if progress.cancelled:
+                yield f"data: {json.dumps({'type': 'cancelled', 'search_id': search_id})}\n\n"
+                break
+            elif 'error' in progress:
                 yield f"data: {json.dumps({'type': 'error', 'message': progress['error']})}\n\n"
                 break
+            elif 'done' in progress and progress.get('stored'):
+                # Stored search results are read back a chunk at a time
+                count = progress['result_count']
+                end = count if limit is None else min(limit, count)
+                for offset in range(0, end, RESULT_CHUNK_SIZE):
+                    page = await loop.run_in_executor(
+                        thread_pool, result_store.page, search_id, offset, min(RESULT_CHUNK_SIZE, end - offset)
+                    )
+                    if page is None:
+                        break
+                    yield f"data: {json.dumps({'type': 'results', 'offset': offset, 'results': page[2]})}\n\n"
+                yield f"data: {json.dumps({'type': 'complete', 'total': count, 'search_id': search_id})}\n\n"
+                break
             elif 'done' in progress:
-                yield f"data: {json.dumps({'type': 'complete', 'results': progress['results']})}\n\n"
+                # Send the final results in chunks rather than one giant event
+                results = progress['results']
+                sent = results if limit is None else results[:limit]
+                for offset in range(0, len(sent), RESULT_CHUNK_SIZE):
+                    chunk = sent[offset:offset + RESULT_CHUNK_SIZE]
+                    yield f"data: {json.dumps({'type': 'results', 'offset': offset, 'results': chunk})}\n\n"
+                yield f"data: {json.dumps({'type': 'complete', 'total': len(results), 'search_id': search_id})}\n\n"
                 break
-            else:
-                yield f"data: {json.dumps({'type': 'progress', **progress})}\n\n"
-        await asyncio.sleep(0.1)  # Check progress every 100ms
+            
+            state = {key: value for key, value in progress.items() if key != 'partial'}
+            if state != sent_progress:
+                yield f"data: {json.dumps({'type': 'progress', **state})}\n\n"
+                sent_progress = state
+            
+            partial = progress.get('partial')
+            if partial is not None and partial is not sent_partial:
+                yield f"data: {json.dumps({'type': 'partial', 'results': partial})}\n\n"
+                sent_partial = partial
+    finally:
+        # A search nobody is watching any more is cancelled unless a client reconnects
+        progress.listeners -= 1
+        if progress.listeners == 0 and not progress.finished and search_id in running_searches:
+            progress.disconnects += 1
+            asyncio.create_task(cancel_abandoned_search(search_id, progress))
+
+async def cancel_abandoned_search(search_id: str, progress: ProgressChannel):
+    """Cancel a search whose listeners have all been gone for DISCONNECT_GRACE_SECONDS"""
+    disconnects = progress.disconnects
+    await asyncio.sleep(DISCONNECT_GRACE_SECONDS)
+    # A client that reconnected (and maybe left again since) resets the grace period
+    if progress.listeners == 0 and progress.disconnects == disconnects and not progress.finished \
+            and running_searches.get(search_id) is progress:
+        print(f"Client disconnected, cancelling search {search_id}")
+        progress.cancel()
 
 @app.get("/search-progress/{search_id}")
-async def get_search_progress(search_id: str):
+async def get_search_progress(search_id: str, limit: int = None):
     """SSE endpoint for search progress updates"""
     return StreamingResponse(
-        search_progress_generator(search_id),
+        search_progress_generator(search_id, limit),
         media_type="text/event-stream"
     )
 
+@app.delete("/search/{search_id}")
+async def cancel_search(search_id: str):
+    """Cancel a running search; it stops at its next batch and frees its slot"""
+    progress = running_searches.get(search_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Search not found or already finished")
+    progress.cancel()
+    return {"search_id": search_id, "cancelled": True}
+
+async def update_index(progress: ProgressChannel, index) -> List[str]:
+    """
+    Scan the folder of an index, evict deleted or modified images
+    and return the images that still need to be encoded
+    """
+    loop = asyncio.get_event_loop()
+    
+    # Get total number of images first
+    progress.update({'progress': 20, 'status': 'Scanning folder...'})
+    scan_start = time.perf_counter()
+    image_files = await loop.run_in_executor(thread_pool, scan_folder, index.folder)
+    metrics.observe("scan", time.perf_counter() - scan_start, len(image_files))
+    
+    # Only new or modified images need to be encoded
+    return index.sync(image_files)
+
+async def encode_stale_images(
+    progress: ProgressChannel,
+    index,
+    stale_files: List[str],
+    preprocess,
+    batch_size: int,
+    priority: int,
+    on_batch=None,
+    progress_range: Tuple[int, int] = (30, 90)
+):
+    """Encode new or modified images into the index, reporting progress per batch"""
+    total_images = len(stale_files)
+    encode_start = time.time()
+    first, last = progress_range
+    
+    def on_progress(processed_images):
+        # Update progress after each batch
+        percent = int(first + (processed_images / total_images * (last - first)))
+        throughput = processed_images / max(time.time() - encode_start, 1e-6)
+        progress.update({
+            'progress': percent,
+            'status': f'Processing images... ({processed_images}/{total_images}, {throughput:.1f} img/s)',
+            'processed': processed_images,
+            'total': total_images,
+            'images_per_sec': round(throughput, 1)
+        })
+    
+    # Batches are merged with other searches' work by the inference scheduler
+    await encode_into_index(index, stale_files, preprocess, batch_size, priority, on_batch, on_progress)
+
+def update_root_progress(channel: ProgressChannel, root: str, **fields):
+    """
+    Update the progress of one root of a search and recompute the search's overall
+    progress, image counts and throughput from all of its roots
+    """
+    # The roots dict is replaced rather than mutated so SSE streams see the change
+    roots = dict(channel.get('roots', {}))
+    roots[root] = dict(roots.get(root, {}), **fields)
+    states = list(roots.values())
+    processed = sum(state.get('processed', 0) for state in states)
+    total = sum(state.get('total', 0) for state in states)
+    throughput = sum(state.get('images_per_sec', 0.0) for state in states if not state.get('done'))
+    if len(roots) == 1:
+        status = roots[root].get('status', '')
+    else:
+        finished = sum(1 for state in states if state.get('done'))
+        status = (
+            f'Searching {len(roots)} folders ({finished} done)... '
+            f'({processed}/{total}, {throughput:.1f} img/s)'
+        )
+    channel.update({
+        'roots': roots,
+        'progress': int(sum(state.get('progress', 0) for state in states) / len(states)),
+        'status': status,
+        'processed': processed,
+        'total': total,
+        'images_per_sec': round(throughput, 1)
+    })
+
+async def encode_discovered_images(
+    channel: ProgressChannel,
+    root: str,
+    index,
+    discovered: set,
+    batches,
+    preprocess,
+    batch_size: int,
+    priority: int,
+    on_batch=None,
+    executor=None,
+    progress_range: Tuple[int, int] = (30, 90)
+):
+    """Encode images of one root while its scan is still finding them, reporting progress per batch"""
+    encode_start = time.time()
+    first, last = progress_range
+    
+    def on_progress(processed_images):
+        # The total grows until the scan is complete
+        total_images = max(len(discovered), processed_images)
+        percent = int(first + (processed_images / total_images * (last - first)))
+        throughput = processed_images / max(time.time() - encode_start, 1e-6)
+        update_root_progress(
+            channel, root,
+            progress=percent,
+            status=f'Processing images... ({processed_images}/{total_images}, {throughput:.1f} img/s)',
+            processed=processed_images,
+            total=total_images,
+            images_per_sec=round(throughput, 1)
+        )
+    
+    await encode_stream_into_index(
+        index, batches, preprocess, batch_size, priority, on_batch, on_progress, executor=executor
+    )
+
+def score_batch(
+    top: TopK,
+    paths: List[str],
+    similarities: torch.Tensor,
+    hit_embeddings,
+    min_score: float,
+    search_type: str,
+    tokens: List[str],
+    token_embeddings,
+    views: torch.Tensor = None
+) -> bool:
+    """
+    Add a batch of cosine similarities to the running top-k; returns whether it changed
+    hit_embeddings(rows) returns the embeddings of the given batch rows for token scoring
+    views holds the best-matching view of every row of tiled images
+    """
+    scores = (similarities + 1) / 2
+    hits = torch.nonzero(scores >= min_score).squeeze(1)
+    if len(hits) == 0:
+        return False
+    
+    # Score every hit against every token in one matrix multiply
+    hit_scores = scores[hits]
+    final_scores = hit_scores
+    hit_token_scores = None
+    if token_embeddings is not None:
+        with metrics.time("tokens", len(hits)):
+            hit_token_scores = score_tokens(hit_embeddings(hits), token_embeddings)
+        final_scores = (final_scores + hit_token_scores.mean(dim=1)) / 2
+    
+    # Only hits that can still enter the top-k are materialized
+    keep = top.candidates(final_scores)
+    items = []
+    for row in keep.tolist():
+        path = paths[hits[row].item()]
+        
+        if hit_token_scores is not None:
+            token_similarities = format_token_similarities(tokens, hit_token_scores[row])
+            description = ", ".join([f"{token} ({score:.1%})" for token, score in token_similarities])
+        elif search_type == 'text':
+            description = ""
+        else:
+            description = "Processing..."
+        
+        # min_score applies to the image similarity, so it is kept for re-filtering
+        items.append({
+            "path": path,
+            "filename": os.path.basename(path),
+            "similarity": round(hit_scores[row].item(), 6),
+            "description": description,
+            "region": region_of(views[hits[row]].item()) if views is not None else None
+        })
+    top.push(final_scores[keep], items)
+    return len(items) > 0
+
 async def process_search(
     search_id: str,
-    folder: str,
+    folders: List[str],
     query_embedding: torch.Tensor,
     model,
     preprocess,
@@ -162,123 +529,428 @@ async def process_search(
     search_type: str,
     query_text: str = None,
     query_path: str = None,
-    device = None
+    mode: str = 'exact',
+    nprobe: int = DEFAULT_NPROBE,
+    top_k: int = DEFAULT_TOP_K,
+    priority: int = SEARCH_PRIORITY,
+    tags: str = None,
+    rescan: bool = False
 ):
-    """Asynchronous function to process search request"""
+    """
+    Asynchronous function to process search request
+    Every root is scanned, encoded and scored by its own worker, on the listing and
+    decode pools of its device, and all of them feed one global top-k
+    A cancelled search stops at its next batch and releases its slot
+    """
+    workers = []
+    progress = search_progress[search_id]
     try:
-        results = []
-        supported_formats = {'.jpg', '.jpeg', '.png', '.gif'}
-        
-        # Get total number of images first
-        search_progress[search_id].update({'progress': 20, 'status': 'Scanning folder...'})
-        image_files = []
-        for root, _, files in os.walk(folder):
-            image_files.extend([
-                os.path.join(root, f) for f in files
-                if os.path.splitext(f)[1].lower() in supported_formats
-            ])
+        progress.check()
+        loop = asyncio.get_event_loop()
+        # top_k=0 still keeps at most MAX_RESULTS, so the top-k buffer has a fixed size
+        top = TopK(min([k for k in (top_k, MAX_RESULTS) if k > 0], default=0))
+        
+        # Encode the query tokens once for the whole search
+        tokens = tokenize_search_query(query_text) if search_type == 'text' else []
+        token_embeddings = None
+        if tokens:
+            with metrics.time("query", len(tokens)):
+                token_embeddings = await loop.run_in_executor(
+                    inference_executor, encode_texts, tokens, model
+                )
         
-        total_images = len(image_files)
-        processed_images = 0
+        def publish(paths, similarities, hit_embeddings, views=None):
+            """Score a batch and publish the current best matches"""
+            if score_batch(top, paths, similarities, hit_embeddings, min_score, search_type, tokens, token_embeddings, views):
+                progress['partial'] = [
+                    dict(item, score=score) for score, item in top.results()[:PARTIAL_RESULTS]
+                ]
         
-        # Process images in batches
-        for i in range(0, len(image_files), batch_size):
-            batch_paths = image_files[i:i + batch_size]
+        async def search_root(root: str):
+            """Scan, encode and score one root"""
+            index = get_index(root)
+            decode_pool = decode_pool_for(root)
+            encoding = None
             
-            # Process batch concurrently
-            valid_paths, batch_embeddings = await process_image_batch(batch_paths, model, preprocess)
+            # Tag filters are resolved to a set of paths up front from the tag index
+            allowed = get_tag_store(root).lookup(tags) if tags else None
             
-            # Update progress after each batch
-            processed_images += len(batch_paths)
-            progress = int(30 + (processed_images / total_images * 60))
-            search_progress[search_id].update({
-                'progress': progress,
-                'status': f'Processing images... ({processed_images}/{total_images})',
-                'processed': processed_images,
-                'total': total_images
-            })
+            def on_batch(paths, embeddings):
+                """Score a batch of freshly encoded embeddings"""
+                progress.check()
+                if allowed is not None:
+                    keep = [i for i, path in enumerate(paths) if path in allowed]
+                    paths, embeddings = [paths[i] for i in keep], embeddings[keep]
+                    if not paths:
+                        return
+                with metrics.time("score", len(paths)):
+                    # Tiled images score as their best-matching view
+                    similarities, views = pool_views(embeddings, query_embedding)
+                    publish(paths, similarities, lambda rows: whole_image(embeddings)[rows], views)
+            
+            # Images this search encodes itself (new or modified); they are scored
+            # as they are encoded, so the pass over indexed rows skips them
+            stale = set()
+            scanned = asyncio.Event()
             
-            if batch_embeddings is not None:
-                # Calculate similarities for the batch
-                similarities = F.cosine_similarity(batch_embeddings, query_embedding.unsqueeze(0))
+            async def discover():
+                """
+                Stream new images from the folder scan, then evict deleted and modified ones
+                Scanned rows are only marked in a bitmap, so the file list is never held
+                """
+                scan_start = time.perf_counter()
+                scanned_files = 0
+                async with index.lock:
+                    seen = np.zeros(index.row_count(), dtype=bool)
+                    generation = index.generation
+                modified = []
+                async for batch in stream_folder(root, reuse=not rescan):
+                    progress.check()
+                    scanned_files += len(batch)
+                    new = [path for path in index.new_paths(batch) if path not in stale]
+                    modified.extend(index.check_files(batch, seen))
+                    stale.update(new)
+                    yield new
+                metrics.observe("scan", time.perf_counter() - scan_start, scanned_files)
+                async with index.lock:
+                    index.sweep(seen, generation, modified)
+                del seen
+                modified = [path for path in modified if path not in stale]
+                stale.update(modified)
+                scanned.set()
+                yield modified
+            
+            try:
+                # Folders kept current by the background indexer skip straight to scoring;
+                # otherwise encoding starts with the first directory listed
+                if indexer.is_current(root):
+                    scanned.set()
+                else:
+                    update_root_progress(progress, root, progress=20, status='Scanning folder...')
+                    encoding = asyncio.ensure_future(encode_discovered_images(
+                        progress, root, index, stale, discover(), preprocess, batch_size, priority,
+                        on_batch, decode_pool
+                    ))
+                    waiting = asyncio.ensure_future(scanned.wait())
+                    await asyncio.wait({encoding, waiting}, return_when=asyncio.FIRST_COMPLETED)
+                    waiting.cancel()
+                    if encoding.done() and not scanned.is_set():
+                        encoding.result()
                 
-                # Process results
-                for path, similarity, img_embedding in zip(valid_paths, similarities, batch_embeddings):
-                    score = (similarity.item() + 1) / 2
+                async with index.lock:
+                    indexed_rows = index.row_count()
+                    
+                    # Approximate search only scores the closest inverted lists
+                    ann = None
+                    if mode == 'ann':
+                        ann = await loop.run_in_executor(thread_pool, index.ensure_ann)
                     
-                    if score >= min_score:
-                        token_scores = []
-                        description = ""
-                        
-                        if search_type == 'text':
-                            # Get individual token similarities concurrently
-                            tokens = tokenize_search_query(query_text)
-                            token_similarities = await async_get_token_similarities(
-                                img_embedding,
-                                tokens,
-                                model,
-                                device
-                            )
-                            
-                            description = ", ".join([f"{token} ({score:.1%})" for token, score in token_similarities])
-                            token_scores = [score for _, score in token_similarities]
-                            
-                            if token_scores:
-                                final_score = (score + sum(token_scores) / len(token_scores)) / 2
-                            else:
-                                final_score = score
-                        else:
-                            final_score = score
-                            description = "Processing..."
-                        
-                        with Image.open(path) as img:
-                            width, height = img.size
-                            aspect_ratio = height / width
-                        
-                        results.append({
-                            "path": path,
-                            "filename": os.path.basename(path),
-                            "score": final_score,
-                            "description": description,
-                            "width": width,
-                            "height": height,
-                            "aspect_ratio": aspect_ratio
-                        })
-        
-        # Sort results by similarity score
-        results.sort(key=lambda x: x["score"], reverse=True)
-        
-        # Update progress with completion
-        search_progress[search_id].update({
+                    # Score what is already indexed while new images are still encoding
+                    update_root_progress(progress, root, status='Scoring indexed images...', indexed=indexed_rows)
+                    # Indexed rows are scored directly on the stored (possibly quantized) matrix
+                    ids = None
+                    if allowed is not None or stale:
+                        mask = np.full(indexed_rows, allowed is None, dtype=bool)
+                        if allowed is not None:
+                            mask[index.rows_of(allowed, indexed_rows)] = True
+                        mask[index.rows_of(stale, indexed_rows)] = False
+                        ids = np.flatnonzero(mask)
+                        del mask
+                    if ann is not None:
+                        candidates = ann.candidates(query_embedding, nprobe)
+                        candidates = candidates[candidates < indexed_rows]
+                        ids = candidates if ids is None else np.intersect1d(candidates, ids)
+                    if ids is not None:
+                        chunks = index.iter_scores(query_embedding, ids=ids)
+                    else:
+                        chunks = index.iter_scores(query_embedding, stop=indexed_rows)
+                    # Chunks are scored lazily, so each chunk is timed from the previous one
+                    chunk_start = time.perf_counter()
+                    for valid_paths, similarities, row_ids in chunks:
+                        progress.check()
+                        similarities, views = index.pool_tiles(row_ids, similarities, query_embedding)
+                        publish(valid_paths, similarities, lambda rows: index.embeddings(row_ids[rows.numpy()]), views)
+                        metrics.observe("score", time.perf_counter() - chunk_start, len(valid_paths))
+                        await asyncio.sleep(0)
+                        chunk_start = time.perf_counter()
+                
+                # Encoding runs outside the lock so concurrent searches of the folder share it
+                if encoding is not None:
+                    await encoding
+                async with index.lock:
+                    save_start = time.perf_counter()
+                    await loop.run_in_executor(thread_pool, index.save)
+                    metrics.observe("index_save", time.perf_counter() - save_start, len(stale))
+                update_root_progress(progress, root, progress=95, status='Done', done=True)
+            except SearchCancelled:
+                raise
+            except Exception as e:
+                # A failing root does not stop the others
+                print(f"Error searching {root}: {str(e)}")
+                update_root_progress(progress, root, progress=95, status=f'Error: {str(e)}', error=str(e), done=True)
+            finally:
+                if encoding is not None and not encoding.done():
+                    encoding.cancel()
+        
+        for root in folders:
+            update_root_progress(progress, root, progress=0, status='Waiting...', done=False)
+        workers = [asyncio.ensure_future(search_root(root)) for root in folders]
+        await asyncio.gather(*workers)
+        progress.check()
+        
+        errors = [state['error'] for state in progress['roots'].values() if 'error' in state]
+        if len(errors) == len(folders):
+            raise RuntimeError(errors[0])
+        
+        # Image dimensions are only read for the final results
+        results = [dict(item, score=score) for score, item in top.results()]
+        sizes = await asyncio.gather(*[
+            loop.run_in_executor(thread_pool, get_image_size, result["path"])
+            for result in results
+        ])
+        for result, (width, height) in zip(results, sizes):
+            result.update({
+                "width": width,
+                "height": height,
+                "aspect_ratio": height / width if width else 1.0
+            })
+        
+        # Results are stored before completion is announced so they can be paged right away
+        folder = ROOT_SEPARATOR.join(folders)
+        meta = {
+            "folder": folder, "search_type": search_type, "query_text": query_text, "query_path": query_path,
+            "min_score": min_score, "top_k": top_k
+        }
+        with metrics.time("results", len(results)):
+            await loop.run_in_executor(thread_pool, result_store.save, search_id, meta, results)
+        await loop.run_in_executor(
+            thread_pool, save_last_settings, None if search_type == 'text' else query_path, folder, search_id
+        )
+        remember_search(
+            search_key(folders, search_type, query_text, query_path, mode, nprobe, tags),
+            search_id, min_score, top.k, len(results)
+        )
+        
+        # Update progress with completion; the results are streamed from the store,
+        # so the progress entry does not hold them while it is kept
+        progress.pop('partial', None)
+        progress.update({
             'progress': 100,
             'status': 'Search complete!',
             'done': True,
-            'results': results
+            'stored': True,
+            'result_count': len(results)
         })
         
-        # Save settings
-        save_last_settings(
-            None if search_type == 'text' else query_path,
-            folder,
-            results
+    except SearchCancelled:
+        print(f"Search {search_id} cancelled")
+        progress.update({'status': 'Search cancelled'})
+    except Exception as e:
+        print(f"Error in background search task: {str(e)}")
+        progress['error'] = f"Error during search: {str(e)}"
+    finally:
+        for worker in workers:
+            if not worker.done():
+                worker.cancel()
+        running_searches.pop(search_id, None)
+        scheduler.release()
+
+def search_key(
+    folders: List[str],
+    search_type: str,
+    query_text: str,
+    query_path: str,
+    mode: str,
+    nprobe: int,
+    tags: str
+) -> tuple:
+    """Everything that decides a search's scores except min_score and top_k"""
+    query = query_text if search_type == 'text' else query_path
+    return (tuple(sorted(folders)), search_type, query, mode, nprobe if mode == 'ann' else None, tags or None)
+
+def normalize_roots(folders: List[str]) -> List[str]:
+    """Absolute, de-duplicated search roots; roots inside another root are dropped"""
+    roots = []
+    # Sorted, a parent comes before the folders below it
+    for folder in sorted({os.path.abspath(folder.strip()) for folder in folders if folder.strip()}):
+        if not any(folder.startswith(root.rstrip(os.sep) + os.sep) for root in roots):
+            roots.append(folder)
+    return roots
+
+def remember_search(key: tuple, search_id: str, min_score: float, top_k: int, total: int):
+    """Record a completed search so a later change of min_score or top_k can re-filter it"""
+    now = time.time()
+    for expired in [k for k, search in completed_searches.items() if now - search["finished"] > RESULT_REUSE_SECONDS]:
+        del completed_searches[expired]
+    completed_searches[key] = {
+        "search_id": search_id,
+        "min_score": min_score,
+        "top_k": top_k,
+        "total": total,
+        "finished": now
+    }
+
+def find_reusable_search(key: tuple, min_score: float, top_k: int) -> Optional[str]:
+    """
+    Return the id of a recent search whose stored results contain every result of the
+    same query with min_score and top_k, or None
+    """
+    search = completed_searches.get(key)
+    if search is None or time.time() - search["finished"] > RESULT_REUSE_SECONDS:
+        return None
+    # A lower min_score admits images the stored search dropped
+    if min_score < search["min_score"]:
+        return None
+    # A truncated top-k only holds the answer for the same min_score and no larger k
+    truncated = search["top_k"] > 0 and search["total"] >= search["top_k"]
+    if truncated and (min_score != search["min_score"] or top_k == 0 or top_k > search["top_k"]):
+        return None
+    return search["search_id"]
+
+async def refilter_search(search_id: str, source_id: str, min_score: float, top_k: int) -> bool:
+    """
+    Complete a search from the stored results of an earlier one with the same query,
+    keeping those above min_score and at most top_k; returns False if they are gone
+    """
+    loop = asyncio.get_event_loop()
+    progress = search_progress[search_id]
+    stored = await loop.run_in_executor(thread_pool, result_store.page, source_id, 0, -1)
+    if stored is None:
+        return False
+    meta, _, results = stored
+    results = [
+        result for result in results
+        if (result["similarity"] if result["similarity"] is not None else result["score"]) >= min_score
+    ]
+    if top_k > 0:
+        results = results[:top_k]
+    
+    meta = dict(meta, min_score=min_score, top_k=top_k, source_search_id=source_id)
+    with metrics.time("results", len(results)):
+        await loop.run_in_executor(thread_pool, result_store.save, search_id, meta, results)
+    await loop.run_in_executor(
+        thread_pool, save_last_settings,
+        None if meta["search_type"] == 'text' else meta["query_path"], meta["folder"], search_id
+    )
+    progress.update({
+        'progress': 100,
+        'status': 'Search complete!',
+        'done': True,
+        'reused': source_id,
+        'stored': True,
+        'result_count': len(results)
+    })
+    return True
+
+async def embed_queries(
+    texts: List[str],
+    paths: List[str],
+    model,
+    preprocess
+) -> Dict[Tuple[str, str], torch.Tensor]:
+    """
+    Embeddings of query texts and images keyed by ('text', text) and ('path', path)
+    Cached queries skip the model; the rest are encoded off the event loop and cached
+    Images that cannot be read are left out
+    """
+    loop = asyncio.get_event_loop()
+    keys = {('text', text): query_cache.text_key(text) for text in texts}
+    image_keys = await asyncio.gather(*[
+        loop.run_in_executor(thread_pool, query_cache.image_key, path) for path in paths
+    ])
+    keys.update((('path', path), key) for path, key in zip(paths, image_keys) if key is not None)
+    
+    embeddings = {}
+    for query, key in keys.items():
+        embedding = await loop.run_in_executor(thread_pool, query_cache.get, key)
+        if embedding is not None:
+            embeddings[query] = embedding
+    
+    missing_texts = [text for text in texts if ('text', text) not in embeddings]
+    if missing_texts:
+        text_embeddings = await loop.run_in_executor(
+            inference_executor, encode_texts, [normalize_text(text) for text in missing_texts], model
         )
+        for text, embedding in zip(missing_texts, text_embeddings):
+            embeddings[('text', text)] = embedding
+            await loop.run_in_executor(thread_pool, query_cache.put, keys[('text', text)], embedding)
+    
+    missing_paths = [path for path in paths if ('path', path) in keys and ('path', path) not in embeddings]
+    if missing_paths:
+        valid_paths, image_embeddings = await process_image_batch(missing_paths, model, preprocess)
+        for path, embedding in zip(valid_paths, image_embeddings if valid_paths else []):
+            embeddings[('path', path)] = embedding
+            await loop.run_in_executor(thread_pool, query_cache.put, keys[('path', path)], embedding)
+    return embeddings
+
+async def run_search(
+    search_id: str,
+    folders: List[str],
+    search_type: str,
+    query_text: str = None,
+    query_path: str = None,
+    priority: int = SEARCH_PRIORITY,
+    **options
+):
+    """Wait for the model and embed the query, then run the search"""
+    progress = search_progress[search_id]
+    try:
+        # Wait for the model if the server has just started
+        if not model_loader.ready:
+            progress.update({'progress': 5, 'status': 'Loading model...'})
+        model, preprocess = await get_model()
+        progress.check()
         
+        progress.update({'progress': 10, 'status': 'Processing query...'})
+        with metrics.time("query"):
+            if search_type == 'image':
+                query = ('path', query_path)
+                embeddings = await embed_queries([], [query_path], model, preprocess)
+            else:
+                query = ('text', query_text)
+                embeddings = await embed_queries([query_text], [], model, preprocess)
+        if query not in embeddings:
+            raise ValueError("Failed to generate query embedding")
+    except SearchCancelled:
+        print(f"Search {search_id} cancelled")
+        progress.update({'status': 'Search cancelled'})
     except Exception as e:
-        print(f"Error in background search task: {str(e)}")
-        search_progress[search_id]['error'] = f"Error during search: {str(e)}"
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"Error generating embedding: {detail}")
+        progress['error'] = f"Error processing query: {detail}"
+    else:
+        # process_search frees the search slot itself
+        await process_search(
+            search_id, folders, embeddings[query], model, preprocess,
+            search_type=search_type, query_text=query_text, query_path=query_path,
+            priority=priority, **options
+        )
+        return
+    running_searches.pop(search_id, None)
+    scheduler.release()
 
 @app.post("/search")
 async def search_images(
     background_tasks: BackgroundTasks,
-    folder: str = Form(...),
+    folder: List[str] = Form(...),
     min_score: float = Form(0.0),
     batch_size: int = Form(32),
     search_type: str = Form(...),
     query_path: str = Form(None),
-    query_text: str = Form(None)
+    query_text: str = Form(None),
+    mode: str = Form('exact'),
+    nprobe: int = Form(DEFAULT_NPROBE),
+    top_k: int = Form(DEFAULT_TOP_K),
+    priority: int = Form(SEARCH_PRIORITY),
+    tags: str = Form(None),
+    rescan: bool = Form(False)
 ):
+    """
+    Start a search of one or more roots; folder can be repeated and each
+    value may hold several roots separated by ROOT_SEPARATOR
+    """
     search_id = str(uuid.uuid4())
-    search_progress[search_id] = {'progress': 0, 'status': 'Initializing search...'}
+    progress = search_progress[search_id] = ProgressChannel({'progress': 0, 'status': 'Initializing search...'})
     
     try:
         print(f"Search request - Type: {search_type}, Folder: {folder}")
@@ -286,78 +958,563 @@ async def search_images(
         if search_type not in ['image', 'text']:
             raise HTTPException(status_code=400, detail="Invalid search type")
         
+        if mode not in ['exact', 'ann']:
+            raise HTTPException(status_code=400, detail="Invalid search mode")
+        
         if search_type == 'image' and not query_path:
             raise HTTPException(status_code=400, detail="Query image path is required for image search")
         
         if search_type == 'text' and not query_text:
             raise HTTPException(status_code=400, detail="Query text is required for text search")
 
-        # Get query embedding
-        search_progress[search_id].update({'progress': 10, 'status': 'Processing query...'})
-        try:
-            device = next(model.parameters()).device
-            if search_type == 'image':
-                query_embedding = get_image_embedding(query_path, model, preprocess)
-            else:  # text search
-                print(f"Processing text query: {query_text}")
-                text = clip.tokenize([query_text]).to(device)
-                with torch.no_grad():
-                    query_embedding = model.encode_text(text)
-                    query_embedding = F.normalize(query_embedding.squeeze(0), dim=0).cpu()
-                print("Text embedding generated successfully")
-
-            if query_embedding is None:
-                raise HTTPException(status_code=400, detail="Failed to generate query embedding")
-            
-        except Exception as e:
-            print(f"Error generating embedding: {str(e)}")
-            search_progress[search_id]['error'] = f"Error processing query: {str(e)}"
-            raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
-
-        # Process folder path
+        # Process folder paths
         try:
-            folder = os.path.abspath(folder)
-            if not os.path.exists(folder):
-                raise HTTPException(status_code=400, detail=f"Folder not found: {folder}")
-            print(f"Searching in folder: {folder}")
+            folders = normalize_roots([root for value in folder for root in value.split(ROOT_SEPARATOR)])
+            if not folders:
+                raise HTTPException(status_code=400, detail="At least one folder is required")
+            for root in folders:
+                if not os.path.exists(root):
+                    raise HTTPException(status_code=400, detail=f"Folder not found: {root}")
+            print(f"Searching in folders: {', '.join(folders)}")
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error with folder path: {str(e)}")
-            search_progress[search_id]['error'] = f"Invalid folder path: {str(e)}"
+            progress['error'] = f"Invalid folder path: {str(e)}"
             raise HTTPException(status_code=400, detail=f"Invalid folder path: {str(e)}")
+
+        # Only min_score or top_k changed since a recent search: re-filter its stored scores
+        if not rescan:
+            key = search_key(folders, search_type, query_text, query_path, mode, nprobe, tags)
+            source_id = find_reusable_search(key, min_score, top_k)
+            if source_id is not None and await refilter_search(search_id, source_id, min_score, top_k):
+                print(f"Re-filtered stored results of search {source_id}")
+                return {"search_id": search_id, "reused": source_id}
+
+        if search_type == 'image' and not os.path.isfile(query_path):
+            raise HTTPException(status_code=400, detail=f"Query image not found: {query_path}")
+        
+        untagged = [root for root in folders if not get_tag_store(root).tagged] if tags else []
+        if untagged:
+            raise HTTPException(status_code=400, detail=f"Folder has not been tagged, run /tags first: {untagged[0]}")
         
-        # Start background processing
+        # Admission control: refuse new searches while the server is saturated
+        if not scheduler.try_admit():
+            raise HTTPException(status_code=429, detail="Too many searches in progress, try again later")
+        running_searches[search_id] = progress
+        
+        # The model wait and query embedding run in the background task,
+        # so the search id is returned without touching the model
         background_tasks.add_task(
-            process_search,
+            run_search,
             search_id=search_id,
-            folder=folder,
-            query_embedding=query_embedding,
-            model=model,
-            preprocess=preprocess,
-            min_score=min_score,
-            batch_size=batch_size,
+            folders=folders,
             search_type=search_type,
             query_text=query_text,
             query_path=query_path,
-            device=device
+            min_score=min_score,
+            batch_size=batch_size,
+            mode=mode,
+            nprobe=nprobe,
+            top_k=top_k,
+            priority=priority,
+            tags=tags,
+            rescan=rescan
         )
         
         return {"search_id": search_id}
         
     except HTTPException as he:
-        search_progress[search_id]['error'] = str(he.detail)
+        progress['error'] = str(he.detail)
         raise he
     except Exception as e:
         print(f"Unexpected error in search endpoint: {str(e)}")
-        search_progress[search_id]['error'] = f"Unexpected error: {str(e)}"
+        progress['error'] = f"Unexpected error: {str(e)}"
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
     finally:
-        # Clean up progress after 5 minutes
-        asyncio.create_task(cleanup_progress(search_id))
+        # Clean up progress 5 minutes after the search finishes
+        asyncio.create_task(cleanup_progress(search_id, progress))
+
+class QueryTerm(BaseModel):
+    """One text or image in a combined query; a negative weight pushes results away from it"""
+    text: Optional[str] = None
+    path: Optional[str] = None
+    weight: float = 1.0
+
+class BatchQuery(BaseModel):
+    """A text query, an image query or a weighted combination of terms"""
+    id: Optional[str] = None
+    text: Optional[str] = None
+    path: Optional[str] = None
+    terms: List[QueryTerm] = []
+
+    def all_terms(self) -> List[QueryTerm]:
+        terms = list(self.terms)
+        if self.text or self.path:
+            terms.append(QueryTerm(text=self.text, path=self.path))
+        return terms
+
+class BatchSearchRequest(BaseModel):
+    folder: str
+    queries: List[BatchQuery]
+    top_k: int = 100
+    min_score: float = 0.0
+    mode: str = 'exact'
+    nprobe: int = DEFAULT_NPROBE
+    batch_size: int = 32
+
+async def encode_queries(queries: List[BatchQuery], model, preprocess) -> torch.Tensor:
+    """
+    Encode every query into one [Q, D] matrix of normalized embeddings
+    Uncached texts are encoded in one batch and uncached images in another
+    """
+    texts = list(dict.fromkeys(term.text for query in queries for term in query.all_terms() if term.text))
+    paths = list(dict.fromkeys(term.path for query in queries for term in query.all_terms() if term.path))
+    
+    with metrics.time("query", len(texts) + len(paths)):
+        embeddings = await embed_queries(texts, paths, model, preprocess)
+    missing = [path for path in paths if ('path', path) not in embeddings]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Could not read query image: {sorted(missing)[0]}")
+    
+    vectors = []
+    for number, query in enumerate(queries):
+        terms = query.all_terms()
+        if not terms:
+            raise HTTPException(status_code=400, detail=f"Query {query.id or number} has no text or image")
+        # Combined queries are the weighted sum of their terms
+        vector = sum(
+            term.weight * (embeddings[('text', term.text)] if term.text else embeddings[('path', term.path)])
+            for term in terms
+        )
+        if vector.norm() < 1e-6:
+            raise HTTPException(status_code=400, detail=f"Query {query.id or number} cancels out")
+        vectors.append(F.normalize(vector.float(), dim=0))
+    return torch.stack(vectors)
+
+async def process_batch_search(
+    folder: str,
+    query_embeddings: torch.Tensor,
+    preprocess,
+    top_k: int,
+    min_score: float,
+    mode: str,
+    nprobe: int,
+    batch_size: int
+) -> List[TopK]:
+    """Score every query against the folder in one pass and return a running top-k per query"""
+    loop = asyncio.get_event_loop()
+    tops = [TopK(top_k) for _ in range(len(query_embeddings))]
+    
+    def score_matrix(paths, similarities):
+        """Add [N, Q] similarities to the per-query top-k"""
+        scores = (similarities + 1) / 2
+        for column, top in enumerate(tops):
+            query_scores = scores[:, column]
+            hits = torch.nonzero(query_scores >= min_score).squeeze(1)
+            if len(hits) == 0:
+                continue
+            rows = hits[top.candidates(query_scores[hits])]
+            top.push(query_scores[rows], [
+                {"path": paths[row], "filename": os.path.basename(paths[row])} for row in rows.tolist()
+            ])
+    
+    def on_batch(paths, embeddings):
+        score_matrix(paths, F.normalize(whole_image(embeddings).float(), dim=1) @ query_embeddings.T)
+    
+    index = get_index(folder)
+    image_files = None
+    if not indexer.is_current(folder):
+        # Scan without the lock so other searches of the folder are not held up
+        scan_start = time.perf_counter()
+        image_files = await loop.run_in_executor(thread_pool, scan_folder, index.folder)
+        metrics.observe("scan", time.perf_counter() - scan_start, len(image_files))
+    async with index.lock:
+        stale_files = index.sync(image_files) if image_files is not None else []
+        indexed_rows = index.row_count()
+        
+        # One [chunk x D] . [D x Q] multiply per chunk scores every query
+        queries = query_embeddings.T.contiguous()
+        ann = await loop.run_in_executor(thread_pool, index.ensure_ann) if mode == 'ann' else None
+        if ann is not None:
+            candidates = np.unique(np.concatenate([ann.candidates(query, nprobe) for query in query_embeddings]))
+            chunks = index.iter_scores(queries, ids=candidates[candidates < indexed_rows])
+        else:
+            chunks = index.iter_scores(queries, stop=indexed_rows)
+        for paths, similarities, _ in chunks:
+            score_matrix(paths, similarities)
+            await asyncio.sleep(0)
+    
+    await encode_into_index(index, stale_files, preprocess, batch_size, SEARCH_PRIORITY, on_batch)
+    async with index.lock:
+        await loop.run_in_executor(thread_pool, index.save)
+    return tops
+
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
+    """
+    Run many text and/or image queries against one folder in a single pass
+    and return the top-k of every query
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per request")
+    if request.mode not in ['exact', 'ann']:
+        raise HTTPException(status_code=400, detail="Invalid search mode")
+    folder = os.path.abspath(request.folder)
+    if not os.path.isdir(folder):
+        raise HTTPException(status_code=400, detail=f"Folder not found: {folder}")
+    
+    model, preprocess = await get_model()
+    query_embeddings = await encode_queries(request.queries, model, preprocess)
+    
+    if not scheduler.try_admit():
+        raise HTTPException(status_code=429, detail="Too many searches in progress, try again later")
+    try:
+        tops = await process_batch_search(
+            folder, query_embeddings, preprocess, request.top_k, request.min_score,
+            request.mode, request.nprobe, request.batch_size
+        )
+    finally:
+        scheduler.release()
+    
+    return {
+        "results": [
+            {
+                "id": query.id if query.id is not None else str(number),
+                "results": [dict(item, score=score) for score, item in top.results()]
+            }
+            for number, (query, top) in enumerate(zip(request.queries, tops))
+        ]
+    }
+
+async def process_duplicates(
+    search_id: str,
+    folder: str,
+    preprocess,
+    threshold: float,
+    mode: str,
+    nprobe: int,
+    use_phash: bool,
+    batch_size: int
+):
+    """Find clusters of near-duplicate images in a folder from its stored embeddings"""
+    progress = search_progress[search_id]
+    try:
+        loop = asyncio.get_event_loop()
+        index = get_index(folder)
+        async with index.lock:
+            stale_files = []
+            if not indexer.is_current(folder):
+                stale_files = await update_index(progress, index)
+        
+        # Only images missing from the index are encoded
+        await encode_stale_images(progress, index, stale_files, preprocess, batch_size, SEARCH_PRIORITY,
+                                  progress_range=(20, 40))
+        
+        async with index.lock:
+            await loop.run_in_executor(thread_pool, index.save)
+            rows = index.row_count()
+            ann = None
+            if mode == 'ann' or (mode == 'auto' and rows >= ANN_MIN_SIZE):
+                ann = await loop.run_in_executor(thread_pool, index.ensure_ann)
+            # Later flushes only append rows past these; evictions and saves replace the arrays
+            matrix, scales, paths = index.matrix, index.scales, index.paths[:rows]
+            if ann is not None:
+                ann = IVFIndex(ann.centroids, ann.assignments[:rows])
+        
+        # Optional pre-filter: identical perceptual hashes are exact duplicates
+        hashes = None
+        if use_phash:
+            hashes = []
+            for start in range(0, len(paths), HASH_CHUNK_SIZE):
+                chunk = paths[start:start + HASH_CHUNK_SIZE]
+                hashes.extend(await asyncio.gather(*[
+                    loop.run_in_executor(thread_pool, perceptual_hash, path) for path in chunk
+                ]))
+                progress.update({
+                    'progress': int(40 + len(hashes) / len(paths) * 15),
+                    'status': f'Hashing images... ({len(hashes)}/{len(paths)})'
+                })
+        
+        def on_progress(done, total):
+            # Called from the worker thread
+            loop.call_soon_threadsafe(progress.update, {
+                'progress': int(55 + done / total * 44),
+                'status': f'Comparing images... ({done}/{total})'
+            })
+        
+        progress.update({'progress': 55, 'status': 'Comparing images...'})
+        clusters = await loop.run_in_executor(
+            thread_pool, find_duplicates, matrix, scales, paths, threshold, ann, nprobe, hashes, on_progress
+        )
+        
+        progress.update({
+            'progress': 100,
+            'status': f'Found {len(clusters)} groups of duplicates',
+            'done': True,
+            'results': clusters
+        })
+    
+    except Exception as e:
+        print(f"Error in duplicate detection task: {str(e)}")
+        progress['error'] = f"Error during duplicate detection: {str(e)}"
+    finally:
+        scheduler.release()
+
+@app.post("/duplicates")
+async def find_duplicate_images(
+    background_tasks: BackgroundTasks,
+    folder: str = Form(...),
+    threshold: float = Form(DEFAULT_THRESHOLD),
+    mode: str = Form('auto'),
+    nprobe: int = Form(DEFAULT_DUPLICATE_NPROBE),
+    phash: bool = Form(False),
+    batch_size: int = Form(32)
+):
+    """
+    Start a duplicate detection job; progress and clusters of near-duplicates
+    stream from /search-progress/{search_id}
+    """
+    search_id = str(uuid.uuid4())
+    progress = search_progress[search_id] = ProgressChannel({'progress': 0, 'status': 'Initializing duplicate detection...'})
+    
+    try:
+        if mode not in ['auto', 'exact', 'ann']:
+            raise HTTPException(status_code=400, detail="Invalid duplicate detection mode")
+        
+        if not 0 < threshold <= 1:
+            raise HTTPException(status_code=400, detail="Threshold must be between 0 and 1")
+        
+        folder = os.path.abspath(folder)
+        if not os.path.isdir(folder):
+            raise HTTPException(status_code=400, detail=f"Folder not found: {folder}")
+        
+        _, preprocess = await get_model()
+        
+        if not scheduler.try_admit():
+            raise HTTPException(status_code=429, detail="Too many searches in progress, try again later")
+        
+        background_tasks.add_task(
+            process_duplicates,
+            search_id=search_id,
+            folder=folder,
+            preprocess=preprocess,
+            threshold=threshold,
+            mode=mode,
+            nprobe=nprobe,
+            use_phash=phash,
+            batch_size=batch_size
+        )
+        
+        return {"search_id": search_id}
+    
+    except HTTPException as he:
+        progress['error'] = str(he.detail)
+        raise he
+    except Exception as e:
+        progress['error'] = f"Unexpected error: {str(e)}"
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    finally:
+        asyncio.create_task(cleanup_progress(search_id, progress))
+
+async def process_tags(
+    search_id: str,
+    folder: str,
+    model,
+    preprocess,
+    labels: List[str],
+    per_image: int,
+    min_score: float,
+    batch_size: int
+):
+    """Tag every image of a folder with its most likely labels from the stored embeddings"""
+    progress = search_progress[search_id]
+    try:
+        loop = asyncio.get_event_loop()
+        index = get_index(folder)
+        async with index.lock:
+            stale_files = []
+            if not indexer.is_current(folder):
+                stale_files = await update_index(progress, index)
+        
+        # Only images missing from the index are encoded
+        await encode_stale_images(progress, index, stale_files, preprocess, batch_size, SEARCH_PRIORITY,
+                                  progress_range=(20, 60))
+        
+        # The label vocabulary is encoded once and reused by later runs
+        progress.update({'progress': 60, 'status': 'Encoding labels...'})
+        label_embeddings = await loop.run_in_executor(inference_executor, label_matrix, labels, model)
+        
+        def on_progress(done, total):
+            # Called from the worker thread
+            loop.call_soon_threadsafe(progress.update, {
+                'progress': int(60 + done / total * 39),
+                'status': f'Tagging images... ({done}/{total})'
+            })
+        
+        store = get_tag_store(folder)
+        async with index.lock:
+            await loop.run_in_executor(thread_pool, index.save)
+            counts = await loop.run_in_executor(
+                thread_pool,
+                lambda: store.tag_index(index, labels, label_embeddings, per_image, min_score, on_progress=on_progress)
+            )
+        
+        progress.update({
+            'progress': 100,
+            'status': f'Tagged {len(store.tags)} images',
+            'done': True,
+            'results': [
+                {"label": label, "count": count}
+                for label, count in sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            ]
+        })
+    
+    except Exception as e:
+        print(f"Error in tagging task: {str(e)}")
+        progress['error'] = f"Error during tagging: {str(e)}"
+    finally:
+        scheduler.release()
+
+@app.post("/tags")
+async def tag_images(
+    background_tasks: BackgroundTasks,
+    folder: str = Form(...),
+    labels: str = Form(None),
+    per_image: int = Form(TAGS_PER_IMAGE),
+    min_score: float = Form(MIN_TAG_SCORE),
+    batch_size: int = Form(32)
+):
+    """
+    Start a tagging job over a folder; labels is one label per line and defaults
+    to the configured vocabulary. Progress and label counts stream from
+    /search-progress/{search_id}
+    """
+    search_id = str(uuid.uuid4())
+    progress = search_progress[search_id] = ProgressChannel({'progress': 0, 'status': 'Initializing tagging...'})
+    
+    try:
+        label_list = list(dict.fromkeys(
+            line.strip() for line in labels.splitlines() if line.strip()
+        )) if labels else load_labels()
+        if not label_list:
+            raise HTTPException(status_code=400, detail="At least one label is required")
+        
+        if per_image < 1:
+            raise HTTPException(status_code=400, detail="per_image must be at least 1")
+        
+        folder = os.path.abspath(folder)
+        if not os.path.isdir(folder):
+            raise HTTPException(status_code=400, detail=f"Folder not found: {folder}")
+        
+        model, preprocess = await get_model()
+        
+        if not scheduler.try_admit():
+            raise HTTPException(status_code=429, detail="Too many searches in progress, try again later")
+        
+        background_tasks.add_task(
+            process_tags,
+            search_id=search_id,
+            folder=folder,
+            model=model,
+            preprocess=preprocess,
+            labels=label_list,
+            per_image=per_image,
+            min_score=min_score,
+            batch_size=batch_size
+        )
+        
+        return {"search_id": search_id}
+    
+    except HTTPException as he:
+        progress['error'] = str(he.detail)
+        raise he
+    except Exception as e:
+        progress['error'] = f"Unexpected error: {str(e)}"
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    finally:
+        asyncio.create_task(cleanup_progress(search_id, progress))
+
+@app.get("/tags")
+async def lookup_tags(folder: str, query: str = None, limit: int = DEFAULT_TOP_K):
+    """
+    Images of a tagged folder matching a tag filter such as "landscape AND sunset";
+    without a query, the label vocabulary and image count per label
+    """
+    store = get_tag_store(os.path.abspath(folder))
+    if not store.tagged:
+        raise HTTPException(status_code=404, detail="Folder has not been tagged")
+    
+    if not query:
+        return {
+            "labels": [
+                {"label": label, "count": count} for label, count in store.label_counts().items()
+            ],
+            "images": len(store.tags)
+        }
+    
+    paths = sorted(store.lookup(query))
+    return {
+        "total": len(paths),
+        "results": [
+            {
+                "path": path,
+                "filename": os.path.basename(path),
+                "tags": [{"label": label, "score": score} for label, score in store.image_tags(path)]
+            }
+            for path in paths[:limit]
+        ]
+    }
+
+@app.post("/index/folders")
+async def register_index_folder(folder: str = Form(...)):
+    """Keep a folder indexed in the background"""
+    await get_model()
+    folder = os.path.abspath(folder)
+    if not os.path.isdir(folder):
+        raise HTTPException(status_code=400, detail=f"Folder not found: {folder}")
+    indexer.register(folder)
+    return indexer.status()
+
+@app.delete("/index/folders")
+async def unregister_index_folder(folder: str = Form(...)):
+    """Stop keeping a folder indexed"""
+    indexer.unregister(folder)
+    return indexer.status()
+
+@app.get("/index/status")
+async def get_index_status():
+    """Queue depth and last synchronization time of the background indexer"""
+    status = indexer.status()
+    status["scheduler"] = {
+        "active_searches": scheduler.active_searches,
+        "max_searches": scheduler.max_searches,
+        "queued_images": scheduler.queue_depth
+    }
+    return status
+
+@app.get("/metrics")
+async def get_metrics():
+    """Per-stage search pipeline timers in the Prometheus text format"""
+    content = metrics.render({
+        "clip_model_ready": int(model_loader.ready),
+        "clip_active_searches": scheduler.active_searches,
+        "clip_inference_queue_images": scheduler.queue_depth,
+        "clip_index_queue_depth": indexer.status()["queue_depth"],
+        "clip_query_cache_hits": query_cache.hits,
+        "clip_query_cache_misses": query_cache.misses
+    })
+    return Response(content=content, media_type="text/plain; version=0.0.4")
 
-async def cleanup_progress(search_id: str):
-    """Remove search progress after a delay"""
-    await asyncio.sleep(300)  # 5 minutes
-    if search_id in search_progress:
+async def cleanup_progress(search_id: str, progress: ProgressChannel):
+    """Remove the progress of a search or job once it has been finished for PROGRESS_KEEP_SECONDS"""
+    version = -1
+    while not progress.finished:
+        version = await progress.wait(version)
+    await asyncio.sleep(PROGRESS_KEEP_SECONDS)
+    if search_progress.get(search_id) is progress:
         del search_progress[search_id]
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# psutil is optional; without it RSS is read from /proc on Linux
+try:
+    import psutil
+    _process = psutil.Process()
+except ImportError:
+    _process = None
+
+# Histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Recent durations kept per stage for the p50/p95 summary
+WINDOW = 2048
+
+# Pipeline stages in the order a search runs them
+STAGES = (
+    "scan", "query", "decode", "preprocess", "encode", "score",
+    "tokens", "index_save", "dimensions", "results", "settings"
+)
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, or None if it cannot be read"""
+    if _process is not None:
+        return _process.memory_info().rss
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _Stage:
+    def __init__(self, buckets: tuple):
+        self.buckets = [0] * len(buckets)
+        self.count = 0
+        self.items = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=WINDOW)
+        self.peak_rss = 0
+
+
+class StageMetrics:
+    """
+    Per-stage timers of the search pipeline: Prometheus histograms plus a window
+    of recent durations for percentiles; safe to use from worker threads.
+    With track_rss every observation also samples the RSS for a per-stage peak,
+    which reads /proc and is meant for benchmarks rather than a serving process
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS, track_rss: bool = False):
+        self.bucket_bounds = buckets
+        self.track_rss = track_rss
+        self._stages: Dict[str, _Stage] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, items: int = 1):
+        """Record one run of a stage that processed items images or rows"""
+        rss = current_rss() if self.track_rss else None
+        with self._lock:
+            state = self._stages.get(stage)
+            if state is None:
+                state = self._stages[stage] = _Stage(self.bucket_bounds)
+            for i, bound in enumerate(self.bucket_bounds):
+                if seconds <= bound:
+                    state.buckets[i] += 1
+            state.count += 1
+            state.items += items
+            state.total += seconds
+            state.recent.append(seconds)
+            if rss is not None:
+                state.peak_rss = max(state.peak_rss, rss)
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1):
+        """Time the enclosed block as one run of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, items)
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+    def _ordered(self) -> List[str]:
+        return sorted(self._stages, key=lambda stage: (STAGES.index(stage) if stage in STAGES else len(STAGES), stage))
+
+    def summary(self) -> Dict[str, Dict]:
+        """Count, items/sec, p50/p95 latency and peak RSS (with track_rss) of every stage"""
+        with self._lock:
+            summary = {}
+            for stage in self._ordered():
+                state = self._stages[stage]
+                recent = np.array(state.recent)
+                summary[stage] = {
+                    "count": state.count,
+                    "items": state.items,
+                    "seconds": round(state.total, 4),
+                    "items_per_sec": round(state.items / state.total, 1) if state.total else None,
+                    "p50_ms": round(float(np.percentile(recent, 50)) * 1000, 3),
+                    "p95_ms": round(float(np.percentile(recent, 95)) * 1000, 3),
+                    "peak_rss_mb": round(state.peak_rss / 2 ** 20, 1) if state.peak_rss else None
+                }
+            return summary
+
+    def render(self, gauges: Dict[str, float] = None) -> str:
+        """Prometheus text exposition of the stage histograms and extra gauges"""
+        lines = [
+            "# HELP clip_stage_seconds Time spent in each search pipeline stage",
+            "# TYPE clip_stage_seconds histogram"
+        ]
+        with self._lock:
+            stages = [(stage, self._stages[stage]) for stage in self._ordered()]
+            for stage, state in stages:
+                for bound, count in zip(self.bucket_bounds, state.buckets):
+                    lines.append(f'clip_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'clip_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {state.count}')
+                lines.append(f'clip_stage_seconds_sum{{stage="{stage}"}} {state.total}')
+                lines.append(f'clip_stage_seconds_count{{stage="{stage}"}} {state.count}')
+
+            lines.append("# HELP clip_stage_items_total Images or rows processed by each stage")
+            lines.append("# TYPE clip_stage_items_total counter")
+            for stage, state in stages:
+                lines.append(f'clip_stage_items_total{{stage="{stage}"}} {state.items}')
+
+            if self.track_rss:
+                lines.append("# HELP clip_stage_peak_rss_bytes Largest resident set size seen at the end of each stage")
+                lines.append("# TYPE clip_stage_peak_rss_bytes gauge")
+                for stage, state in stages:
+                    lines.append(f'clip_stage_peak_rss_bytes{{stage="{stage}"}} {state.peak_rss}')
+
+        # Sampled once per scrape
+        rss = current_rss()
+        if rss is not None:
+            lines.append("# HELP clip_process_resident_memory_bytes Resident set size of the server")
+            lines.append("# TYPE clip_process_resident_memory_bytes gauge")
+            lines.append(f"clip_process_resident_memory_bytes {rss}")
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared metrics instance used by the pipeline and the /metrics endpoint
+metrics = StageMetrics()
@@ -0,0 +1,245 @@
+"""
+Model loading: background loading for fast server startup and
+precompiled TorchScript / ONNX Runtime artifacts for CPU hosts
+
+Usage:
+    python -m backend.models export --format torchscript
+    python -m backend.models export --format onnx
+"""
+import os
+import json
+import time
+import argparse
+import asyncio
+import numpy as np
+import torch
+from pathlib import Path
+from PIL import Image
+from typing import Callable, Dict, Optional, Tuple
+from .index import INDEX_ROOT
+
+# Model weights: "torch" loads the CLIP checkpoint, "torchscript" and "onnx"
+# load artifacts written by `python -m backend.models export`
+MODEL_FORMAT = os.environ.get("CLIP_MODEL_FORMAT", "torch")
+MODEL_NAME = "ViT-B/32"
+ARTIFACT_DIR = Path(os.environ.get("CLIP_MODEL_DIR", str(INDEX_ROOT / "models")))
+
+ARTIFACT_FILES = {
+    "torchscript": ("visual.pt", "text.pt"),
+    "onnx": ("visual.onnx", "text.onnx")
+}
+
+# CLIP input normalization
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class ClipPreprocess:
+    """
+    CLIP image preprocessing (bicubic resize, center crop, normalize)
+    without the torchvision dependency; picklable for decode worker processes
+    """
+
+    def __init__(self, size: int = 224):
+        self.size = size
+        self.mean = torch.tensor(CLIP_MEAN).view(3, 1, 1)
+        self.std = torch.tensor(CLIP_STD).view(3, 1, 1)
+
+    def __call__(self, image: Image.Image) -> torch.Tensor:
+        width, height = image.size
+        short, long = (width, height) if width <= height else (height, width)
+        long = int(self.size * long / short)
+        new_size = (self.size, long) if width <= height else (long, self.size)
+        image = image.resize(new_size, Image.BICUBIC)
+
+        left = int(round((image.width - self.size) / 2.0))
+        top = int(round((image.height - self.size) / 2.0))
+        image = image.crop((left, top, left + self.size, top + self.size)).convert("RGB")
+        pixels = torch.from_numpy(np.asarray(image, dtype=np.float32) / 255.0).permute(2, 0, 1)
+        return (pixels - self.mean) / self.std
+
+
+class TorchScriptCLIP:
+    """CLIP image and text encoders loaded from TorchScript artifacts"""
+
+    def __init__(self, folder: Path, device: str):
+        visual, text = ARTIFACT_FILES["torchscript"]
+        self.visual = torch.jit.load(str(folder / visual), map_location=device).eval()
+        self.text = torch.jit.load(str(folder / text), map_location=device).eval()
+
+    def parameters(self):
+        return self.visual.parameters()
+
+    def eval(self):
+        return self
+
+    def encode_image(self, images: torch.Tensor) -> torch.Tensor:
+        return self.visual(images)
+
+    def encode_text(self, tokens: torch.Tensor) -> torch.Tensor:
+        return self.text(tokens)
+
+
+class OnnxCLIP:
+    """CLIP image and text encoders running on ONNX Runtime (CPU)"""
+
+    def __init__(self, folder: Path):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        visual, text = ARTIFACT_FILES["onnx"]
+        self.visual = onnxruntime.InferenceSession(str(folder / visual), options, providers=providers)
+        self.text = onnxruntime.InferenceSession(str(folder / text), options, providers=providers)
+        # Callers read the device and dtype from the first parameter
+        self._param = torch.zeros(0)
+
+    def parameters(self):
+        return iter([self._param])
+
+    def eval(self):
+        return self
+
+    def encode_image(self, images: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.visual.run(None, {"image": images.numpy()})[0])
+
+    def encode_text(self, tokens: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.text.run(None, {"text": tokens.numpy()})[0])
+
+
+def load_compiled_model(model_format: str, device: str, folder: Path = ARTIFACT_DIR):
+    """Load an exported model artifact and return model and preprocess function"""
+    if model_format not in ARTIFACT_FILES:
+        raise ValueError(f"Unknown model format: {model_format}")
+    if not all((folder / name).exists() for name in ARTIFACT_FILES[model_format]):
+        raise FileNotFoundError(
+            f"No {model_format} model in {folder}; run `python -m backend.models export --format {model_format}`"
+        )
+    with open(folder / "model.json", "r") as f:
+        metadata = json.load(f)
+    if model_format == "onnx":
+        model = OnnxCLIP(folder)
+    else:
+        model = TorchScriptCLIP(folder, device)
+    return model, ClipPreprocess(metadata["input_size"])
+
+
+class _ImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image):
+        return self.model.encode_image(image)
+
+
+class _TextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, text):
+        return self.model.encode_text(text)
+
+
+def export_model(model_format: str, folder: Path = ARTIFACT_DIR):
+    """Export the CLIP image and text encoders (fp32, CPU) as TorchScript or ONNX"""
+    import clip
+
+    model, _ = clip.load(MODEL_NAME, device="cpu")
+    model.eval()
+    input_size = getattr(getattr(model, "visual", None), "input_resolution", 224)
+    image = torch.randn(2, 3, input_size, input_size)
+    text = clip.tokenize(["a photo of a cat", "a photo of a dog"])
+    visual_name, text_name = ARTIFACT_FILES[model_format]
+    folder.mkdir(parents=True, exist_ok=True)
+
+    with torch.no_grad():
+        if model_format == "torchscript":
+            torch.jit.trace(_ImageEncoder(model), image).save(str(folder / visual_name))
+            torch.jit.trace(_TextEncoder(model), text).save(str(folder / text_name))
+        else:
+            for encoder, example, name, input_name in [
+                (_ImageEncoder(model), image, visual_name, "image"),
+                (_TextEncoder(model), text, text_name, "text")
+            ]:
+                torch.onnx.export(
+                    encoder, (example,), str(folder / name),
+                    input_names=[input_name], output_names=["embedding"],
+                    dynamic_axes={input_name: {0: "batch"}, "embedding": {0: "batch"}},
+                    opset_version=17
+                )
+
+    with open(folder / "model.json", "w") as f:
+        json.dump({"model": MODEL_NAME, "input_size": input_size}, f)
+    print(f"Exported {MODEL_NAME} as {model_format} to {folder}")
+
+
+class ModelLoader:
+    """
+    Loads the model in a background thread so the server answers requests
+    right away; requests that need the model wait on it
+    """
+
+    def __init__(self, load: Callable):
+        self.load = load
+        self.model = None
+        self.preprocess = None
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def start(self, on_ready: Callable = None):
+        """Start loading; on_ready(model, preprocess) runs before any waiter resumes"""
+        self.started = time.time()
+        self._ready = asyncio.Event()
+        asyncio.create_task(self._load(on_ready))
+
+    async def _load(self, on_ready: Callable):
+        loop = asyncio.get_event_loop()
+        try:
+            model, preprocess = await loop.run_in_executor(None, self.load)
+            if on_ready is not None:
+                on_ready(model, preprocess)
+            self.model, self.preprocess = model, preprocess
+            self.load_seconds = round(time.time() - self.started, 2)
+            print(f"Model loaded in {self.load_seconds}s")
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+            self.error = str(e)
+        self._ready.set()
+
+    async def wait(self) -> Tuple:
+        """Return (model, preprocess) once loaded; raises RuntimeError if loading failed"""
+        await self._ready.wait()
+        if self.error is not None:
+            raise RuntimeError(f"Model failed to load: {self.error}")
+        return self.model, self.preprocess
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "format": MODEL_FORMAT,
+            "error": self.error,
+            "load_seconds": self.load_seconds
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export precompiled CLIP model artifacts")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Export the image and text encoders")
+    export.add_argument("--format", choices=sorted(ARTIFACT_FILES), default="torchscript")
+    export.add_argument("--output", default=str(ARTIFACT_DIR), help="Artifact directory")
+    args = parser.parse_args()
+    export_model(args.format, Path(args.output))
+
+
+if __name__ == "__main__":
+    main()
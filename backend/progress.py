@@ -0,0 +1,59 @@
+import asyncio
+
+
+class SearchCancelled(Exception):
+    """Raised inside a search once it has been cancelled"""
+
+
+class ProgressChannel(dict):
+    """
+    Progress state of one search
+    Every update bumps a version number and wakes the listeners,
+    so SSE streams only send when something changed
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self.cancelled = False
+        self.listeners = 0
+        # Times the last listener has disconnected
+        self.disconnects = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return 'done' in self or 'error' in self or self.cancelled
+
+    def cancel(self):
+        """Ask the search to stop at its next batch"""
+        self.cancelled = True
+        self._notify()
+
+    def check(self):
+        """Raise SearchCancelled if the search has been cancelled"""
+        if self.cancelled:
+            raise SearchCancelled()
+
+    def _notify(self):
+        self.version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._notify()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._notify()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._notify()
+
+    async def wait(self, version: int) -> int:
+        """Wait until the channel is newer than version and return the new version"""
+        while self.version <= version:
+            await self._changed.wait()
+        return self.version
@@ -0,0 +1,169 @@
+import os
+import hashlib
+import threading
+import numpy as np
+import torch
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from .index import INDEX_ROOT
+from .models import MODEL_FORMAT, MODEL_NAME
+
+# On-disk cache of query embeddings, one .npy file per query
+QUERY_CACHE_ROOT = INDEX_ROOT / "queries"
+
+# Query embeddings kept in memory
+QUERY_CACHE_SIZE = int(os.environ.get("CLIP_QUERY_CACHE_SIZE", "1024"))
+
+# Query embeddings kept on disk (0 disables the disk cache); the least
+# recently used are deleted once the limit is passed
+QUERY_CACHE_FILES = int(os.environ.get("CLIP_QUERY_CACHE_FILES", "20000"))
+
+# Bytes read per step when hashing a query image
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def normalize_text(text: str) -> str:
+    """
+    Cache key form of a text query; CLIP's tokenizer lowercases and collapses
+    whitespace itself, so queries differing only in those encode identically
+    """
+    return " ".join(text.split()).lower()
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of a file's content"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class QueryCache:
+    """
+    Embeddings of query images and texts keyed by image content hash or
+    normalized text, in a bounded in-memory LRU backed by files on disk
+    The key includes the model, so switching models does not reuse embeddings
+    Calls may block on disk I/O and are meant to run in a worker thread
+    """
+
+    def __init__(self, root=QUERY_CACHE_ROOT, size: int = QUERY_CACHE_SIZE, max_files: int = QUERY_CACHE_FILES):
+        self.root = root
+        self.size = size
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        # Content hashes of query images by (path, mtime, size), so an unchanged file is not re-read
+        self._digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._files: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _key(self, kind: str, value: str) -> str:
+        return hashlib.sha1(f"{MODEL_FORMAT}|{MODEL_NAME}|{kind}|{value}".encode("utf-8")).hexdigest()
+
+    def text_key(self, text: str) -> str:
+        return self._key("text", normalize_text(text))
+
+    def image_key(self, path: str) -> Optional[str]:
+        """Key of a query image, or None if it cannot be read"""
+        try:
+            st = os.stat(path)
+            stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+            with self._lock:
+                digest = self._digests.get(stamp)
+            if digest is None:
+                digest = file_digest(path)
+                with self._lock:
+                    self._digests[stamp] = digest
+                    while len(self._digests) > self.size:
+                        self._digests.popitem(last=False)
+        except OSError as e:
+            print(f"Error hashing query image {path}: {str(e)}")
+            return None
+        return self._key("image", digest)
+
+    def _path(self, key: str):
+        return self.root / key[:2] / (key + ".npy")
+
+    def _remember(self, key: str, embedding: torch.Tensor):
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """Cached embedding of a query, from memory or disk"""
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return embedding
+        if self.max_files > 0:
+            path = self._path(key)
+            try:
+                embedding = torch.from_numpy(np.load(path))
+                # The file's mtime orders the disk cache by last use
+                os.utime(path)
+            except FileNotFoundError:
+                embedding = None
+            except Exception as e:
+                print(f"Error reading cached query embedding {path}: {str(e)}")
+                embedding = None
+            if embedding is not None:
+                self._remember(key, embedding)
+                with self._lock:
+                    self.hits += 1
+                return embedding
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, embedding: torch.Tensor):
+        """Cache the embedding of a query in memory and on disk"""
+        embedding = embedding.detach().float().cpu()
+        self._remember(key, embedding)
+        if self.max_files <= 0:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding.numpy())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error caching query embedding {path}: {str(e)}")
+            return
+        with self._lock:
+            if self._files is not None:
+                self._files += 1
+        self._prune()
+
+    def _prune(self):
+        """Delete the least recently used files once the disk cache is over its limit"""
+        with self._lock:
+            if self._files is not None and self._files <= self.max_files:
+                return
+        files = [(entry.stat().st_mtime, entry) for entry in self.root.glob("*/*.npy")]
+        excess = len(files) - self.max_files
+        if excess > 0:
+            # Prune a tenth below the limit so the directory is not listed on every put
+            excess += self.max_files // 10
+            for _, entry in sorted(files)[:excess]:
+                try:
+                    entry.unlink()
+                except OSError:
+                    pass
+        with self._lock:
+            self._files = len(files) - max(excess, 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._memory)}
+
+
+# Shared query cache used by the API
+query_cache = QueryCache()
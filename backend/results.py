@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from .index import INDEX_ROOT
+
+# SQLite database holding the results of recent searches
+RESULTS_DB = INDEX_ROOT / "results.db"
+
+# Searches whose results are kept; older ones are deleted as new ones are saved
+RESULTS_KEEP = int(os.environ.get("CLIP_RESULTS_KEEP", "50"))
+
+# Largest page served by /results
+MAX_PAGE_SIZE = 1000
+
+# Bumped when the tables change; stored results are a cache, so older
+# layouts are dropped rather than migrated
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    search_id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    meta TEXT NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    search_id TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    score REAL NOT NULL,
+    similarity REAL,
+    description TEXT,
+    width INTEGER,
+    height INTEGER,
+    region TEXT,
+    PRIMARY KEY (search_id, rank)
+) WITHOUT ROWID;
+"""
+
+
+class ResultStore:
+    """
+    Search results in SQLite, one row per result, so large result sets are
+    written in one transaction and read back a page at a time
+    Calls block on disk I/O and are meant to run in a worker thread
+    """
+
+    def __init__(self, path=RESULTS_DB, keep: int = RESULTS_KEEP):
+        self.path = path
+        self.keep = keep
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS results; DROP TABLE IF EXISTS searches;")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def save(self, search_id: str, meta: Dict, results: List[Dict]):
+        """Store the results of a search and drop the oldest searches beyond the limit"""
+        rows = (
+            (search_id, rank, result["path"], result["score"], result.get("similarity"),
+             result.get("description"), result.get("width"), result.get("height"),
+             json.dumps(result["region"]) if result.get("region") else None)
+            for rank, result in enumerate(results)
+        )
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                    (search_id, time.time(), json.dumps(meta), len(results))
+                )
+                conn.execute("DELETE FROM results WHERE search_id = ?", (search_id,))
+                conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                expired = [row[0] for row in conn.execute(
+                    "SELECT search_id FROM searches ORDER BY created DESC LIMIT -1 OFFSET ?", (self.keep,)
+                )]
+                for expired_id in expired:
+                    conn.execute("DELETE FROM results WHERE search_id = ?", (expired_id,))
+                    conn.execute("DELETE FROM searches WHERE search_id = ?", (expired_id,))
+
+    def page(self, search_id: str, offset: int = 0, limit: int = 100) -> Optional[Tuple[Dict, int, List[Dict]]]:
+        """
+        Return (meta, total, results[offset:offset + limit]), or None for an unknown search
+        A negative limit returns every result from offset on
+        """
+        with self._lock:
+            conn = self._connect()
+            search = conn.execute("SELECT meta, total FROM searches WHERE search_id = ?", (search_id,)).fetchone()
+            if search is None:
+                return None
+            rows = conn.execute(
+                "SELECT path, score, similarity, description, width, height, region FROM results "
+                "WHERE search_id = ? AND rank >= ? ORDER BY rank LIMIT ?",
+                (search_id, offset, limit)
+            ).fetchall()
+        results = [
+            {
+                "path": path,
+                "filename": os.path.basename(path),
+                "score": score,
+                "similarity": similarity,
+                "description": description,
+                "width": width,
+                "height": height,
+                "aspect_ratio": height / width if width else 1.0,
+                "region": json.loads(region) if region else None
+            }
+            for path, score, similarity, description, width, height, region in rows
+        ]
+        return json.loads(search[0]), search[1], results
+
+
+# Shared result store used by the API
+result_store = ResultStore()
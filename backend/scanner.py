@@ -0,0 +1,205 @@
+import os
+import json
+import asyncio
+import threading
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.gif'}
+
+# Directories listed in parallel; listing is I/O bound, so this can exceed the core count
+SCAN_WORKERS = int(os.environ.get("CLIP_SCAN_WORKERS", "8"))
+
+# Reuse cached listings of directories whose mtime has not changed
+SCAN_CACHE = os.environ.get("CLIP_SCAN_CACHE", "1") != "0"
+
+scan_pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+
+# Directory listings in flight at once; directories waiting to be listed are
+# queued by path, so memory stays bounded however wide the tree is
+MAX_PENDING_LISTINGS = SCAN_WORKERS * 4
+
+# Listing pools per storage device, created on first use, so a slow mount
+# does not hold up listing on other devices
+device_pools: Dict[int, ThreadPoolExecutor] = {}
+_device_pools_lock = threading.Lock()
+
+Listing = Tuple[List[Tuple[str, float, int]], List[str]]
+
+
+def is_supported(name: str) -> bool:
+    dot = name.rfind(".")
+    return dot > 0 and name[dot:].lower() in SUPPORTED_FORMATS
+
+
+def device_of(path: str) -> int:
+    """Storage device a path is on, or -1 if it cannot be stat'ed"""
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return -1
+
+
+def scan_pool_for(folder: str) -> ThreadPoolExecutor:
+    """Listing pool of the device a folder is on"""
+    device = device_of(folder)
+    with _device_pools_lock:
+        if device not in device_pools:
+            device_pools[device] = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+        return device_pools[device]
+
+
+class ListingCache:
+    """
+    Directory listings of one folder tree keyed by directory mtime
+    A directory's mtime changes when entries are added, removed or renamed,
+    so an unchanged directory is not listed or stat'ed again
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            print(f"Error loading directory listings {self.path}: {str(e)}")
+            self.entries = {}
+
+    def get(self, directory: str, mtime_ns: int) -> Optional[Listing]:
+        entry = self.entries.get(directory)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        files = [(os.path.join(directory, name), mtime, size) for name, mtime, size in entry[1]]
+        return files, [os.path.join(directory, name) for name in entry[2]]
+
+    def put(self, directory: str, mtime_ns: int, files: List[Tuple[str, float, int]], subdirs: List[str]):
+        """Store a listing as (name, mtime, size) rows and subdirectory names"""
+        with self._lock:
+            self.entries[directory] = [mtime_ns, files, subdirs]
+            self._dirty = True
+
+    def save(self, visited: Set[str]):
+        """Drop listings of directories a complete scan did not reach and write the cache"""
+        with self._lock:
+            gone = [directory for directory in self.entries if directory not in visited]
+            for directory in gone:
+                del self.entries[directory]
+            if not (self._dirty or gone):
+                return
+            self._dirty = False
+            entries = dict(self.entries)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".json.tmp")
+            # json.dumps uses the C encoder; json.dump to a file does not
+            with open(tmp, "w") as f:
+                f.write(json.dumps(entries))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"Error saving directory listings {self.path}: {str(e)}")
+
+
+def list_directory(directory: str, cache: ListingCache = None, reuse: bool = True) -> Listing:
+    """
+    Return (path, mtime, size) of the supported images directly in a directory and
+    its subdirectories; stat results come from the DirEntry where the OS provides them
+    """
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+    except OSError:
+        return [], []
+    if cache is not None and reuse:
+        cached = cache.get(directory, mtime_ns)
+        if cached is not None:
+            return cached
+
+    files, subdirs, names, subdir_names = [], [], [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        subdir_names.append(entry.name)
+                    elif is_supported(entry.name):
+                        st = entry.stat()
+                        files.append((entry.path, st.st_mtime, st.st_size))
+                        names.append((entry.name, st.st_mtime, st.st_size))
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Error listing directory {directory}: {str(e)}")
+        return [], []
+
+    if cache is not None:
+        cache.put(directory, mtime_ns, names, subdir_names)
+    return files, subdirs
+
+
+def iter_scan(
+    folder: str,
+    cache: ListingCache = None,
+    reuse: bool = True,
+    pool: ThreadPoolExecutor = None
+) -> Iterator[List[Tuple[str, float, int]]]:
+    """Yield the supported images of every directory below folder, listing subtrees in parallel"""
+    pool = pool or scan_pool
+    visited = {folder}
+    queued = deque([folder])
+    pending = set()
+    try:
+        while queued or pending:
+            while queued and len(pending) < MAX_PENDING_LISTINGS:
+                pending.add(pool.submit(list_directory, queued.popleft(), cache, reuse))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                visited.update(subdirs)
+                queued.extend(subdirs)
+                if files:
+                    yield files
+    finally:
+        for future in pending:
+            future.cancel()
+    if cache is not None:
+        cache.save(visited)
+
+
+async def stream_scan(
+    folder: str,
+    cache: ListingCache = None,
+    reuse: bool = True,
+    pool: ThreadPoolExecutor = None
+) -> AsyncIterator[List[Tuple[str, float, int]]]:
+    """Async variant of iter_scan: yields each directory's images as soon as it is listed"""
+    loop = asyncio.get_event_loop()
+    pool = pool or scan_pool
+    visited = {folder}
+    queued = deque([folder])
+    pending = set()
+    try:
+        while queued or pending:
+            while queued and len(pending) < MAX_PENDING_LISTINGS:
+                pending.add(loop.run_in_executor(pool, list_directory, queued.popleft(), cache, reuse))
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                visited.update(subdirs)
+                queued.extend(subdirs)
+                if files:
+                    yield files
+    finally:
+        for future in pending:
+            future.cancel()
+    if cache is not None:
+        await loop.run_in_executor(pool, cache.save, visited)
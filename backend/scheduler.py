@@ -0,0 +1,246 @@
+import os
+import heapq
+import asyncio
+import itertools
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional, Callable
+from .clip_utils import encode_image_batch, iter_image_batches, inference_executor, PREFETCH_BATCHES
+
+# A micro-batch is run once it holds this many images...
+MAX_BATCH = int(os.environ.get("CLIP_MAX_BATCH", "128"))
+
+# ...or once its oldest request has waited this many seconds
+MAX_WAIT = float(os.environ.get("CLIP_MAX_WAIT", "0.01"))
+
+# Searches admitted at once; further requests get 429
+MAX_SEARCHES = int(os.environ.get("CLIP_MAX_SEARCHES", "16"))
+
+# Request priorities (lower runs first)
+SEARCH_PRIORITY = 0
+BACKGROUND_PRIORITY = 10
+
+
+class InferenceScheduler:
+    """
+    Owns the model and runs image encode requests from every search and the
+    background indexer as shared micro-batches, highest priority first
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT, max_searches: int = MAX_SEARCHES):
+        self.model = None
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_searches = max_searches
+        self.active_searches = 0
+        self._queue = []
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, model):
+        """Take ownership of the model and start the batching loop"""
+        self.model = model
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def try_admit(self) -> bool:
+        """Reserve a search slot; False when the server is saturated"""
+        if self.active_searches >= self.max_searches:
+            return False
+        self.active_searches += 1
+        return True
+
+    def release(self):
+        """Free a search slot"""
+        self.active_searches = max(0, self.active_searches - 1)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(inputs) for _, _, inputs, _ in self._queue)
+
+    async def encode_images(self, inputs: torch.Tensor, priority: int = SEARCH_PRIORITY) -> torch.Tensor:
+        """Queue a [B, 3, H, W] batch and wait for its normalized embeddings"""
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), inputs, future))
+        self._wakeup.set()
+        return await future
+
+    def encoder(self, priority: int = SEARCH_PRIORITY) -> Callable:
+        """Return an encoder coroutine function for iter_image_batches"""
+        async def encode(inputs: torch.Tensor) -> torch.Tensor:
+            return await self.encode_images(inputs, priority)
+        return encode
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            # Give concurrent requests a moment to fill the micro-batch
+            deadline = loop.time() + self.max_wait
+            while self.queue_depth < self.max_batch and loop.time() < deadline:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+
+            # Take requests in priority order up to the batch limit; requests of
+            # cancelled searches are dropped without being encoded
+            requests = []
+            rows = 0
+            while self._queue and (not requests or rows + len(self._queue[0][2]) <= self.max_batch):
+                request = heapq.heappop(self._queue)
+                if request[3].done():
+                    continue
+                requests.append(request)
+                rows += len(request[2])
+            if not requests:
+                continue
+
+            try:
+                batch = torch.cat([inputs for _, _, inputs, _ in requests])
+                embeddings = await loop.run_in_executor(inference_executor, encode_image_batch, batch, self.model)
+            except Exception as e:
+                for _, _, _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            start = 0
+            for _, _, inputs, future in requests:
+                if not future.done():
+                    future.set_result(embeddings[start:start + len(inputs)])
+                start += len(inputs)
+
+
+async def encode_into_index(
+    index,
+    paths: List[str],
+    preprocess,
+    batch_size: int,
+    priority: int = SEARCH_PRIORITY,
+    on_batch: Callable = None,
+    on_progress: Callable = None,
+    executor: ThreadPoolExecutor = None
+):
+    """
+    Encode images into an index through the scheduler
+    Images another search is already encoding are not encoded again;
+    their embeddings are handed over once ready, and images that search
+    gives up on (cancelled or failed) are encoded here instead
+    on_batch(valid_paths, embeddings) is called for every batch,
+    on_progress(done_count) after every batch
+    executor is an optional thread pool to decode on
+    """
+    loop = asyncio.get_event_loop()
+    mine = [path for path in paths if path not in index.in_flight]
+    theirs = [(path, index.in_flight[path]) for path in paths if path in index.in_flight]
+    for path in mine:
+        index.in_flight[path] = loop.create_future()
+
+    done = 0
+    try:
+        async for batch_paths, valid_paths, embeddings in iter_image_batches(
+            mine, scheduler.model, preprocess, batch_size, encoder=scheduler.encoder(priority), executor=executor
+        ):
+            if embeddings is not None:
+                index.add(valid_paths, embeddings)
+            results = dict(zip(valid_paths, embeddings)) if embeddings is not None else {}
+            for path in batch_paths:
+                future = index.in_flight.pop(path, None)
+                if future is not None and not future.done():
+                    future.set_result(results.get(path))
+            if embeddings is not None and on_batch is not None:
+                on_batch(valid_paths, embeddings)
+            done += len(batch_paths)
+            if on_progress is not None:
+                on_progress(done)
+    finally:
+        # Images left unencoded (error or cancellation) can be claimed again;
+        # a cancelled future tells waiting searches to encode them themselves
+        # (a None result means the image could not be decoded)
+        for path in mine:
+            future = index.in_flight.pop(path, None)
+            if future is not None and not future.done():
+                future.cancel()
+
+    # Wait for images that another search is encoding; asyncio.wait (unlike
+    # gather) leaves the shared futures alone if this search is cancelled
+    for i in range(0, len(theirs), batch_size):
+        group = theirs[i:i + batch_size]
+        await asyncio.wait([future for _, future in group])
+        valid = [(path, future.result()) for path, future in group if not future.cancelled()]
+        valid = [(path, embedding) for path, embedding in valid if embedding is not None]
+        if valid and on_batch is not None:
+            on_batch([path for path, _ in valid], torch.stack([embedding for _, embedding in valid]))
+        abandoned = [path for path, future in group if future.cancelled()]
+        if abandoned:
+            await encode_into_index(index, abandoned, preprocess, batch_size, priority, on_batch, executor=executor)
+        done += len(group)
+        if on_progress is not None:
+            on_progress(done)
+
+
+async def encode_stream_into_index(
+    index,
+    batches: AsyncIterator[List[str]],
+    preprocess,
+    batch_size: int,
+    priority: int = SEARCH_PRIORITY,
+    on_batch: Callable = None,
+    on_progress: Callable = None,
+    prefetch: int = PREFETCH_BATCHES,
+    executor: ThreadPoolExecutor = None
+):
+    """
+    Encode images into an index as their paths arrive, e.g. from a folder scan
+    that is still running; up to prefetch + 1 batches are decoded or encoded at once
+    on_progress(done_count) is called after every batch
+    """
+    slots = asyncio.Semaphore(prefetch + 1)
+    tasks = set()
+    done = 0
+
+    async def encode(chunk):
+        nonlocal done
+        try:
+            await encode_into_index(index, chunk, preprocess, batch_size, priority, on_batch, executor=executor)
+        finally:
+            slots.release()
+        done += len(chunk)
+        if on_progress is not None:
+            on_progress(done)
+
+    async def start(chunk):
+        await slots.acquire()
+        # Stop at the first failed batch instead of after the whole stream
+        for task in [task for task in tasks if task.done()]:
+            tasks.discard(task)
+            task.result()
+        tasks.add(asyncio.ensure_future(encode(chunk)))
+
+    try:
+        buffer = []
+        async for paths in batches:
+            buffer.extend(paths)
+            while len(buffer) >= batch_size:
+                chunk, buffer = buffer[:batch_size], buffer[batch_size:]
+                await start(chunk)
+        if buffer:
+            await start(buffer)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# Shared scheduler instance used by the API
+scheduler = InferenceScheduler()
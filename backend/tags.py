@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import numpy as np
+import torch
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from .index import index_dir_for
+from .clip_utils import encode_texts
+
+# Optional label vocabulary file, one label per line
+LABELS_FILE = os.environ.get("CLIP_TAG_LABELS", "")
+
+# Default vocabulary, also used by analyze_image_content
+DEFAULT_LABELS = [
+    "a photograph", "digital art", "a painting", "a sketch",
+    "landscape photo", "portrait photo", "abstract art", "still life",
+    "black and white", "colorful", "high contrast", "soft lighting",
+    "nature scene", "urban scene", "indoor scene", "outdoor scene",
+    "close-up shot", "wide angle shot", "aerial view", "macro photography",
+    "night scene", "daylight scene", "sunset scene", "sunrise scene",
+    "architecture", "people", "animals", "plants",
+    "water", "mountains", "sky", "buildings",
+    "vintage style", "modern style", "minimalist", "detailed",
+    "texture", "pattern", "symmetrical", "asymmetrical"
+]
+
+# Tags kept per image and the smallest label probability kept as a tag
+TAGS_PER_IMAGE = 5
+MIN_TAG_SCORE = 0.05
+
+# CLIP logit scale applied before the softmax over labels
+LOGIT_SCALE = 100.0
+
+# Open tag stores, keyed by absolute folder path
+_stores: Dict[str, "TagStore"] = {}
+
+# Encoded label matrices, keyed by vocabulary
+_label_matrices: Dict[Tuple[str, ...], torch.Tensor] = {}
+
+
+def load_labels() -> List[str]:
+    """Return the configured label vocabulary"""
+    if LABELS_FILE:
+        try:
+            with open(LABELS_FILE, "r", encoding="utf-8") as f:
+                labels = [line.strip() for line in f if line.strip()]
+            if labels:
+                return list(dict.fromkeys(labels))
+        except Exception as e:
+            print(f"Error reading labels file {LABELS_FILE}: {str(e)}")
+    return DEFAULT_LABELS
+
+
+def label_matrix(labels: List[str], model) -> torch.Tensor:
+    """Return the [L, D] normalized embeddings of a vocabulary, encoding it only once"""
+    key = tuple(labels)
+    if key not in _label_matrices:
+        _label_matrices[key] = encode_texts(list(labels), model)
+    return _label_matrices[key]
+
+
+def label_probabilities(similarities: torch.Tensor) -> torch.Tensor:
+    """Turn [N, L] image-label cosine similarities into per-image label probabilities"""
+    return (LOGIT_SCALE * similarities).softmax(dim=-1)
+
+
+def top_labels(probabilities: torch.Tensor, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Return the (values, indices) of the k most likely labels of every image"""
+    return probabilities.topk(min(k, probabilities.shape[-1]), dim=-1)
+
+
+class TagStore:
+    """
+    Persisted zero-shot tags of one folder's images, with an inverted
+    label -> paths map so tag filters are set lookups
+    """
+
+    FILE = "tags.json"
+
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        self.path = index_dir_for(self.folder) / self.FILE
+        self.labels: List[str] = []
+        self.tags: Dict[str, List[Tuple[int, float]]] = {}
+        self.per_image = TAGS_PER_IMAGE
+        self.min_score = MIN_TAG_SCORE
+        self._postings: Dict[int, Set[str]] = {}
+        self.load()
+
+    @property
+    def tagged(self) -> bool:
+        return bool(self.labels)
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.labels = data["labels"]
+            self.per_image = data.get("per_image", TAGS_PER_IMAGE)
+            self.min_score = data.get("min_score", MIN_TAG_SCORE)
+            self.tags = {path: [tuple(tag) for tag in tags] for path, tags in data["tags"].items()}
+        except Exception as e:
+            print(f"Error loading tags for {self.folder}: {str(e)}")
+            self.labels, self.tags = [], {}
+        self._build_postings()
+
+    def save(self):
+        """Write the tags atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({
+                "labels": self.labels,
+                "per_image": self.per_image,
+                "min_score": self.min_score,
+                "tags": self.tags
+            }, f)
+        os.replace(tmp, self.path)
+
+    def _build_postings(self):
+        postings: Dict[int, Set[str]] = {}
+        for path, tags in self.tags.items():
+            for label_id, _ in tags:
+                postings.setdefault(label_id, set()).add(path)
+        self._postings = postings
+
+    def tag_index(
+        self,
+        index,
+        labels: List[str],
+        label_embeddings: torch.Tensor,
+        per_image: int = TAGS_PER_IMAGE,
+        min_score: float = MIN_TAG_SCORE,
+        paths: List[str] = None,
+        on_progress: Callable = None
+    ) -> Dict[str, int]:
+        """
+        Tag the images of an embedding index by scoring its stored matrix against
+        the [L, D] label matrix chunk by chunk; returns the image count per label
+        With paths, only those images are (re)tagged and the other tags are kept
+        """
+        self.labels = list(labels)
+        self.per_image, self.min_score = per_image, min_score
+        total = index.row_count()
+        known = set(index.paths[:total])
+        ids = None
+        if paths is not None:
+            wanted = set(paths)
+            ids = np.array([row for row, path in enumerate(index.paths[:total]) if path in wanted], dtype=np.int64)
+            self.tags = {path: tags for path, tags in self.tags.items() if path in known and path not in wanted}
+            total = len(ids)
+        else:
+            self.tags = {}
+
+        done = 0
+        if total:
+            for chunk_paths, similarities, _ in index.iter_scores(label_embeddings.T.contiguous(), ids=ids):
+                values, indices = top_labels(label_probabilities(similarities), per_image)
+                keep = values >= min_score
+                for path, row_values, row_indices, row_keep in zip(
+                    chunk_paths, values.tolist(), indices.tolist(), keep.tolist()
+                ):
+                    self.tags[path] = [
+                        (label_id, round(value, 4))
+                        for label_id, value, kept in zip(row_indices, row_values, row_keep) if kept
+                    ]
+                done += len(chunk_paths)
+                if on_progress is not None:
+                    on_progress(done, total)
+
+        self._build_postings()
+        self.save()
+        return self.label_counts()
+
+    def label_counts(self) -> Dict[str, int]:
+        """Number of images tagged with each label"""
+        return {label: len(self._postings.get(i, ())) for i, label in enumerate(self.labels)}
+
+    def image_tags(self, path: str) -> List[Tuple[str, float]]:
+        """Return the (label, probability) tags of an image"""
+        return [(self.labels[label_id], score) for label_id, score in self.tags.get(path, [])]
+
+    def _match_labels(self, term: str) -> List[int]:
+        """Labels named by a filter term: an exact label, else labels containing the term"""
+        term = term.strip().lower()
+        exact = [i for i, label in enumerate(self.labels) if label.lower() == term]
+        if exact:
+            return exact
+        return [i for i, label in enumerate(self.labels) if term in label.lower()]
+
+    def _term_paths(self, term: str) -> Set[str]:
+        paths = set()
+        for label_id in self._match_labels(term):
+            paths |= self._postings.get(label_id, set())
+        return paths
+
+    def lookup(self, expression: str) -> Set[str]:
+        """
+        Paths matching a tag filter such as "landscape AND sunset",
+        "people OR animals" or "water AND NOT night"; AND binds tighter than OR
+        """
+        result = set()
+        for clause in re.split(r"\s+OR\s+", expression.strip(), flags=re.IGNORECASE):
+            matches: Optional[Set[str]] = None
+            excluded = set()
+            for term in re.split(r"\s+AND\s+", clause, flags=re.IGNORECASE):
+                negated = re.match(r"NOT\s+(.+)", term.strip(), flags=re.IGNORECASE)
+                if negated:
+                    excluded |= self._term_paths(negated.group(1))
+                    continue
+                paths = self._term_paths(term)
+                matches = paths if matches is None else matches & paths
+            if matches is None:
+                # Only negated terms: start from every tagged image
+                matches = set(self.tags)
+            result |= matches - excluded
+        return result
+
+
+def get_tag_store(folder: str) -> TagStore:
+    """Return the shared tag store for a folder, loading it on first use"""
+    folder = os.path.abspath(folder)
+    if folder not in _stores:
+        _stores[folder] = TagStore(folder)
+    return _stores[folder]
@@ -0,0 +1,76 @@
+import os
+import hashlib
+from PIL import Image, features
+from typing import Tuple
+from .index import INDEX_ROOT
+from .imaging import open_image
+
+# On-disk thumbnail cache
+THUMB_ROOT = INDEX_ROOT / "thumbnails"
+
+# Requested sizes are rounded up to one of these bounding-box sizes
+THUMB_SIZES = (128, 256, 384, 512, 1024, 1600, 2048)
+DEFAULT_THUMB_SIZE = 384
+
+# Thumbnails are written as WebP when Pillow supports it
+THUMB_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMB_MEDIA_TYPE = "image/webp" if THUMB_FORMAT == "WEBP" else "image/jpeg"
+THUMB_QUALITY = 80
+
+# Write the default-size thumbnail while images are decoded for embedding
+THUMBNAILS_ON_INGEST = os.environ.get("CLIP_THUMBNAILS_ON_INGEST", "1") != "0"
+
+
+def snap_size(size: int) -> int:
+    """Round a requested size up to a supported thumbnail size"""
+    for thumb_size in THUMB_SIZES:
+        if size <= thumb_size:
+            return thumb_size
+    return THUMB_SIZES[-1]
+
+
+def thumbnail_key(image_path: str, mtime: float, file_size: int, size: int) -> str:
+    """Cache key of a thumbnail; changes whenever the source file changes"""
+    key = f"{os.path.abspath(image_path)}|{mtime}|{file_size}|{size}|{THUMB_FORMAT}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def thumbnail_path(key: str):
+    """Location of a thumbnail in the cache"""
+    extension = ".webp" if THUMB_FORMAT == "WEBP" else ".jpg"
+    return THUMB_ROOT / key[:2] / (key + extension)
+
+
+def write_thumbnail(image: Image.Image, path, size: int):
+    """Downscale an image to fit a size x size box and write it atomically"""
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    image.save(tmp_path, THUMB_FORMAT, quality=THUMB_QUALITY)
+    os.replace(tmp_path, path)
+
+
+def get_thumbnail(image_path: str, size: int = DEFAULT_THUMB_SIZE) -> Tuple[str, str]:
+    """Return (thumbnail path, ETag), generating the thumbnail if it is not cached"""
+    size = snap_size(size)
+    st = os.stat(image_path)
+    key = thumbnail_key(image_path, st.st_mtime, st.st_size, size)
+    path = thumbnail_path(key)
+    if not path.exists():
+        write_thumbnail(open_image(image_path, size), path, size)
+    return str(path), f'"{key}"'
+
+
+def save_ingest_thumbnail(image_path: str, image: Image.Image, target_size: int):
+    """Write the default thumbnail from an image already decoded for embedding"""
+    # The image must have been decoded at enough resolution for a sharp thumbnail
+    if target_size and target_size < DEFAULT_THUMB_SIZE:
+        return
+    try:
+        st = os.stat(image_path)
+        path = thumbnail_path(thumbnail_key(image_path, st.st_mtime, st.st_size, DEFAULT_THUMB_SIZE))
+        if not path.exists():
+            write_thumbnail(image, path, DEFAULT_THUMB_SIZE)
+    except Exception as e:
+        print(f"Error writing thumbnail for {image_path}: {str(e)}")
@@ -0,0 +1,64 @@
+import os
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from typing import List, Optional, Tuple
+
+# Multi-crop indexing: every image is also embedded as the tiles of an NxN grid for
+# every N listed, e.g. "2" (4 tiles) or "2,3" (4 + 9 tiles); empty disables tiling
+TILE_GRIDS = sorted({int(n) for n in os.environ.get("CLIP_TILE_GRIDS", "").split(",") if n.strip() and int(n) > 1})
+
+
+def tile_boxes(grids: List[int]) -> List[Tuple[float, float, float, float]]:
+    """Tile boxes (left, top, right, bottom) as fractions of the image size, grid by grid in row order"""
+    return [
+        (col / n, row / n, (col + 1) / n, (row + 1) / n)
+        for n in grids
+        for row in range(n)
+        for col in range(n)
+    ]
+
+
+# Boxes of the configured tiles; view 0 of an image is the whole image, view i is TILE_BOXES[i - 1]
+TILE_BOXES = tile_boxes(TILE_GRIDS)
+
+
+def tile_decode_size(target_size: int, boxes: List[Tuple[float, float, float, float]]) -> int:
+    """Reduced decode size that keeps the smallest tile at target_size"""
+    if not target_size or not boxes:
+        return target_size
+    smallest = min(min(right - left, bottom - top) for left, top, right, bottom in boxes)
+    return int(round(target_size / smallest))
+
+
+def crop_tiles(image: Image.Image, boxes: List[Tuple[float, float, float, float]]) -> List[Image.Image]:
+    """Crop the tiles of an image"""
+    width, height = image.size
+    return [
+        image.crop((round(left * width), round(top * height), round(right * width), round(bottom * height)))
+        for left, top, right, bottom in boxes
+    ]
+
+
+def whole_image(embeddings: torch.Tensor) -> torch.Tensor:
+    """Whole-image embeddings [B, D] of [B, D] or tiled [B, 1 + tiles, D] embeddings"""
+    return embeddings[:, 0] if embeddings.dim() == 3 else embeddings
+
+
+def pool_views(embeddings: torch.Tensor, query: torch.Tensor) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Cosine similarities of embeddings with a query, max-pooled over the views of
+    tiled [B, 1 + tiles, D] embeddings; also returns the best view of every image
+    (None for untiled [B, D] embeddings)
+    """
+    if embeddings.dim() == 2:
+        return F.cosine_similarity(embeddings, query.unsqueeze(0)), None
+    scores = F.normalize(embeddings.float(), dim=-1) @ F.normalize(query.float(), dim=0)
+    return scores.max(dim=1)
+
+
+def region_of(view: int) -> Optional[List[float]]:
+    """Box of a best view as [left, top, right, bottom] fractions, or None for the whole image"""
+    if view <= 0 or view > len(TILE_BOXES):
+        return None
+    return [round(value, 4) for value in TILE_BOXES[view - 1]]
@@ -0,0 +1,47 @@
+import torch
+from typing import List, Tuple, Any
+
+
+class TopK:
+    """
+    Running top-k over scored batches
+    A k of 0 keeps every item
+    """
+
+    def __init__(self, k: int = 0):
+        self.k = k
+        self.scores = torch.empty(0)
+        self.items: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def threshold(self) -> float:
+        """Score an item must beat to enter a full top-k"""
+        if self.k > 0 and len(self.items) >= self.k:
+            return self.scores.min().item()
+        return float("-inf")
+
+    def candidates(self, scores: torch.Tensor) -> torch.Tensor:
+        """Return indices of the scores that can still enter the top-k"""
+        indices = torch.nonzero(scores > self.threshold).squeeze(1)
+        if self.k > 0 and len(indices) > self.k:
+            indices = indices[torch.topk(scores[indices], self.k).indices]
+        return indices
+
+    def push(self, scores: torch.Tensor, items: List[Any]):
+        """Merge scored items into the running top-k"""
+        if not items:
+            return
+        self.scores = torch.cat([self.scores, scores.float()])
+        self.items = self.items + list(items)
+        if self.k > 0 and len(self.items) > self.k:
+            values, indices = torch.topk(self.scores, self.k)
+            self.scores = values
+            self.items = [self.items[i] for i in indices.tolist()]
+
+    def results(self) -> List[Tuple[float, Any]]:
+        """Return (score, item) pairs sorted by score in descending order"""
+        order = torch.argsort(self.scores, descending=True).tolist()
+        return [(self.scores[i].item(), self.items[i]) for i in order]
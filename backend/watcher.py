@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional
+from .index import get_index, scan_folder, INDEX_ROOT, SUPPORTED_FORMATS
+from .clip_utils import thread_pool, inference_executor
+from .scheduler import encode_into_index, BACKGROUND_PRIORITY
+from .tags import get_tag_store, label_matrix
+
+# watchdog is optional; without it folders are re-scanned periodically
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Registered folders survive restarts
+FOLDERS_FILE = INDEX_ROOT / "watched_folders.json"
+
+# Seconds between mtime-diff re-scans of every registered folder
+POLL_INTERVAL = float(os.environ.get("CLIP_WATCH_INTERVAL", "60"))
+
+# Seconds to wait after a change so bursts of events are handled together
+DEBOUNCE_DELAY = 2.0
+
+# Background encoding works in small batches; the scheduler runs them
+# behind search requests so searches are not starved
+BATCH_SIZE = 16
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """Mark a registered folder dirty when an image below it changes"""
+
+    def __init__(self, indexer: "FolderIndexer", folder: str):
+        super().__init__()
+        self.indexer = indexer
+        self.folder = folder
+
+    def on_any_event(self, event):
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        if event.is_directory or any(
+            os.path.splitext(path)[1].lower() in SUPPORTED_FORMATS for path in paths if path
+        ):
+            self.indexer.mark_dirty_threadsafe(self.folder)
+
+
+class FolderIndexer:
+    """
+    Long-running service that keeps the embedding index of registered folders
+    up to date, using filesystem events when watchdog is installed and a
+    periodic mtime-diff re-scan otherwise
+    """
+
+    def __init__(self):
+        self.folders: Dict[str, Dict] = {}
+        self.model = None
+        self.preprocess = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._observer = None
+
+    @property
+    def watching(self) -> bool:
+        return self._observer is not None
+
+    def start(self, model, preprocess):
+        """Start the background loop and re-register saved folders"""
+        self.model = model
+        self.preprocess = preprocess
+        self._loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.daemon = True
+            self._observer.start()
+        for folder in self._load_folders():
+            if os.path.isdir(folder):
+                self.register(folder)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background loop and the filesystem observer"""
+        if self._task is not None:
+            self._task.cancel()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def register(self, folder: str):
+        """Start keeping a folder indexed"""
+        folder = os.path.abspath(folder)
+        if folder in self.folders:
+            return
+        state = {"dirty": True, "pending": 0, "last_synced": None, "watch": None}
+        if self._observer is not None:
+            try:
+                state["watch"] = self._observer.schedule(_ChangeHandler(self, folder), folder, recursive=True)
+            except Exception as e:
+                print(f"Error watching folder {folder}: {str(e)}")
+        self.folders[folder] = state
+        self._save_folders()
+        self._wakeup.set()
+
+    def unregister(self, folder: str):
+        """Stop keeping a folder indexed"""
+        state = self.folders.pop(os.path.abspath(folder), None)
+        if state is None:
+            return
+        if state["watch"] is not None:
+            self._observer.unschedule(state["watch"])
+        self._save_folders()
+
+    def mark_dirty(self, folder: str):
+        """Queue a folder for re-synchronization"""
+        if folder in self.folders:
+            self.folders[folder]["dirty"] = True
+            self._wakeup.set()
+
+    def mark_dirty_threadsafe(self, folder: str):
+        """Queue a folder for re-synchronization from an observer thread"""
+        self._loop.call_soon_threadsafe(self.mark_dirty, folder)
+
+    def is_current(self, folder: str) -> bool:
+        """Whether a search can use the stored index of a folder without re-scanning it"""
+        state = self.folders.get(os.path.abspath(folder))
+        if state is None or state["dirty"] or state["pending"] or state["last_synced"] is None:
+            return False
+        # Without filesystem events the index is only as fresh as the last re-scan
+        return self.watching or time.time() - state["last_synced"] < POLL_INTERVAL
+
+    def status(self) -> Dict:
+        """Queue depth and synchronization state of every registered folder"""
+        folders = [
+            {
+                "folder": folder,
+                "indexed": len(get_index(folder)),
+                "pending": state["pending"],
+                "dirty": state["dirty"],
+                "last_synced": state["last_synced"]
+            }
+            for folder, state in self.folders.items()
+        ]
+        synced = [f["last_synced"] for f in folders if f["last_synced"] is not None]
+        return {
+            "watching": self.watching,
+            "queue_depth": sum(f["pending"] + int(f["dirty"]) for f in folders),
+            "last_synced": max(synced) if synced else None,
+            "folders": folders
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                await asyncio.sleep(DEBOUNCE_DELAY)
+            except asyncio.TimeoutError:
+                # Periodic fallback: re-scan everything to catch missed changes
+                for state in self.folders.values():
+                    state["dirty"] = True
+            self._wakeup.clear()
+
+            for folder in list(self.folders):
+                if folder in self.folders and self.folders[folder]["dirty"]:
+                    try:
+                        await self.sync_folder(folder)
+                    except Exception as e:
+                        print(f"Error indexing folder {folder}: {str(e)}")
+
+    async def sync_folder(self, folder: str):
+        """Embed new and modified images of a folder and evict deleted ones"""
+        state = self.folders[folder]
+        state["dirty"] = False
+        loop = asyncio.get_event_loop()
+
+        # Re-stat every image so in-place edits are caught; this also refreshes the listing cache
+        files = await loop.run_in_executor(thread_pool, scan_folder, folder, False)
+        index = get_index(folder)
+        async with index.lock:
+            stale_files = index.sync(files)
+        state["pending"] = len(stale_files)
+
+        def on_progress(processed_images):
+            state["pending"] = max(0, len(stale_files) - processed_images)
+
+        await encode_into_index(
+            index, stale_files, self.preprocess, BATCH_SIZE,
+            priority=BACKGROUND_PRIORITY, on_progress=on_progress
+        )
+
+        async with index.lock:
+            await loop.run_in_executor(thread_pool, index.save)
+            # Folders that have been tagged keep their tags current
+            store = get_tag_store(folder)
+            if store.tagged and (stale_files or len(store.tags) != len(index)):
+                labels = await loop.run_in_executor(inference_executor, label_matrix, store.labels, self.model)
+                await loop.run_in_executor(
+                    thread_pool, lambda: store.tag_index(
+                        index, store.labels, labels, store.per_image, store.min_score, paths=stale_files
+                    )
+                )
+        state["pending"] = 0
+        state["last_synced"] = time.time()
+
+    def _load_folders(self) -> List[str]:
+        try:
+            if FOLDERS_FILE.exists():
+                with open(FOLDERS_FILE, "r") as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Error reading watched folders: {str(e)}")
+        return []
+
+    def _save_folders(self):
+        try:
+            FOLDERS_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(FOLDERS_FILE, "w") as f:
+                json.dump(list(self.folders), f)
+        except Exception as e:
+            print(f"Error saving watched folders: {str(e)}")
+
+
+# Shared indexer instance used by the API
+indexer = FolderIndexer()
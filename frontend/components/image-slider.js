@@ -58,7 +58,7 @@ class ImageSlider {
     this.currentIndex = startIndex;
     
     this.slider.innerHTML = images.map((img, index) => `
-      <li class="slider-item" style="background-image: url('/image/${encodeURIComponent(img.path)}')">
+      <li class="slider-item" style="background-image: url('/thumb/${encodeURIComponent(img.path)}?size=1600')">
         <div class="slider-content">
           ${img.description ? `
             <h2 class="title">${img.filename}</h2>
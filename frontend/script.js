@@ -11,6 +11,7 @@ document.addEventListener('DOMContentLoaded', async function() {
   const minScoreInput = document.getElementById('minScore');
   const minScoreValue = document.getElementById('minScoreValue');
   const batchSize = document.getElementById('batchSize');
+  const topK = document.getElementById('topK');
   const browseFolderBtn = document.getElementById('browseFolderBtn');
   const folderPath = document.getElementById('folderPath');
   const imageModal = document.getElementById('imageModal');
@@ -20,9 +21,17 @@ document.addEventListener('DOMContentLoaded', async function() {
   const imageSearchSection = document.getElementById('imageSearchSection');
   const textSearchSection = document.getElementById('textSearchSection');
   const searchQuery = document.getElementById('searchQuery');
+  const loadMore = document.getElementById('loadMore');
+  const loadMoreBtn = document.getElementById('loadMoreBtn');
+
+  // Results are shown a page at a time; further pages come from /results
+  const RESULTS_PAGE_SIZE = 200;
 
   let selectedImagePath = null;
   let currentSearchType = 'image';
+  let currentResults = [];
+  let currentSearchId = null;
+  let resultsTotal = 0;
 
   // Load last settings
   try {
@@ -36,14 +45,47 @@ document.addEventListener('DOMContentLoaded', async function() {
       imagePreview.src = `/image/${encodeURIComponent(settings.last_query)}`;
       previewContainer.style.display = 'block';
     }
-    // Display last results if available
-    if (settings && settings.last_results && settings.last_results.length > 0) {
-      displayResults(settings.last_results);
+    // Display the first page of the last results if available
+    if (settings && settings.last_search_id) {
+      currentSearchId = settings.last_search_id;
+      await loadResultsPage(false);
     }
   } catch (error) {
     console.error('Error loading last settings:', error);
   }
 
+  async function loadResultsPage(append) {
+    const offset = append ? currentResults.length : 0;
+    const response = await fetch(`/results/${currentSearchId}?offset=${offset}&limit=${RESULTS_PAGE_SIZE}`);
+    if (!response.ok) {
+      currentSearchId = null;
+      updateLoadMore();
+      return;
+    }
+    const data = await response.json();
+    resultsTotal = data.total;
+    if (data.results.length > 0 || append) {
+      displayResults(data.results, append);
+    }
+    updateLoadMore();
+  }
+
+  function updateLoadMore() {
+    const remaining = currentSearchId ? resultsTotal - currentResults.length : 0;
+    loadMore.classList.toggle('show', remaining > 0);
+  }
+
+  loadMoreBtn.addEventListener('click', async () => {
+    loadMoreBtn.disabled = true;
+    try {
+      await loadResultsPage(true);
+    } catch (error) {
+      console.error('Error loading more results:', error);
+    } finally {
+      loadMoreBtn.disabled = false;
+    }
+  });
+
   // Drag and drop handlers
   if (dropZone) {
     ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
@@ -103,24 +145,32 @@ document.addEventListener('DOMContentLoaded', async function() {
     minScoreValue.textContent = `${this.value}%`;
   });
 
-  // Folder selection handling
-  browseFolderBtn.addEventListener('click', async () => {
+  // Folder selection handling; several folders are separated by ';'
+  async function selectFolder(append) {
     try {
       const response = await fetch('/select-image', {
         method: 'POST'
       });
       const data = await response.json();
       if (data.folder_path) {
-        folderPath.value = data.folder_path;
+        const folders = append && folderPath.value ? folderPath.value.split(';') : [];
+        if (!folders.includes(data.folder_path)) {
+          folders.push(data.folder_path);
+        }
+        folderPath.value = folders.join(';');
       }
     } catch (error) {
       console.error('Error selecting folder:', error);
       alert('Error selecting folder: ' + error.message);
     }
-  });
+  }
+
+  browseFolderBtn.addEventListener('click', () => selectFolder(false));
+  document.getElementById('addFolderBtn').addEventListener('click', () => selectFolder(true));
 
   // Update loading display functions
   let eventSource;
+  let activeSearchId = null;
   const searchProgress = document.getElementById('searchProgress');
   const progressText = document.getElementById('progressText');
   const statusText = document.getElementById('statusText');
@@ -138,9 +188,10 @@ document.addEventListener('DOMContentLoaded', async function() {
       eventSource.close();
       eventSource = null;
     }
+    activeSearchId = null;
     
     // Hide loading overlay
-    loading.classList.remove('show');
+    loading.classList.remove('show', 'partial');
     setTimeout(() => {
       loading.style.display = 'none';
       // Reset progress for next time
@@ -224,13 +275,27 @@ document.addEventListener('DOMContentLoaded', async function() {
   // Form submission
   form.addEventListener('submit', async function(e) {
     e.preventDefault();
+
+    // Stop a search that is still running before starting the next one
+    if (activeSearchId) {
+      fetch(`/search/${activeSearchId}`, { method: 'DELETE' }).catch(() => {});
+      activeSearchId = null;
+    }
+    if (eventSource) {
+      eventSource.close();
+      eventSource = null;
+    }
+
     gallery.innerHTML = '';
+    currentSearchId = null;
+    updateLoadMore();
     showLoading();
 
     const formData = new FormData();
     formData.append('folder', folderPath.value);
     formData.append('min_score', minScoreInput.value / 100);
     formData.append('batch_size', batchSize.value);
+    formData.append('top_k', topK.value);
     formData.append('search_type', currentSearchType);
 
     if (currentSearchType === 'image') {
@@ -262,6 +327,7 @@ document.addEventListener('DOMContentLoaded', async function() {
       }
       
       const { search_id } = await response.json();
+      activeSearchId = search_id;
       
       // Close any existing SSE connection
       if (eventSource) {
@@ -269,7 +335,9 @@ document.addEventListener('DOMContentLoaded', async function() {
       }
       
       // Connect to SSE endpoint for progress updates
-      eventSource = new EventSource(`/search-progress/${search_id}`);
+      // Only the first page of the final results is streamed
+      eventSource = new EventSource(`/search-progress/${search_id}?limit=${RESULTS_PAGE_SIZE}`);
+      let finalResults = [];
       
       eventSource.onmessage = (event) => {
         const data = JSON.parse(event.data);
@@ -279,13 +347,19 @@ document.addEventListener('DOMContentLoaded', async function() {
             updateProgress(data.progress, data.status);
             break;
             
-          case 'complete':
-            // Display results
-            if (!data.results || !Array.isArray(data.results)) {
-              throw new Error('Invalid response format from server');
-            }
+          case 'partial':
+            // Show the best matches so far while the search keeps running
+            loading.classList.add('partial');
+            displayResults(data.results);
+            break;
             
-            if (data.results.length === 0) {
+          case 'results':
+            // Final results arrive in chunks
+            finalResults = finalResults.concat(data.results);
+            break;
+            
+          case 'complete':
+            if (finalResults.length === 0) {
               gallery.innerHTML = `
                 <div class="no-results">
                   <i class="bi bi-search" style="font-size: 3rem; opacity: 0.5;"></i>
@@ -294,11 +368,18 @@ document.addEventListener('DOMContentLoaded', async function() {
                 </div>
               `;
             } else {
-              displayResults(data.results);
+              displayResults(finalResults);
+              currentSearchId = search_id;
+              resultsTotal = data.total;
+              updateLoadMore();
             }
             hideLoading();
             break;
             
+          case 'cancelled':
+            hideLoading();
+            break;
+            
           case 'error':
             throw new Error(data.message);
         }
@@ -325,13 +406,53 @@ document.addEventListener('DOMContentLoaded', async function() {
     }
   });
 
-  function displayResults(results) {
-    if(results.length === 0) {
-      gallery.innerHTML = '<div class="text-center p-5"><h3>No similar images found</h3></div>';
-      return;
+  // Outline the tile that matched best; region is [left, top, right, bottom] as fractions of the image
+  function addRegionHighlight(container, img, region) {
+    const [left, top, right, bottom] = region;
+    // Keep the matched tile inside the cropped thumbnail
+    img.style.objectPosition = `${(left + right) * 50}% ${(top + bottom) * 50}%`;
+    
+    const overlay = document.createElement('div');
+    overlay.className = 'region-highlight';
+    const box = document.createElement('div');
+    box.className = 'region-box';
+    overlay.appendChild(box);
+    container.appendChild(overlay);
+    
+    // The thumbnail is scaled to cover the container, so map the region through that scaling
+    const place = () => {
+      const width = container.clientWidth;
+      const height = container.clientHeight;
+      if (!img.naturalWidth || !width || !height) return;
+      const scale = Math.max(width / img.naturalWidth, height / img.naturalHeight);
+      const shownWidth = img.naturalWidth * scale;
+      const shownHeight = img.naturalHeight * scale;
+      const offsetX = (width - shownWidth) * (left + right) / 2;
+      const offsetY = (height - shownHeight) * (top + bottom) / 2;
+      box.style.left = `${(offsetX + left * shownWidth) / width * 100}%`;
+      box.style.top = `${(offsetY + top * shownHeight) / height * 100}%`;
+      box.style.width = `${(right - left) * shownWidth / width * 100}%`;
+      box.style.height = `${(bottom - top) * shownHeight / height * 100}%`;
+    };
+    
+    img.addEventListener('load', place);
+    if (window.ResizeObserver) {
+      new ResizeObserver(place).observe(container);
     }
+  }
 
-    gallery.innerHTML = '';
+  function displayResults(results, append = false) {
+    if (!append) {
+      currentResults = [];
+      if(results.length === 0) {
+        gallery.innerHTML = '<div class="text-center p-5"><h3>No similar images found</h3></div>';
+        return;
+      }
+      gallery.innerHTML = '';
+    }
+    
+    const startIndex = currentResults.length;
+    currentResults = currentResults.concat(results);
     
     results.forEach((result, index) => {
       const item = document.createElement('div');
@@ -360,7 +481,7 @@ document.addEventListener('DOMContentLoaded', async function() {
       imageContainer.className = 'image-container';
       
       const img = document.createElement('img');
-      img.src = `/image/${encodeURIComponent(result.path)}`;
+      img.src = `/thumb/${encodeURIComponent(result.path)}?size=384`;
       img.alt = result.filename;
       img.loading = 'lazy';
       
@@ -383,6 +504,9 @@ document.addEventListener('DOMContentLoaded', async function() {
       `;
       
       imageContainer.appendChild(img);
+      if (result.region) {
+        addRegionHighlight(imageContainer, img, result.region);
+      }
       item.appendChild(imageContainer);
       item.appendChild(details);
 
@@ -390,7 +514,7 @@ document.addEventListener('DOMContentLoaded', async function() {
       item.addEventListener('click', () => {
         console.log('Gallery item clicked:', result);
         try {
-          imageSlider.loadImages(results, index);
+          imageSlider.loadImages(currentResults, startIndex + index);
           imageSlider.show();
         } catch (error) {
           console.error('Error showing image in slider:', error);
@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+from backend.ann import IVFIndex, ANN_MIN_SIZE
+from backend.benchmark import synthetic_embeddings
+
+
+def test_all_lists_together_hold_every_row():
+    matrix = synthetic_embeddings(2000, dim=32, clusters=16)
+    ann = IVFIndex.build(matrix, nlist=16)
+    assert ann.nlist == 16 and len(ann) == 2000
+    query = torch.from_numpy(matrix[0])
+    assert ann.candidates(query, nprobe=16).tolist() == list(range(2000))
+    candidates = ann.candidates(query, nprobe=2)
+    assert 0 in candidates and len(candidates) < 2000
+    assert (np.diff(candidates) > 0).all()
+
+
+def test_search_finds_the_exact_top_matches():
+    matrix = synthetic_embeddings(4000, dim=32, clusters=16, seed=1)
+    ann = IVFIndex.build(matrix, nlist=16)
+    query = torch.from_numpy(matrix[123])
+    exact = set(torch.topk(torch.from_numpy(matrix) @ query, 10).indices.tolist())
+    ids, scores = ann.search(matrix, query, 10, nprobe=4)
+    assert ids[0] == 123 and abs(scores[0].item() - 1) < 1e-5
+    assert len(exact & set(ids.tolist())) >= 8
+
+
+def test_add_and_select_keep_rows_aligned(tmp_path):
+    matrix = synthetic_embeddings(1000, dim=32, clusters=8, seed=2)
+    ann = IVFIndex.build(matrix[:800], nlist=8)
+    ann.add(matrix[800:])
+    assert len(ann) == 1000
+    # New rows go to their nearest centroid
+    nearest = (torch.from_numpy(matrix[800:]) @ ann.centroids.T).argmax(dim=1).numpy()
+    assert (ann.assignments[800:] == nearest).all()
+
+    # Dropping rows renumbers the survivors in order
+    keep = list(range(0, 1000, 2))
+    assignments = ann.assignments[keep]
+    ann.select(keep)
+    assert len(ann) == 500 and (ann.assignments == assignments).all()
+    assert ann.candidates(torch.from_numpy(matrix[0]), nprobe=8).tolist() == list(range(500))
+
+    path = tmp_path / "ann.npz"
+    ann.save(path)
+    loaded = IVFIndex.load(path)
+    assert (loaded.assignments == ann.assignments).all() and loaded.trained_size == 800
+    assert torch.equal(loaded.centroids, ann.centroids)
+
+
+def test_rebuild_once_grown_well_past_training_size():
+    matrix = synthetic_embeddings(100, dim=8, clusters=4, seed=3)
+    ann = IVFIndex.build(matrix, nlist=4)
+    assert not ann.needs_rebuild()
+    ann.assignments = np.zeros(4 * ANN_MIN_SIZE + 1, dtype=np.int32)
+    assert ann.needs_rebuild()
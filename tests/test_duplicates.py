@@ -0,0 +1,82 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from backend.ann import IVFIndex
+from backend.benchmark import synthetic_embeddings
+from backend.duplicates import find_duplicates, join_exact, group_by_hash, perceptual_hash, DisjointSet
+from backend.index import quantize
+
+
+def with_near_copies(size: int, copies: int, seed: int = 0):
+    """Synthetic embeddings with slightly perturbed copies of their first rows appended"""
+    matrix = synthetic_embeddings(size, dim=32, clusters=16, seed=seed)
+    rng = np.random.default_rng(seed)
+    noise = 0.02 * rng.standard_normal((copies, matrix.shape[1])).astype(np.float32)
+    near = F.normalize(torch.from_numpy(matrix[:copies] + noise), dim=1).numpy()
+    return np.concatenate([matrix, near])
+
+
+def cluster_sets(clusters):
+    return {frozenset(member["path"] for member in cluster["paths"]) for cluster in clusters}
+
+
+def test_exact_join_finds_every_near_copy():
+    matrix = with_near_copies(500, 20)
+    paths = [f"{i}.jpg" for i in range(len(matrix))]
+    clusters = find_duplicates(matrix, None, paths, threshold=0.95)
+    assert cluster_sets(clusters) == {frozenset([f"{i}.jpg", f"{500 + i}.jpg"]) for i in range(20)}
+    assert all(cluster["size"] == 2 and 0.95 <= cluster["score"] <= 1.0 for cluster in clusters)
+
+
+def test_blocked_join_matches_a_single_block():
+    matrix = with_near_copies(300, 30, seed=1)
+    ids = np.arange(len(matrix))
+    whole, blocked = DisjointSet(len(matrix)), DisjointSet(len(matrix))
+    join_exact(whole, matrix, None, ids, 0.9, block_size=len(matrix))
+    join_exact(blocked, matrix, None, ids, 0.9, block_size=64)
+    assert [group.tolist() for group in whole.clusters()] == [group.tolist() for group in blocked.clusters()]
+    assert np.allclose(whole.best, blocked.best)
+
+
+def test_ann_join_finds_the_exact_clusters():
+    matrix = with_near_copies(2000, 50, seed=2)
+    paths = [f"{i}.jpg" for i in range(len(matrix))]
+    exact = cluster_sets(find_duplicates(matrix, None, paths, threshold=0.95))
+    ann = IVFIndex.build(matrix, nlist=16)
+    approximate = cluster_sets(find_duplicates(matrix, None, paths, threshold=0.95, ann=ann, nprobe=16))
+    assert approximate == exact
+    # Probing fewer lists may miss pairs across lists, but never invents any
+    pairs = cluster_sets(find_duplicates(matrix, None, paths, threshold=0.95, ann=ann, nprobe=2))
+    assert pairs <= exact and len(pairs) >= len(exact) * 0.8
+
+
+def test_int8_rows_are_compared_like_float32():
+    matrix = with_near_copies(500, 20, seed=3)
+    paths = [f"{i}.jpg" for i in range(len(matrix))]
+    quantized, scales = quantize(torch.from_numpy(matrix), "int8")
+    assert cluster_sets(find_duplicates(quantized, scales, paths, threshold=0.95)) == \
+        cluster_sets(find_duplicates(matrix, None, paths, threshold=0.95))
+
+
+def test_identical_hashes_are_grouped_without_embeddings():
+    representatives, groups = group_by_hash([7, 0, 7, 9, None, 7])
+    assert representatives.tolist() == [0, 1, 3, 4]
+    assert [group.tolist() for group in groups] == [[0, 2, 5]]
+
+    # Rows with identical hashes are grouped even if their embeddings differ
+    matrix = synthetic_embeddings(6, dim=32, clusters=6, seed=4)
+    paths = [f"{i}.jpg" for i in range(6)]
+    clusters = find_duplicates(matrix, None, paths, threshold=0.99, hashes=[7, 0, 7, 9, None, 7])
+    assert cluster_sets(clusters) == {frozenset(["0.jpg", "2.jpg", "5.jpg"])}
+    assert clusters[0]["score"] == 1.0
+
+
+def test_perceptual_hash_ignores_resizing(tmp_path):
+    gradient = np.tile(np.linspace(0, 255, 256, dtype=np.uint8), (256, 1))
+    image = Image.fromarray(np.stack([gradient, gradient.T, 255 - gradient], axis=2))
+    image.save(tmp_path / "large.png")
+    image.resize((96, 96)).save(tmp_path / "small.png")
+    assert perceptual_hash(str(tmp_path / "large.png")) == perceptual_hash(str(tmp_path / "small.png"))
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    assert perceptual_hash(str(tmp_path / "broken.png")) is None
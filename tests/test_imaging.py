@@ -0,0 +1,73 @@
+import pytest
+import torch
+from PIL import Image
+from backend.benchmark import make_corpus
+from backend.imaging import open_image
+from backend.models import ClipPreprocess
+
+# Largest allowed embedding drift (1 - cosine), as in `benchmark drift`
+MAX_DRIFT = 0.02
+
+# Orientation tag of a photo taken with the camera turned clockwise
+ROTATED_90_CW = 6
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("corpus")
+    make_corpus(str(folder), 3)
+    return sorted(str(path) for path in folder.glob("*.jpg"))
+
+
+def test_large_jpeg_is_decoded_at_reduced_resolution(corpus):
+    reduced = open_image(corpus[0], 448)
+    full = open_image(corpus[0], 0)
+    assert full.size == (1920, 1280)
+    assert min(reduced.size) >= 448 and reduced.width < full.width
+    assert reduced.width / reduced.height == pytest.approx(full.width / full.height, rel=0.01)
+
+
+def test_large_png_is_reduced_by_an_integer_factor(tmp_path):
+    path = str(tmp_path / "wide.png")
+    Image.new("RGB", (2000, 1000), (10, 20, 30)).save(path)
+    assert open_image(path, 448).size == (1000, 500)
+    assert open_image(path, 0).size == (2000, 1000)
+
+
+def test_preprocessed_pixels_barely_drift(corpus):
+    preprocess = ClipPreprocess()
+    for path in corpus:
+        difference = (preprocess(open_image(path, 448)) - preprocess(open_image(path, 0))).abs()
+        assert difference.mean().item() < 0.02
+        assert difference.max().item() < 0.15
+
+
+@pytest.mark.parametrize("target_size", [0, 448])
+def test_exif_orientation_is_applied(tmp_path, target_size):
+    # Stored landscape with a red block in its top-left corner
+    image = Image.new("RGB", (1800, 1200), (0, 0, 255))
+    image.paste((255, 0, 0), (0, 0, 300, 300))
+    exif = Image.Exif()
+    exif[0x0112] = ROTATED_90_CW
+    path = str(tmp_path / "rotated.jpg")
+    image.save(path, exif=exif, quality=95)
+
+    upright = open_image(path, target_size)
+    width, height = upright.size
+    assert height > width
+    # Turned upright, the block ends up in the top-right corner
+    red, _, blue = upright.getpixel((width - 1 - width // 20, height // 40))
+    assert red > 200 and blue < 60
+    red, _, blue = upright.getpixel((width // 20, height // 40))
+    assert red < 60 and blue > 200
+
+
+def test_embeddings_barely_drift(corpus):
+    pytest.importorskip("clip")
+    from backend.clip_utils import load_model, encode_image_batch
+
+    model, preprocess = load_model()
+    full = encode_image_batch(torch.stack([preprocess(open_image(path, 0)) for path in corpus]), model)
+    reduced = encode_image_batch(torch.stack([preprocess(open_image(path, 448)) for path in corpus]), model)
+    drift = 1 - (full * reduced).sum(dim=1)
+    assert drift.max().item() < MAX_DRIFT
@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+import backend.index as index_module
+from backend.index import EmbeddingIndex, quantize, dequantize, score_block
+
+
+def make_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    return EmbeddingIndex(str(tmp_path / "photos"), "float32", tile_grids=[])
+
+
+def unit(rows: int, seed: int) -> torch.Tensor:
+    return F.normalize(torch.from_numpy(np.random.default_rng(seed).standard_normal((rows, 8)).astype(np.float32)), dim=1)
+
+
+def test_sweep_replaces_modified_rows_after_concurrent_eviction(tmp_path, monkeypatch):
+    index = make_index(tmp_path, monkeypatch)
+    files = [("a.jpg", 1.0, 10), ("b.jpg", 1.0, 10), ("c.jpg", 1.0, 10)]
+    index.add(index.new_paths(files), unit(3, 0))
+
+    # A streaming scan starts and finds b.jpg modified...
+    seen = np.zeros(index.row_count(), dtype=bool)
+    generation = index.generation
+    scanned = [("a.jpg", 1.0, 10), ("b.jpg", 2.0, 20), ("c.jpg", 1.0, 10)]
+    modified = index.check_files(scanned, seen)
+    assert modified == ["b.jpg"]
+
+    # ...while another search evicts a row, so seen no longer lines up
+    index.remove(["c.jpg"])
+    assert generation != index.generation
+    assert index.sweep(seen, generation, modified) is False
+
+    # The modified file is re-encoded and its row replaced
+    replacement = unit(1, 1)
+    index.add(modified, replacement)
+    index.row_count()
+    row = index.paths.index("b.jpg")
+    assert index.paths.count("b.jpg") == 1
+    assert (index.mtimes[row], index.sizes[row]) == (2.0, 20)
+    assert torch.allclose(index.embeddings(np.array([row]))[0], replacement[0])
+    assert "b.jpg" not in index._stats
+    assert index.new_paths(scanned[:2]) == []
+
+
+def test_sweep_evicts_unseen_and_modified_rows(tmp_path, monkeypatch):
+    index = make_index(tmp_path, monkeypatch)
+    files = [("a.jpg", 1.0, 10), ("b.jpg", 1.0, 10), ("c.jpg", 1.0, 10)]
+    index.add(index.new_paths(files), unit(3, 0))
+
+    seen = np.zeros(index.row_count(), dtype=bool)
+    generation = index.generation
+    # c.jpg was deleted, b.jpg modified
+    modified = index.check_files([("a.jpg", 1.0, 10), ("b.jpg", 2.0, 20)], seen)
+    assert index.sweep(seen, generation, modified) is True
+    assert index.paths == ["a.jpg"]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_flush_appends_to_tail_and_save_merges_it(tmp_path, monkeypatch, dtype):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    folder = str(tmp_path / "photos")
+    first, second = unit(3, 0), unit(2, 1)
+    index = EmbeddingIndex(folder, dtype, tile_grids=[2])
+    index.add(["a.jpg", "b.jpg", "c.jpg"], first)
+    index.save()
+    base = index.matrix.base
+    assert isinstance(base, np.memmap)
+
+    # New rows go to the tail; the memory-mapped rows are not copied
+    index.add(["d.jpg", "e.jpg"], second)
+    assert index.row_count() == 5
+    assert index.matrix.base is base
+    expected = torch.cat([first, second])
+    tolerance = 0.02 if dtype == "int8" else 1e-6
+    assert torch.allclose(index.embeddings(np.array([4, 0, 3, 2])), expected[[4, 0, 3, 2]], atol=tolerance)
+    scores = torch.cat([block for _, block, _ in index.iter_scores(expected[4], chunk_size=2)])
+    assert torch.allclose(scores, expected @ expected[4], atol=tolerance)
+    assert index.pool_tiles(np.arange(5), scores, expected[4])[0].shape == (5,)
+
+    index.save()
+    reloaded = EmbeddingIndex(folder, dtype, tile_grids=[2])
+    assert reloaded.paths == ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"]
+    assert torch.allclose(reloaded.embeddings(np.arange(5)), expected, atol=tolerance)
+    assert len(reloaded.tiles) == 5
+
+
+def test_eviction_keeps_rows_added_while_it_ran(tmp_path, monkeypatch):
+    index = make_index(tmp_path, monkeypatch)
+    index.add(["a.jpg", "b.jpg"], unit(2, 0))
+    index.row_count()
+
+    # c.jpg is added on the event loop between the flush and the eviction
+    index.add(["c.jpg"], unit(1, 1))
+    index._select([0])
+    assert index.new_paths([("c.jpg", 1.0, 10)]) == []
+    assert index.row_count() == 2
+    assert index.paths == ["a.jpg", "c.jpg"]
+    seen = np.zeros(2, dtype=bool)
+    assert index.check_files([("c.jpg", 0.0, 0)], seen) == []
+    assert seen.tolist() == [False, True]
+
+
+def test_quantize_round_trips_within_precision():
+    block = unit(64, 2).numpy()
+    for dtype, tolerance in [("float32", 1e-7), ("float16", 1e-3), ("int8", 1e-2)]:
+        stored, scales = quantize(block, dtype)
+        assert stored.dtype == np.dtype(dtype)
+        assert (scales is not None) == (dtype == "int8")
+        assert np.abs(dequantize(stored, scales).numpy() - block).max() < tolerance
+
+
+def test_quantize_int8_uses_the_full_range_per_row():
+    block = np.array([[0.5, -0.25, 0.0], [0.0, 0.0, 0.0]], dtype=np.float32)
+    stored, scales = quantize(block, "int8")
+    assert stored[0].tolist() == [127, -64, 0]
+    assert scales[1] == 1.0 and not stored[1].any()
+
+
+@pytest.mark.parametrize("dtype,tolerance", [("float16", 2e-3), ("int8", 2e-2)])
+def test_score_block_matches_float32_scores(dtype, tolerance):
+    rows = unit(256, 3)
+    queries = unit(4, 4)
+    exact = rows @ queries.T
+    stored, scales = quantize(rows.numpy(), dtype)
+    # One query [D] and a query matrix [D, Q]
+    assert torch.allclose(score_block(stored, scales, queries[0]), exact[:, 0], atol=tolerance)
+    scores = score_block(stored, scales, queries.T.contiguous())
+    assert scores.shape == (256, 4)
+    assert torch.allclose(scores, exact, atol=tolerance)
+    # The top matches agree with float32 scoring
+    assert torch.topk(scores[:, 0], 5).indices.tolist()[0] == torch.topk(exact[:, 0], 5).indices.tolist()[0]
+
+
+def test_index_converts_stored_precision_on_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    folder = str(tmp_path / "photos")
+    embeddings = unit(5, 5)
+    index = EmbeddingIndex(folder, "float32", tile_grids=[])
+    index.add([f"{i}.jpg" for i in range(5)], embeddings)
+    index.save()
+
+    converted = EmbeddingIndex(folder, "int8", tile_grids=[])
+    assert converted.matrix.dtype == np.int8 and len(converted.scales) == 5
+    assert torch.allclose(converted.embeddings(np.arange(5)), embeddings, atol=2e-2)
+    converted.save()
+    assert EmbeddingIndex(folder, "int8", tile_grids=[]).matrix.dtype == np.int8
@@ -0,0 +1,16 @@
+import pytest
+from backend.benchmark import make_tree, measure_memory
+from backend.metrics import current_rss
+
+# 20000 rows are a 40 MB float32 matrix: a search that loads the whole
+# matrix, or every score, at once would exceed this
+MAX_GROWTH_MB = 64
+
+
+@pytest.mark.skipif(current_rss() is None, reason="resident set size cannot be read on this platform")
+def test_concurrent_searches_run_in_bounded_memory(tmp_path):
+    folder = make_tree(str(tmp_path / "tree"), 200, 100)
+    run = measure_memory(folder, searches=4, top_k=500, batch_size=32)
+    assert run["images"] == 20000
+    assert run["results"] == [500] * 4
+    assert run["peak_rss_mb"] - run["baseline_rss_mb"] < MAX_GROWTH_MB
@@ -0,0 +1,49 @@
+import asyncio
+import backend.main as main
+from backend.progress import ProgressChannel
+
+
+def test_search_survives_a_reconnect_within_the_grace_period(monkeypatch):
+    monkeypatch.setattr(main, "DISCONNECT_GRACE_SECONDS", 0.05)
+
+    async def listen(search_id: str):
+        events = main.search_progress_generator(search_id)
+        event = await events.__anext__()
+        await events.aclose()
+        return event
+
+    async def run():
+        progress = ProgressChannel(progress=10, status='Searching...')
+        monkeypatch.setitem(main.search_progress, "s1", progress)
+        monkeypatch.setitem(main.running_searches, "s1", progress)
+
+        assert '"progress": 10' in await listen("s1")
+        # The client reconnects before the grace period is over
+        await asyncio.sleep(0.02)
+        events = main.search_progress_generator("s1")
+        await events.__anext__()
+        await asyncio.sleep(0.1)
+        assert not progress.cancelled
+
+        # Once nobody reconnects the search is cancelled
+        await events.aclose()
+        await asyncio.sleep(0.02)
+        assert not progress.cancelled
+        await asyncio.sleep(0.1)
+        assert progress.cancelled
+
+    asyncio.run(run())
+
+
+def test_finished_search_is_not_cancelled_on_disconnect(monkeypatch):
+    monkeypatch.setattr(main, "DISCONNECT_GRACE_SECONDS", 0.01)
+
+    async def run():
+        progress = ProgressChannel(progress=100, done=True, results=[])
+        monkeypatch.setitem(main.search_progress, "s2", progress)
+        events = [event async for event in main.search_progress_generator("s2")]
+        assert '"type": "complete"' in events[-1]
+        await asyncio.sleep(0.05)
+        assert not progress.cancelled
+
+    asyncio.run(run())
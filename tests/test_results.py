@@ -0,0 +1,59 @@
+import sqlite3
+from backend.results import ResultStore, SCHEMA_VERSION
+
+
+def results(count: int):
+    return [
+        {"path": f"/photos/img{i}.jpg", "score": 1 - i / 100, "width": 40, "height": 30,
+         "region": [0, 0, 0.5, 0.5] if i == 0 else None}
+        for i in range(count)
+    ]
+
+
+def test_pages_are_read_back_in_rank_order(tmp_path):
+    store = ResultStore(tmp_path / "results.db")
+    store.save("s1", {"query": "sunset"}, results(25))
+
+    meta, total, page = store.page("s1", 10, 5)
+    assert meta == {"query": "sunset"} and total == 25
+    assert [result["filename"] for result in page] == [f"img{i}.jpg" for i in range(10, 15)]
+    assert page[0]["aspect_ratio"] == 0.75 and page[0]["region"] is None
+
+    _, _, first = store.page("s1", 0, 1)
+    assert first[0]["region"] == [0, 0, 0.5, 0.5]
+    # A negative limit reads to the end; past the end is empty
+    assert len(store.page("s1", 20, -1)[2]) == 5
+    assert store.page("s1", 30, 10)[2] == []
+    assert store.page("unknown") is None
+
+
+def test_saving_again_replaces_the_results(tmp_path):
+    store = ResultStore(tmp_path / "results.db")
+    store.save("s1", {"top_k": 25}, results(25))
+    store.save("s1", {"top_k": 3}, results(3))
+    meta, total, page = store.page("s1", 0, 100)
+    assert meta == {"top_k": 3} and total == 3 and len(page) == 3
+
+
+def test_oldest_searches_expire_beyond_the_limit(tmp_path, monkeypatch):
+    store = ResultStore(tmp_path / "results.db", keep=2)
+    clock = iter(range(100))
+    monkeypatch.setattr("backend.results.time.time", lambda: next(clock))
+    for search_id in ["s1", "s2", "s3"]:
+        store.save(search_id, {}, results(2))
+    assert store.page("s1") is None
+    assert store.page("s2") is not None and store.page("s3") is not None
+    rows = sqlite3.connect(str(tmp_path / "results.db")).execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    assert rows == 4
+
+
+def test_results_of_an_older_schema_are_dropped(tmp_path):
+    path = tmp_path / "results.db"
+    conn = sqlite3.connect(str(path))
+    conn.executescript("CREATE TABLE searches (search_id TEXT); PRAGMA user_version = 1;")
+    conn.close()
+    store = ResultStore(path)
+    assert store.page("s1") is None
+    store.save("s1", {}, results(1))
+    assert store.page("s1")[1] == 1
+    assert sqlite3.connect(str(path)).execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
@@ -0,0 +1,73 @@
+import os
+import shutil
+import asyncio
+from backend.scanner import ListingCache, iter_scan, stream_scan
+
+
+def scan(folder: str, cache: ListingCache = None, reuse: bool = True):
+    return sorted(row for files in iter_scan(folder, cache, reuse) for row in files)
+
+
+def touch_dir(directory, offset_ns: int):
+    """Move a directory's mtime, as adding or removing an entry would"""
+    mtime_ns = os.stat(directory).st_mtime_ns + offset_ns
+    os.utime(directory, ns=(mtime_ns, mtime_ns))
+
+
+def make_tree(root):
+    (root / "a" / "deep").mkdir(parents=True)
+    (root / "b").mkdir()
+    for path in ["top.jpg", "a/one.png", "a/deep/two.JPG", "b/three.jpeg", "b/notes.txt"]:
+        (root / path).write_bytes(b"x")
+    return str(root)
+
+
+def test_scan_lists_supported_images_recursively(tmp_path):
+    folder = make_tree(tmp_path / "photos")
+    names = [os.path.relpath(path, folder) for path, _, _ in scan(folder)]
+    assert names == sorted(os.path.join(*name.split("/")) for name in ["top.jpg", "a/one.png", "a/deep/two.JPG", "b/three.jpeg"])
+    assert sorted(row for files in asyncio.run(collect(folder)) for row in files) == scan(folder)
+
+
+async def collect(folder: str):
+    return [files async for files in stream_scan(folder)]
+
+
+def test_unchanged_directories_come_from_the_cache(tmp_path):
+    folder = make_tree(tmp_path / "photos")
+    cache = ListingCache(tmp_path / "listings.json")
+    first = scan(folder, cache)
+    assert (tmp_path / "listings.json").exists()
+
+    # Rewriting a file in place leaves its directory's mtime alone: the cached row is kept
+    os.utime(os.path.join(folder, "top.jpg"), (1, 1))
+    assert scan(folder, ListingCache(tmp_path / "listings.json")) == first
+    # ...unless the cache is bypassed
+    rescanned = scan(folder, cache, reuse=False)
+    assert (os.path.join(folder, "top.jpg"), 1.0, 1) in rescanned
+
+
+def test_changed_directories_are_listed_again(tmp_path):
+    folder = make_tree(tmp_path / "photos")
+    cache = ListingCache(tmp_path / "listings.json")
+    scan(folder, cache)
+
+    (tmp_path / "photos" / "a" / "new.jpg").write_bytes(b"xy")
+    touch_dir(tmp_path / "photos" / "a", 10 ** 9)
+    paths = [path for path, _, _ in scan(folder, cache)]
+    assert os.path.join(folder, "a", "new.jpg") in paths
+
+    # Listings of removed directories are dropped when the cache is saved
+    shutil.rmtree(tmp_path / "photos" / "b")
+    touch_dir(tmp_path / "photos", 10 ** 9)
+    paths = [path for path, _, _ in scan(folder, cache)]
+    assert not any(path.startswith(os.path.join(folder, "b")) for path in paths)
+    assert os.path.join(folder, "b") not in ListingCache(tmp_path / "listings.json").entries
+
+
+def test_unreadable_cache_starts_empty(tmp_path):
+    (tmp_path / "listings.json").write_text("{not json")
+    cache = ListingCache(tmp_path / "listings.json")
+    assert cache.entries == {}
+    folder = make_tree(tmp_path / "photos")
+    assert len(scan(folder, cache)) == 4
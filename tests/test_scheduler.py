@@ -0,0 +1,93 @@
+import asyncio
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+import backend.index as index_module
+import backend.scheduler as scheduler_module
+from backend.index import EmbeddingIndex
+from backend.scheduler import InferenceScheduler, encode_into_index
+
+
+class FakeModel(torch.nn.Module):
+    """Image encoder that embeds the mean colour of an image"""
+
+    def __init__(self):
+        super().__init__()
+        self.scale = torch.nn.Parameter(torch.ones(1))
+
+    def encode_image(self, inputs: torch.Tensor) -> torch.Tensor:
+        return inputs.mean(dim=(2, 3)) * self.scale + 0.1
+
+
+def preprocess(image: Image.Image) -> torch.Tensor:
+    return torch.from_numpy(np.asarray(image.resize((8, 8)), dtype=np.float32) / 255.0).permute(2, 0, 1)
+
+
+def make_images(folder, count: int):
+    folder.mkdir()
+    paths = []
+    for i in range(count):
+        path = folder / f"img{i}.png"
+        Image.new("RGB", (16, 16), (i * 30, 100, 200 - i * 20)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_waiter_encodes_images_of_a_cancelled_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    paths = make_images(tmp_path / "photos", 8)
+    index = EmbeddingIndex(str(tmp_path / "photos"), "float32", tile_grids=[])
+
+    async def run():
+        scheduler = InferenceScheduler(max_wait=0)
+        monkeypatch.setattr(scheduler_module, "scheduler", scheduler)
+        scheduler.start(FakeModel())
+        scored = []
+
+        # The first search claims every image, the second waits on its futures
+        first = asyncio.ensure_future(encode_into_index(index, paths, preprocess, 4))
+        await asyncio.sleep(0)
+        assert set(index.in_flight) == set(paths)
+        second = asyncio.ensure_future(encode_into_index(
+            index, paths, preprocess, 4, on_batch=lambda valid, embeddings: scored.extend(valid)
+        ))
+        await asyncio.sleep(0)
+
+        # The first search is cancelled before anything is encoded
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await second
+        await scheduler.stop()
+        return scored
+
+    scored = asyncio.run(run())
+    assert sorted(scored) == sorted(paths)
+    assert index.row_count() == 8
+    assert not index.in_flight
+
+
+def test_waiter_gets_embeddings_of_the_other_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    paths = make_images(tmp_path / "photos", 6)
+    (tmp_path / "photos" / "broken.png").write_bytes(b"not an image")
+    paths.append(str(tmp_path / "photos" / "broken.png"))
+    index = EmbeddingIndex(str(tmp_path / "photos"), "float32", tile_grids=[])
+
+    async def run():
+        scheduler = InferenceScheduler(max_wait=0)
+        monkeypatch.setattr(scheduler_module, "scheduler", scheduler)
+        scheduler.start(FakeModel())
+        scored = []
+        first = asyncio.ensure_future(encode_into_index(index, paths, preprocess, 4))
+        await asyncio.sleep(0)
+        second = encode_into_index(index, paths, preprocess, 4, on_batch=lambda valid, embeddings: scored.extend(valid))
+        await asyncio.gather(first, second)
+        await scheduler.stop()
+        return scored
+
+    scored = asyncio.run(run())
+    # The undecodable image is reported as invalid, not encoded again
+    assert sorted(scored) == sorted(paths[:6])
+    assert index.row_count() == 6
@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+import torch
+import torch.nn.functional as F
+import backend.index as index_module
+import backend.main as main
+from backend.index import get_index, scan_folder
+from backend.main import search_key, remember_search, find_reusable_search
+from backend.progress import ProgressChannel
+from backend.results import ResultStore
+
+
+@pytest.fixture
+def key(monkeypatch):
+    monkeypatch.setattr(main, "completed_searches", {})
+    return search_key(["/photos"], "text", "sunset", None, "exact", 8, None)
+
+
+def test_untruncated_search_is_reused_for_any_higher_min_score_or_top_k(key):
+    # 40 results with top_k 500: every match above 0.2 is stored
+    remember_search(key, "s1", 0.2, 500, 40)
+    assert find_reusable_search(key, 0.2, 500) == "s1"
+    assert find_reusable_search(key, 0.5, 10) == "s1"
+    assert find_reusable_search(key, 0.2, 0) == "s1"
+    assert find_reusable_search(key, 0.1, 500) is None
+
+
+def test_truncated_search_is_reused_only_for_the_same_min_score_and_no_larger_k(key):
+    # top_k 100 was reached, so lower-ranked matches were dropped
+    remember_search(key, "s1", 0.2, 100, 100)
+    assert find_reusable_search(key, 0.2, 50) == "s1"
+    assert find_reusable_search(key, 0.2, 100) == "s1"
+    assert find_reusable_search(key, 0.2, 200) is None
+    assert find_reusable_search(key, 0.2, 0) is None
+    assert find_reusable_search(key, 0.3, 50) is None
+
+
+def test_other_queries_and_expired_searches_are_not_reused(key, monkeypatch):
+    remember_search(key, "s1", 0.0, 500, 10)
+    assert find_reusable_search(search_key(["/photos"], "text", "beach", None, "exact", 8, None), 0.0, 500) is None
+    monkeypatch.setattr(main, "RESULT_REUSE_SECONDS", -1)
+    assert find_reusable_search(key, 0.0, 500) is None
+
+
+def test_key_ignores_root_order_and_nprobe_of_exact_searches():
+    assert search_key(["/b", "/a"], "text", "x", None, "exact", 8, None) == \
+        search_key(["/a", "/b"], "text", "x", None, "exact", 16, "")
+    assert search_key(["/a"], "text", "x", None, "ann", 8, None) != search_key(["/a"], "text", "x", None, "ann", 16, None)
+    assert search_key(["/a"], "image", "x", "/q.jpg", "exact", 8, None)[2] == "/q.jpg"
+
+
+def test_normalize_roots_drops_duplicates_and_nested_roots(tmp_path):
+    photos = str(tmp_path / "photos")
+    assert main.normalize_roots([
+        photos, photos + "/2024", f" {photos} ", str(tmp_path / "photos-old"), str(tmp_path / "photos/../photos"), ""
+    ]) == [photos, str(tmp_path / "photos-old")]
+
+
+def test_normalize_roots_makes_paths_absolute(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert main.normalize_roots(["b", "a", "a/x"]) == [str(tmp_path / "a"), str(tmp_path / "b")]
+
+
+def test_search_merges_the_top_k_of_every_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    monkeypatch.setattr(index_module, "_indexes", {})
+    monkeypatch.setattr(index_module, "_listings", {})
+    monkeypatch.setattr(main, "result_store", ResultStore(tmp_path / "results.db"))
+    monkeypatch.setattr(main, "SETTINGS_FILE", str(tmp_path / "settings.json"))
+    monkeypatch.setattr(main, "completed_searches", {})
+
+    # Empty files with their embeddings put straight into each root's index
+    embeddings = {}
+    for number, root in enumerate(["a", "b"]):
+        (tmp_path / root).mkdir()
+        for i in range(4):
+            (tmp_path / root / f"img{i}.jpg").write_bytes(b"")
+        index = get_index(str(tmp_path / root))
+        paths = index.new_paths(scan_folder(index.folder))
+        vectors = F.normalize(torch.randn(len(paths), 8, generator=torch.Generator().manual_seed(number)), dim=1)
+        index.add(paths, vectors)
+        index.save()
+        embeddings.update(zip(paths, vectors))
+    best = str(tmp_path / "b" / "img2.jpg")
+
+    async def run():
+        main.search_progress["s1"] = ProgressChannel({'progress': 0})
+        await main.process_search(
+            "s1", [str(tmp_path / "a"), str(tmp_path / "b")], embeddings[best], None, None,
+            0.0, 8, "image", query_path=best, top_k=5
+        )
+        return main.search_progress.pop("s1")
+
+    progress = asyncio.run(run())
+    assert progress.get('error') is None and progress['result_count'] == 5
+    results = main.result_store.page("s1", 0, 10)[2]
+    scores = {path: (embedding @ embeddings[best]).item() for path, embedding in embeddings.items()}
+    expected = sorted(scores, key=scores.get, reverse=True)[:5]
+    assert [result["path"] for result in results] == expected
+    assert results[0]["path"] == best
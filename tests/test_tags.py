@@ -0,0 +1,75 @@
+import pytest
+import torch
+import backend.index as index_module
+from backend.index import EmbeddingIndex
+from backend.tags import TagStore
+
+LABELS = ["landscape photo", "sunset scene", "night scene", "people", "animals", "water"]
+
+TAGS = {
+    "beach.jpg": ["landscape photo", "sunset scene", "water"],
+    "harbour.jpg": ["landscape photo", "night scene", "water"],
+    "party.jpg": ["people", "night scene"],
+    "dog.jpg": ["animals", "landscape photo"],
+    "portrait.jpg": ["people"],
+}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_module, "INDEX_ROOT", tmp_path / "index")
+    store = TagStore(str(tmp_path / "photos"))
+    store.labels = list(LABELS)
+    store.tags = {path: [(LABELS.index(label), 0.5) for label in labels] for path, labels in TAGS.items()}
+    store._build_postings()
+    return store
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("water", {"beach.jpg", "harbour.jpg"}),
+    ("landscape AND sunset", {"beach.jpg"}),
+    ("people OR animals", {"party.jpg", "portrait.jpg", "dog.jpg"}),
+    ("water AND NOT night", {"beach.jpg"}),
+    ("NOT landscape", {"party.jpg", "portrait.jpg"}),
+    # AND binds tighter than OR
+    ("animals OR landscape AND night", {"dog.jpg", "harbour.jpg"}),
+    ("people and not night or sunset", {"portrait.jpg", "beach.jpg"}),
+    ("scene AND water", {"beach.jpg", "harbour.jpg"}),
+    ("mountains", set()),
+])
+def test_lookup_combines_terms(store, expression, expected):
+    assert store.lookup(expression) == expected
+
+
+def test_exact_label_wins_over_substring_matches(store):
+    store.labels.append("people outdoors")
+    store.tags["hike.jpg"] = [(len(store.labels) - 1, 0.5)]
+    store._build_postings()
+    assert store.lookup("people") == {"party.jpg", "portrait.jpg"}
+    assert store.lookup("people outdoors") == {"hike.jpg"}
+    assert store.lookup("peop") == {"party.jpg", "portrait.jpg", "hike.jpg"}
+
+
+def test_tags_are_persisted(store, tmp_path):
+    store.save()
+    reloaded = TagStore(str(tmp_path / "photos"))
+    assert reloaded.label_counts() == store.label_counts()
+    assert reloaded.lookup("water AND NOT night") == {"beach.jpg"}
+    assert reloaded.image_tags("party.jpg") == [("people", 0.5), ("night scene", 0.5)]
+
+
+def test_tag_index_keeps_likely_labels(store):
+    # Every image sits on one label's axis
+    index = EmbeddingIndex(store.folder, "float32", tile_grids=[])
+    files = [("a.jpg", 1.0, 10), ("b.jpg", 1.0, 10), ("c.jpg", 1.0, 10)]
+    index.add(index.new_paths(files), torch.eye(len(LABELS))[[0, 3, 5]])
+    counts = store.tag_index(index, LABELS, torch.eye(len(LABELS)), per_image=3, min_score=0.5)
+    assert counts["landscape photo"] == counts["people"] == counts["water"] == 1
+    assert store.lookup("people OR water") == {"b.jpg", "c.jpg"}
+
+    # Retagging one image keeps the tags of the others
+    index.remove(["b.jpg"])
+    index.add(["b.jpg"], torch.eye(len(LABELS))[[4]])
+    store.tag_index(index, LABELS, torch.eye(len(LABELS)), per_image=3, min_score=0.5, paths=["b.jpg"])
+    assert store.lookup("animals") == {"b.jpg"}
+    assert store.lookup("landscape OR water") == {"a.jpg", "c.jpg"}
@@ -0,0 +1,38 @@
+import torch
+from backend.topk import TopK
+
+
+def push_in_batches(top: TopK, scores: torch.Tensor, batch: int):
+    for start in range(0, len(scores), batch):
+        block = scores[start:start + batch]
+        rows = top.candidates(block)
+        top.push(block[rows], [start + row for row in rows.tolist()])
+
+
+def test_running_top_k_matches_a_full_sort():
+    scores = torch.rand(1000, generator=torch.Generator().manual_seed(0))
+    top = TopK(10)
+    push_in_batches(top, scores, 64)
+    values, indices = torch.topk(scores, 10)
+    assert [item for _, item in top.results()] == indices.tolist()
+    assert [score for score, _ in top.results()] == values.tolist()
+
+
+def test_zero_k_keeps_every_item_in_score_order():
+    top = TopK(0)
+    top.push(torch.tensor([0.2, 0.9]), ["b", "a"])
+    top.push(torch.tensor([0.5]), ["c"])
+    assert [item for _, item in top.results()] == ["a", "c", "b"]
+    assert top.threshold == float("-inf")
+
+
+def test_threshold_and_candidates_once_full():
+    top = TopK(2)
+    assert top.threshold == float("-inf")
+    top.push(torch.tensor([0.3, 0.8, 0.5]), ["a", "b", "c"])
+    assert len(top) == 2
+    assert top.threshold == 0.5
+    # Only scores above the current minimum can still enter, at most k of them
+    assert top.candidates(torch.tensor([0.4, 0.6, 0.9, 0.7])).tolist() == [2, 3]
+    top.push(torch.tensor([]), [])
+    assert len(top) == 2